@@ -265,7 +265,14 @@ AC_DEFUN([_AX_BOOST_CHECK_LIB_],[
             AC_CHECK_LIB($ax_lib, exit,
                         [$3="-l$ax_lib"; AC_SUBST($3) link_ok="yes"; break])
 	done
-    fi		    
+	dnl Not there (a multiarch lib dir, say): see if the linker finds it on its own
+	if test "$link_ok" != "yes"; then
+	    for ax_lib in $1 $1-mt; do
+		AC_CHECK_LIB($ax_lib, exit,
+                             [$3="-l$ax_lib"; AC_SUBST($3) link_ok="yes"; break])
+	    done
+	fi
+    fi
 		    		    
     if test "$link_ok" != "yes"; then
     	AC_MSG_ERROR([Could not link against lib[$1]!])
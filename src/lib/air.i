@@ -25,6 +25,10 @@ class air_modes_preamble : public gr_sync_block
 {
 private:
   air_modes_preamble (int channel_rate, float threshold_db);
+public:
+  unsigned long num_preambles() const;
+  void set_nthreads(int nthreads);
+  int nthreads() const;
 };
 
 GR_SWIG_BLOCK_MAGIC(air,modes_slicer);
@@ -35,6 +39,14 @@ class air_modes_slicer : public gr_block
 {
 private:
 	air_modes_slicer (int channel_rate, gr_msg_queue_sptr queue);
+public:
+	unsigned long num_sliced() const;
+	unsigned long num_passed() const;
+	unsigned long num_corrected(int nbits) const;
+	void set_error_correction(int nbits);
+	int error_correction() const;
+	void set_start_time(double secs);
+	double start_time() const;
 };
 
 // ----------------------------------------------------------------
@@ -25,9 +25,12 @@
 #endif
 
 #include <air_modes_preamble.h>
+#include <modes_preamble_scan.h>
 #include <gr_io_signature.h>
+#include <gr_tag_info.h>
 #include <string.h>
 #include <iostream>
+#include <algorithm>
 
 air_modes_preamble_sptr air_make_modes_preamble(int channel_rate, float threshold_db)
 {
@@ -52,7 +55,36 @@ air_modes_preamble::air_modes_preamble(int channel_rate, float threshold_db) :
 	str << name() << unique_id();
 	d_me = pmt::pmt_string_to_symbol(str.str());
 	d_key = pmt::pmt_string_to_symbol("preamble_found");
+	d_time_key = pmt::pmt_string_to_symbol("rx_time");
+	d_time = pmt::PMT_NIL;
+	d_num_preambles = 0;
+	d_nthreads = 1;
 	set_history(d_check_width);
+
+	//we only put out samples around preambles, so tags on the input don't line
+	//up with anything on the output. the time ones go out in our own tags instead.
+	set_tag_propagation_policy(TPP_DONT);
+}
+
+static bool tag_before(pmt::pmt_t x, pmt::pmt_t y)
+{
+	return gr_tags::get_nitems(x) < gr_tags::get_nitems(y);
+}
+
+//move d_time up to the last rx_time tag before sample upto. the source (UHD)
+//tags the first sample and any after an overflow with the time it was taken.
+void air_modes_preamble::update_time(const std::vector<pmt::pmt_t> &tags,
+                                     std::vector<pmt::pmt_t>::const_iterator &next, uint64_t upto)
+{
+	for(; next != tags.end() && gr_tags::get_nitems(*next) < upto; next++) {
+		uint64_t sample = gr_tags::get_nitems(*next);
+		if(pmt::pmt_is_tuple(d_time) && sample <= pmt::pmt_to_uint64(pmt::pmt_tuple_ref(d_time, 2)))
+			continue; //seen it already, we went over it again as history
+		pmt::pmt_t value = gr_tags::get_value(*next);
+		d_time = pmt::pmt_make_tuple(pmt::pmt_tuple_ref(value, 0), //whole seconds
+		                             pmt::pmt_tuple_ref(value, 1), //fractional seconds
+		                             pmt::pmt_from_uint64(sample));
+	}
 }
 
 static void integrate_and_dump(float *out, const float *in, int chips, int samps_per_chip) {
@@ -65,18 +97,6 @@ static void integrate_and_dump(float *out, const float *in, int chips, int samps
 	}
 }
 
-//the preamble pattern in bits
-//fixme goes in .h
-static const bool preamble_bits[] = {1, 0, 1, 0, 0, 0, 0, 1, 0, 1};
-static double correlate_preamble(const float *in, int samples_per_chip) {
-	double corr = 0.0;
-	for(int i=0; i<10; i++) {
-		for(int j=0; j<samples_per_chip;j++)
-			if(preamble_bits[i]) corr += in[i*samples_per_chip+j];
-	}
-	return corr;
-}
-
 int air_modes_preamble::general_work(int noutput_items,
 						  gr_vector_int &ninput_items,
                           gr_vector_const_void_star &input_items,
@@ -87,83 +107,71 @@ int air_modes_preamble::general_work(int noutput_items,
 	const int ninputs = std::min(ninput_items[0], ninput_items[1]); //just in case
 	float *out = (float *) output_items[0];
 
-	//fixme move into .h
-	const int pulse_offsets[4] = {    0,
-	                              int(2 * d_samples_per_chip),
-	                              int(7 * d_samples_per_chip),
-	                              int(9 * d_samples_per_chip)
-	                             };
-
-	uint64_t abs_out_sample_cnt = nitems_written(0);
-
-	for(int i=0; i < ninputs; i++) {
-		float pulse_threshold = inavg[i] * d_threshold;
-		if(in[i] > pulse_threshold) { //hey we got a candidate
-			if(in[i+1] > in[i]) continue; //wait for the peak
-			//check to see the rest of the pulses are there
-			if( in[i+pulse_offsets[1]] < pulse_threshold ) continue;
-			if( in[i+pulse_offsets[2]] < pulse_threshold ) continue;
-			if( in[i+pulse_offsets[3]] < pulse_threshold ) continue;
-
-			//get a more accurate bit center by finding the correlation peak across all four preamble bits
-			bool late = false;
-			do {
-				double now_corr = correlate_preamble(in+i, d_samples_per_chip);
-				double late_corr = correlate_preamble(in+i+1, d_samples_per_chip);
-				late = (late_corr > now_corr);
-				if(late) i++;
-			} while(late);
-
-			//now check to see that the rest of the chips in the preamble
-			//are below the peaks by threshold dB
-			float avgpeak = ( in[i+pulse_offsets[0]]
-			                + in[i+pulse_offsets[1]]
-			                + in[i+pulse_offsets[2]]
-			                + in[i+pulse_offsets[3]]) / 4.0;
-
-			float space_threshold = inavg[i] + (avgpeak - inavg[i])/d_threshold;
-			bool valid_preamble = true; //f'in c++
-			for( int j=1.5*d_samples_per_symbol; j<=3*d_samples_per_symbol; j++)
-				if(in[i+j] > space_threshold) valid_preamble = false;
-			for( int j=5*d_samples_per_symbol; j<=7.5*d_samples_per_symbol; j++)
-				if(in[i+j] > space_threshold) valid_preamble = false;
-			if(!valid_preamble) continue;
-
-			//be sure we've got enough room in the input buffer to copy out a whole packet
-			if(ninputs-i < 240*d_samples_per_chip) {
-				consume_each(i-1);
-				return 0;
-			}
+	const int packet_length = 240*d_samples_per_chip;
+
+	std::vector<modes_preamble_candidate> candidates;
+	modes_find_preambles_threaded(in, inavg, ninputs, d_samples_per_chip, d_threshold, d_nthreads, candidates);
+
+	//in[] starts history()-1 samples before nitems_read(0); this is the absolute
+	//sample number of in[0], which the slicer turns into a time for each packet.
+	//on the first call in[0] is before the start of the stream and this wraps,
+	//which comes right again once i is added.
+	const uint64_t abs_sample_cnt = nitems_read(0) - (history() - 1);
+	const uint64_t tags_from = (nitems_read(0) < history() - 1) ? 0 : abs_sample_cnt;
+	std::vector<pmt::pmt_t> time_tags;
+	get_tags_in_range(time_tags, 0, tags_from, abs_sample_cnt + ninputs, d_time_key);
+	std::sort(time_tags.begin(), time_tags.end(), tag_before);
+	std::vector<pmt::pmt_t>::const_iterator next_time = time_tags.begin();
+
+	//now go through them in order and put out every one we have room for.
+	//a preamble inside the packet we just put out is skipped, same as
+	//the scan used to jump over the packet body.
+	int nout = 0;
+	int next_free = 0; //first sample past the last packet we put out
+	int consumed = ninputs;
+	std::vector<modes_preamble_candidate>::iterator cand;
+	for(cand = candidates.begin(); cand != candidates.end(); cand++) {
+		int i = cand->index;
+		if(i < next_free) continue;
+
+		//be sure we've got enough room in the input buffer to copy out a whole packet,
+		//and in the output buffer to put it. if not, leave it for the next call.
+		if(ninputs-i < packet_length || nout+240 > noutput_items) {
+			consumed = std::max(i-1, next_free);
+			break;
+		}
 
-			//all right i'm prepared to call this a preamble			
-			//let's integrate and dump the output
-			//FIXME: disable and use center sample
-			bool life_sucks = true;
-			if(life_sucks) {
-				for(int j=0; j<240; j++) {
-					out[j] = in[i+j*d_samples_per_chip];
-				}
-			} else {
-				i -= d_samples_per_chip-1;
-				integrate_and_dump(out, &in[i], 240, d_samples_per_chip);
+		//all right i'm prepared to call this a preamble
+		//let's integrate and dump the output
+		//FIXME: disable and use center sample
+		bool life_sucks = true;
+		if(life_sucks) {
+			for(int j=0; j<240; j++) {
+				out[nout+j] = in[i+j*d_samples_per_chip];
 			}
-
-			//now tag the preamble
-			add_item_tag(0, //stream ID
-					 nitems_written(0), //sample
-					 d_key,      //frame_info
-			         pmt::pmt_from_double((double) space_threshold),
-			         d_me        //block src id
-			        );
-			//std::cout << "PREAMBLE" << std::endl;
-			
-			//produce only one output per work call
-			consume_each(i+240*d_samples_per_chip);
-			return 240;
+		} else {
+			integrate_and_dump(&out[nout], &in[i-d_samples_per_chip+1], 240, d_samples_per_chip);
 		}
+
+		//now tag the preamble with where it was in the input stream, and the
+		//time reference that goes with that
+		update_time(time_tags, next_time, abs_sample_cnt + i + 1);
+		add_item_tag(0, //stream ID
+				 nitems_written(0)+nout, //sample
+				 d_key,      //frame_info
+		         pmt::pmt_make_tuple(pmt::pmt_from_double((double) cand->space_threshold),
+		                             pmt::pmt_from_uint64(abs_sample_cnt + i),
+		                             d_time),
+		         d_me        //block src id
+		        );
+		//std::cout << "PREAMBLE" << std::endl;
+		d_num_preambles++;
+
+		nout += 240;
+		next_free = i + packet_length;
 	}
-	
-	//didn't get anything this time
-	consume_each(ninputs);
-	return 0;
+
+	consume_each(std::max(consumed, next_free));
+	update_time(time_tags, next_time, abs_sample_cnt + std::max(consumed, next_free));
+	return nout;
 }
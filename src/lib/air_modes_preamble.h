@@ -24,6 +24,7 @@
 #define INCLUDED_AIR_MODES_PREAMBLE_H
 
 #include <gr_block.h>
+#include <vector>
 
 class air_modes_preamble;
 typedef boost::shared_ptr<air_modes_preamble> air_modes_preamble_sptr;
@@ -47,9 +48,18 @@ private:
 	int d_samples_per_symbol;
 	float d_threshold_db;
 	float d_threshold;
-	pmt::pmt_t d_me, d_key;
+	pmt::pmt_t d_me, d_key, d_time_key;
+	unsigned long d_num_preambles;
+	int d_nthreads;
+	pmt::pmt_t d_time; //the last rx_time we've seen, as (secs, frac, sample), or PMT_NIL
+
+	void update_time(const std::vector<pmt::pmt_t> &tags, std::vector<pmt::pmt_t>::const_iterator &next, uint64_t upto);
 
 public:
+    unsigned long num_preambles() const { return d_num_preambles; } //how many preambles have been found so far
+    void set_nthreads(int nthreads) { d_nthreads = std::max(1, nthreads); } //split the search across this many threads
+    int nthreads() const { return d_nthreads; }
+
     int general_work (int noutput_items,
               gr_vector_int &ninput_items,
               gr_vector_const_void_star &input_items,
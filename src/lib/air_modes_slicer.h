@@ -45,12 +45,25 @@ private:
     int d_chip_rate;
     int d_samples_per_chip;
     int d_samples_per_symbol;
+    int d_channel_rate;
     double d_secs_per_sample;
+    uint64_t d_start_secs; //the time of the first sample, for sources that don't tag it
+    double d_start_frac;
     gr_msg_queue_sptr d_queue;
-    std::ostringstream d_payload;
-    pmt::pmt_t d_timestamp;
+    unsigned long d_num_sliced;
+    unsigned long d_num_passed;
+    unsigned long d_num_corrected[2]; //one-bit and two-bit fixes
+    int d_ec_bits;
 
 public:
+    unsigned long num_sliced() const { return d_num_sliced; } //how many packets have been sliced
+    unsigned long num_passed() const { return d_num_passed; } //how many made it through the checks and onto the queue
+    unsigned long num_corrected(int nbits) const { return (nbits == 1 || nbits == 2) ? d_num_corrected[nbits-1] : 0; } //how many of those needed nbits (1 or 2) fixed
+    void set_error_correction(int nbits) { d_ec_bits = std::max(0, std::min(2, nbits)); } //fix up to this many bad bits in DF11/17, 0 for none
+    int error_correction() const { return d_ec_bits; }
+    void set_start_time(double secs); //time of the first sample if the source doesn't send rx_time, say for a file
+    double start_time() const { return d_start_secs + d_start_frac; }
+
     int work (int noutput_items,
               gr_vector_const_void_star &input_items,
               gr_vector_void_star &output_items);
@@ -23,6 +23,8 @@
 #ifndef AIR_MODES_TYPES_H
 #define AIR_MODES_TYPES_H
 
+#include <stdint.h>
+
 typedef enum { No_Packet = 0, Short_Packet = 1, Fruited_Packet = 2, Long_Packet = 3 } framer_packet_type;
 typedef enum { No_Error = 0, Solution_Found, Too_Many_LCBs, No_Solution, Multiple_Solutions } bruteResultTypeDef;
 
@@ -36,9 +38,26 @@ struct modes_packet {
 	framer_packet_type type; //what length packet are we
 	unsigned int message_type;
 	float reference_level;
-	double timestamp;
+	uint64_t timestamp_secs; //when the preamble started: whole seconds since the epoch,
+	double timestamp_frac;   //and the fraction of a second after that
 };
 
+//fixed-layout frame record handed to python through the message queue.
+//this is what the slicer puts in each gr_message; keep it in sync with
+//the struct format in modes_frame.py.
+struct modes_frame_record {
+	unsigned char data[14]; //raw packet bytes, zero-padded for short packets
+	unsigned char message_type; //downlink format
+	unsigned char type; //framer_packet_type, tells python how long the packet is
+	unsigned int parity; //syndrome from modes_check_parity
+	float reference_level;
+	uint64_t timestamp_secs; //split like this so a double doesn't lose the nanoseconds
+	double timestamp_frac;
+} __attribute__((packed));
+
+//"=14sBBIfQd" is 40 bytes; this won't compile if the struct comes out any other size
+typedef char modes_frame_record_is_40_bytes[sizeof(modes_frame_record) == 40 ? 1 : -1];
+
 struct slice_result_t {
 	bool decision;
 	bool confidence;
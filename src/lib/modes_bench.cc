@@ -0,0 +1,211 @@
+/*
+# Copyright 2010 Nick Foster
+# 
+# This file is part of gr-air-modes
+# 
+# gr-air-modes is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+# 
+# gr-air-modes is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with gr-air-modes; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+# 
+*/
+
+//microbenchmarks for the hot loops in the receive chain (preamble search,
+//slicer and parity check). not installed.
+//
+//  modes_bench [file [channel_rate]]
+//
+//with no file it makes up a few seconds of noisy traffic at 4Msps; give it
+//a file of complex floats (like modes_iqgen.py writes) to use real data.
+
+#ifdef HAVE_CONFIG_H
+#include "config.h"
+#endif
+
+#include <modes_preamble_scan.h>
+#include <modes_slice.h>
+#include <modes_parity.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <math.h>
+#include <sys/time.h>
+#include <vector>
+
+static double now()
+{
+	struct timeval tv;
+	gettimeofday(&tv, NULL);
+	return tv.tv_sec + tv.tv_usec * 1e-6;
+}
+
+static double gaussian()
+{
+	double u1 = (rand() + 1.0) / (RAND_MAX + 2.0);
+	double u2 = (rand() + 1.0) / (RAND_MAX + 2.0);
+	return sqrt(-2.0 * log(u1)) * cos(2.0 * M_PI * u2);
+}
+
+//magnitudes of complex noise with unit power, with a pulse-position
+//modulated packet of random bits dropped in every so often
+static void make_traffic(std::vector<float> &mag, int nsamples, int samples_per_chip)
+{
+	mag.resize(nsamples);
+	for(int i=0; i < nsamples; i++) {
+		double re = gaussian() * sqrt(0.5), im = gaussian() * sqrt(0.5);
+		mag[i] = sqrt(re*re + im*im);
+	}
+
+	static const int preamble_chips[] = {0, 2, 7, 9};
+	int i = 0;
+	while(1) {
+		i += 500 + rand() % 4000;
+		int nbits = (rand() % 2) ? 112 : 56;
+		if(i + (16 + 2*nbits) * samples_per_chip >= nsamples) break;
+		float amplitude = pow(10.0, (6 + rand() % 20) / 20.0);
+		std::vector<int> chips;
+		for(int c=0; c < 4; c++) chips.push_back(preamble_chips[c]);
+		for(int b=0; b < nbits; b++) chips.push_back(16 + 2*b + (rand() % 2));
+		for(unsigned int c=0; c < chips.size(); c++)
+			for(int s=0; s < samples_per_chip; s++)
+				mag[i + chips[c]*samples_per_chip + s] += amplitude;
+	}
+}
+
+static void read_traffic(std::vector<float> &mag, const char *filename)
+{
+	FILE *fp = fopen(filename, "rb");
+	if(!fp) {
+		perror(filename);
+		exit(1);
+	}
+	float iq[2*4096];
+	size_t n;
+	while((n = fread(iq, 2*sizeof(float), 4096, fp)) > 0)
+		for(size_t i=0; i < n; i++)
+			mag.push_back(sqrt(iq[2*i]*iq[2*i] + iq[2*i+1]*iq[2*i+1]));
+	fclose(fp);
+}
+
+typedef void (*scan_fn)(const float *, const float *, int, int, int, int, int, float,
+                        std::vector<modes_preamble_candidate> &);
+
+static double time_scan(scan_fn scan, const std::vector<float> &mag, const std::vector<float> &avg,
+                        int nsamples, int samples_per_chip, float threshold,
+                        std::vector<modes_preamble_candidate> &found)
+{
+	int reps = 0;
+	double start = now(), elapsed;
+	do {
+		found.clear();
+		scan(&mag[0], &avg[0], 0, nsamples, 0, nsamples, samples_per_chip, threshold, found);
+		reps++;
+		elapsed = now() - start;
+	} while(elapsed < 1.0);
+	return elapsed * 1e9 / (double(reps) * nsamples);
+}
+
+static void bench_preamble(const std::vector<float> &mag, int samples_per_chip)
+{
+	//same as the moving average in uhd_modes.py
+	std::vector<float> avg(mag.size());
+	double acc = 0;
+	for(unsigned int i=0; i < mag.size(); i++) {
+		acc += mag[i];
+		if(i >= 100) acc -= mag[i-100];
+		avg[i] = acc / 100.0;
+	}
+
+	int nsamples = mag.size() - 240*samples_per_chip; //leave room for the lookahead
+	float threshold = powf(10., 3.0/10.);
+
+	std::vector<modes_preamble_candidate> scalar, bulk;
+	double scalar_ns = time_scan(modes_find_preambles_scalar, mag, avg, nsamples, samples_per_chip, threshold, scalar);
+	double bulk_ns = time_scan(modes_find_preambles, mag, avg, nsamples, samples_per_chip, threshold, bulk);
+
+	bool same = (scalar.size() == bulk.size());
+	for(unsigned int i=0; same && i < scalar.size(); i++)
+		same = (scalar[i].index == bulk[i].index);
+
+	printf("preamble search, %i samples, %u preambles\n", nsamples, (unsigned int) scalar.size());
+	printf("  one sample at a time: %.2f ns/sample\n", scalar_ns);
+	printf("  eight at a time:      %.2f ns/sample (%.1fx)\n", bulk_ns, scalar_ns / bulk_ns);
+	if(!same) printf("  the two searches DISAGREE\n");
+}
+
+//preamble detector output for npackets packets of random bits, one sample
+//per chip, 240 samples to a packet. the first five bits are always 17 for
+//long packets and never 17 for short ones.
+static void make_packets(std::vector<float> &chips, int npackets, bool long_packets)
+{
+	static const int preamble_chips[] = {0, 2, 7, 9};
+	chips.assign(240*npackets, 0);
+	for(int p=0; p < npackets; p++) {
+		float *packet = &chips[240*p];
+		for(int c=0; c < 240; c++) packet[c] = fabs(gaussian()) * 0.1;
+		for(int c=0; c < 4; c++) packet[preamble_chips[c]] += 1.0;
+
+		int df = long_packets ? 17 : (rand() % 31);
+		if(df == 17) df = 11;
+		for(int b=0; b < 112; b++) {
+			int bit = (b < 5) ? ((df >> (4-b)) & 1) : (rand() % 2);
+			packet[16 + 2*b + (bit ? 0 : 1)] += 1.0;
+		}
+	}
+}
+
+static void bench_slicer(bool long_packets)
+{
+	const int npackets = 10000;
+	std::vector<float> chips;
+	make_packets(chips, npackets, long_packets);
+
+	modes_packet rx_packet;
+	unsigned int check = 0; //so the compiler can't throw the work away
+	long sliced = 0;
+	double start = now(), elapsed;
+	do {
+		for(int p=0; p < npackets; p++) {
+			modes_slice_packet(&chips[240*p], rx_packet);
+			check ^= modes_check_parity(rx_packet.data, (rx_packet.type == Short_Packet) ? 56 : 112);
+		}
+		sliced += npackets;
+		elapsed = now() - start;
+	} while(elapsed < 1.0);
+
+	printf("  %s packets: %.0f frames/sec (%.0f ns/frame) [%x]\n", long_packets ? "long" : "short",
+	       sliced / elapsed, elapsed * 1e9 / sliced, check & 0xF);
+}
+
+int main(int argc, char **argv)
+{
+	int channel_rate = 4000000;
+	std::vector<float> mag;
+
+	if(argc > 2) channel_rate = atoi(argv[2]);
+	int samples_per_chip = channel_rate / 2000000;
+
+	if(argc > 1) read_traffic(mag, argv[1]);
+	else {
+		srand(1090);
+		make_traffic(mag, 4*channel_rate, samples_per_chip);
+	}
+	mag.resize(mag.size() + 240*samples_per_chip, 0); //padding for the lookahead
+
+	bench_preamble(mag, samples_per_chip);
+
+	printf("slicer, slicing and parity\n");
+	bench_slicer(false);
+	bench_slicer(true);
+
+	return 0;
+}
@@ -30,6 +30,7 @@
 #include <modes_parity.h>
 #include <math.h>
 #include <stdlib.h>
+#include <boost/unordered_map.hpp>
 
 /*  Mode S Parity Table
  *   Index is bit position with bit 0 being the first bit after preamble
@@ -150,29 +151,101 @@ const unsigned int modes_parity_table[112] =
     0x000002,
     0x000001,
 };
-int modes_check_parity(unsigned char data[], int length)
-{
-	int short_crc, long_crc, i;
-	// Check both long and short
-	short_crc = 0;
-	long_crc = 0;
-	for(i = 0; i < 56; i++)
-	{
-		if(data[i/8] & (1 << (7-(i%8))))
-		{
-			short_crc ^= modes_parity_table[i+56];
-			long_crc ^= modes_parity_table[i];
+//the same CRC a byte at a time. entry n is the CRC of the byte n.
+//modes_parity_table above is still what you want for working out which
+//bit an error syndrome points at.
+static const unsigned int modes_crc_poly = 0xFFF409;
+static unsigned int modes_crc_table[256];
 
+static bool modes_crc_init()
+{
+	for(unsigned int n=0; n < 256; n++) {
+		unsigned int crc = n << 16;
+		for(int i=0; i < 8; i++) {
+			if(crc & 0x800000) crc = ((crc << 1) ^ modes_crc_poly) & 0xFFFFFF;
+			else crc = (crc << 1) & 0xFFFFFF;
 		}
+		modes_crc_table[n] = crc;
 	}
-	for( ; i < length; i++)
-	{
-		if(data[i/8] & (1 << (7-(i%8))))
-		{
-			long_crc ^= modes_parity_table[i];
+	return true;
+}
+static const bool modes_crc_ready = modes_crc_init();
+
+//CRC of the first nbytes of data
+unsigned int modes_crc(const unsigned char data[], int nbytes)
+{
+	unsigned int crc = 0;
+	for(int i=0; i < nbytes; i++)
+		crc = ((crc << 8) & 0xFFFFFF) ^ modes_crc_table[((crc >> 16) ^ data[i]) & 0xFF];
+	return crc;
+}
+
+//returns the CRC of the packet XORed with its parity field, which is 0 for
+//a good DF11/DF17 and the transponder address for a good DF0/4/5/20/21.
+int modes_check_parity(unsigned char data[], int length)
+{
+	const int nbytes = length / 8;
+	unsigned int parity = (data[nbytes-3] << 16) | (data[nbytes-2] << 8) | data[nbytes-1];
+	return modes_crc(data, nbytes-3) ^ parity;
+}
+
+//error correction by syndrome lookup. flipping bit n of a packet changes
+//its syndrome by modes_parity_table[n] (offset by 56 for short packets), so
+//we precompute the syndrome of every one-bit and two-bit error and look the
+//packet's syndrome up. none of them collide, so a hit means exactly one fix.
+//the first five bits (the DF) are left alone: an error there would have
+//changed how long we thought the packet was in the first place.
+struct modes_ec_fix {
+	unsigned char bits[2];
+	unsigned char nbits;
+};
+typedef boost::unordered_map<unsigned int, modes_ec_fix> modes_ec_table;
+
+static modes_ec_table modes_ec_tables[2]; //short, long
+
+static bool modes_ec_init()
+{
+	for(int t=0; t < 2; t++) {
+		const int length = t ? 112 : 56;
+		const unsigned int *syndromes = &modes_parity_table[112 - length];
+		modes_ec_table &table = modes_ec_tables[t];
+		for(int a=5; a < length; a++) {
+			modes_ec_fix fix;
+			fix.bits[0] = a;
+			fix.bits[1] = 0;
+			fix.nbits = 1;
+			table[syndromes[a]] = fix;
+			for(int b=a+1; b < length; b++) {
+				fix.bits[1] = b;
+				fix.nbits = 2;
+				table[syndromes[a] ^ syndromes[b]] = fix;
+			}
 		}
 	}
-	if(length == 112) return long_crc;
-	else return short_crc;
+	return true;
 }
+static const bool modes_ec_ready = modes_ec_init();
 
+//tries to fix the packet's nonzero parity syndrome by flipping one bit, or
+//if max_bits is 2, two bits that the slicer flagged as low confidence.
+//returns the number of bits flipped, or 0 if it couldn't be fixed.
+int modes_ec_syndrome(modes_packet &packet, int length, int max_bits)
+{
+	const modes_ec_table &table = modes_ec_tables[length == 112];
+	modes_ec_table::const_iterator hit = table.find(packet.parity);
+	if(hit == table.end()) return 0;
+
+	const modes_ec_fix &fix = hit->second;
+	if(fix.nbits > max_bits) return 0;
+	if(fix.nbits == 2) {
+		int found = 0;
+		for(unsigned int i=0; i < packet.numlowconf; i++)
+			if(packet.lowconfbits[i] == fix.bits[0] || packet.lowconfbits[i] == fix.bits[1]) found++;
+		if(found < 2) return 0;
+	}
+
+	for(int i=0; i < fix.nbits; i++)
+		packet.data[fix.bits[i]/8] ^= 1 << (7-(fix.bits[i]%8));
+	packet.parity = 0;
+	return fix.nbits;
+}
@@ -24,7 +24,7 @@
 #define INCLUDED_MODES_PARITY_H
 extern const unsigned int modes_parity_table[112];
 int modes_check_parity(unsigned char data[], int length);
-bruteResultTypeDef modes_ec_brute(modes_packet &err_packet);
-unsigned next_set_of_n_elements(unsigned x);
+unsigned int modes_crc(const unsigned char data[], int nbytes);
+int modes_ec_syndrome(modes_packet &packet, int length, int max_bits);
 
 #endif
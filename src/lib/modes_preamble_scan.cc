@@ -0,0 +1,227 @@
+/*
+# Copyright 2010 Nick Foster
+# 
+# This file is part of gr-air-modes
+# 
+# gr-air-modes is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+# 
+# gr-air-modes is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with gr-air-modes; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+# 
+*/
+
+#ifdef HAVE_CONFIG_H
+#include "config.h"
+#endif
+
+#include <modes_preamble_scan.h>
+#include <boost/thread.hpp>
+#include <boost/bind.hpp>
+#include <climits>
+#ifdef __SSE__
+#include <xmmintrin.h>
+#endif
+
+//the preamble pattern in bits
+static const bool preamble_bits[] = {1, 0, 1, 0, 0, 0, 0, 1, 0, 1};
+static double correlate_preamble(const float *in, int samples_per_chip) {
+	double corr = 0.0;
+	for(int i=0; i<10; i++) {
+		for(int j=0; j<samples_per_chip;j++)
+			if(preamble_bits[i]) corr += in[i*samples_per_chip+j];
+	}
+	return corr;
+}
+
+//the rest of the checks, for a sample that passed the four pulse tests.
+//climbs to the correlation peak (moving i along with it) and then
+//checks the spaces. returns true and fills in the candidate if it's a preamble.
+static inline bool check_preamble(const float *in, const float *inavg, int &i,
+                                  int samples_per_chip, float threshold,
+                                  modes_preamble_candidate &candidate)
+{
+	const int samples_per_symbol = samples_per_chip * 2;
+
+	//get a more accurate bit center by finding the correlation peak across all four preamble bits
+	double now_corr = correlate_preamble(in+i, samples_per_chip);
+	while(1) {
+		double late_corr = correlate_preamble(in+i+1, samples_per_chip);
+		if(late_corr <= now_corr) break;
+		now_corr = late_corr;
+		i++;
+	}
+
+	//now check to see that the rest of the chips in the preamble
+	//are below the peaks by threshold dB
+	float avgpeak = ( in[i]
+	                + in[i+2*samples_per_chip]
+	                + in[i+7*samples_per_chip]
+	                + in[i+9*samples_per_chip]) / 4.0;
+
+	float space_threshold = inavg[i] + (avgpeak - inavg[i])/threshold;
+	for( int j=1.5*samples_per_symbol; j<=3*samples_per_symbol; j++)
+		if(in[i+j] > space_threshold) return false;
+	for( int j=5*samples_per_symbol; j<=7.5*samples_per_symbol; j++)
+		if(in[i+j] > space_threshold) return false;
+
+	candidate.index = i;
+	candidate.space_threshold = space_threshold;
+	return true;
+}
+
+//the four pulse tests for one starting sample. these are what throw out
+//nearly all the noise.
+static inline bool pulse_test(const float *in, const float *inavg, int i,
+                              int samples_per_chip, float threshold)
+{
+	float pulse_threshold = inavg[i] * threshold;
+	return (in[i] > pulse_threshold)
+	    && (in[i+1] <= in[i]) //wait for the peak
+	    && (in[i+2*samples_per_chip] >= pulse_threshold)
+	    && (in[i+7*samples_per_chip] >= pulse_threshold)
+	    && (in[i+9*samples_per_chip] >= pulse_threshold);
+}
+
+//pulse tests for the eight starting samples from i, as a bitmask
+//(bit 0 is sample i). with SSE that's four samples to an instruction and
+//no branches. without it we just go looking for the first one that passes,
+//which is the only bit the caller uses anyway.
+static inline int pulse_mask8(const float *in, const float *inavg, int i,
+                              int samples_per_chip, float threshold)
+{
+#ifdef __SSE__
+	const __m128 thresh = _mm_set1_ps(threshold);
+	int bits = 0;
+	for(int half=0; half < 2; half++) {
+		const float *x = in + i + 4*half;
+		__m128 now = _mm_loadu_ps(x);
+		__m128 pulse_threshold = _mm_mul_ps(_mm_loadu_ps(inavg + i + 4*half), thresh);
+		__m128 pass = _mm_cmpgt_ps(now, pulse_threshold);
+		pass = _mm_and_ps(pass, _mm_cmple_ps(_mm_loadu_ps(x+1), now));
+		pass = _mm_and_ps(pass, _mm_cmpge_ps(_mm_loadu_ps(x+2*samples_per_chip), pulse_threshold));
+		pass = _mm_and_ps(pass, _mm_cmpge_ps(_mm_loadu_ps(x+7*samples_per_chip), pulse_threshold));
+		pass = _mm_and_ps(pass, _mm_cmpge_ps(_mm_loadu_ps(x+9*samples_per_chip), pulse_threshold));
+		bits |= _mm_movemask_ps(pass) << (4*half);
+	}
+	return bits;
+#else
+	for(int k=0; k < 8; k++)
+		if(pulse_test(in, inavg, i+k, samples_per_chip, threshold)) return 1 << k;
+	return 0;
+#endif
+}
+
+//the hill climb moves the scan position along, so where the scan ends
+//up depends on where it started. a chunk that starts in the middle of a
+//preamble can climb to a different peak (or miss it) compared to a scan
+//that came in from earlier. the cure is to start each chunk a packet
+//length early and throw away whatever it finds before its real start;
+//by then it has fallen into step with the scan of the chunk before.
+//
+//almost every sample is noise and fails the pulse tests, so the scan
+//runs them eight samples at a time and only stops at samples that pass.
+//it visits the same samples in the same order as the one-at-a-time
+//scan below, so it finds exactly the same preambles.
+void modes_find_preambles(const float *in, const float *inavg,
+                          int begin, int end, int keep_from, int keep_to,
+                          int samples_per_chip, float threshold,
+                          std::vector<modes_preamble_candidate> &found)
+{
+	int i = begin;
+	while(i < end) {
+		int bits;
+		if(end - i >= 8) {
+			bits = pulse_mask8(in, inavg, i, samples_per_chip, threshold);
+			if(!bits) {
+				i += 8;
+				continue;
+			}
+		} else {
+			bits = pulse_test(in, inavg, i, samples_per_chip, threshold);
+			if(!bits) {
+				i++;
+				continue;
+			}
+		}
+
+		while(!(bits & 1)) { //skip up to the first sample that passed
+			bits >>= 1;
+			i++;
+		}
+
+		modes_preamble_candidate candidate;
+		bool valid_preamble = check_preamble(in, inavg, i, samples_per_chip, threshold, candidate);
+		if(valid_preamble && i >= keep_from && i < keep_to) found.push_back(candidate);
+		i++; //the climb may have moved us on, so start the next mask from here
+	}
+}
+
+//the original one-sample-at-a-time scan. it isn't used by the block any
+//more; it's kept as the reference for modes_bench.
+void modes_find_preambles_scalar(const float *in, const float *inavg,
+                                 int begin, int end, int keep_from, int keep_to,
+                                 int samples_per_chip, float threshold,
+                                 std::vector<modes_preamble_candidate> &found)
+{
+	const int pulse_offsets[4] = {    0,
+	                              int(2 * samples_per_chip),
+	                              int(7 * samples_per_chip),
+	                              int(9 * samples_per_chip)
+	                             };
+
+	for(int i=begin; i < end; i++) {
+		float pulse_threshold = inavg[i] * threshold;
+		if(in[i] > pulse_threshold) { //hey we got a candidate
+			if(in[i+1] > in[i]) continue; //wait for the peak
+			//check to see the rest of the pulses are there
+			if( in[i+pulse_offsets[1]] < pulse_threshold ) continue;
+			if( in[i+pulse_offsets[2]] < pulse_threshold ) continue;
+			if( in[i+pulse_offsets[3]] < pulse_threshold ) continue;
+
+			modes_preamble_candidate candidate;
+			if(!check_preamble(in, inavg, i, samples_per_chip, threshold, candidate)) continue;
+			if(i < keep_from || i >= keep_to) continue;
+			found.push_back(candidate);
+		}
+	}
+}
+
+void modes_find_preambles_threaded(const float *in, const float *inavg,
+                                   int end, int samples_per_chip, float threshold,
+                                   int nthreads,
+                                   std::vector<modes_preamble_candidate> &found)
+{
+	const int overlap = 240 * samples_per_chip; //one packet's worth of warmup
+	const int chunk = end / nthreads;
+
+	//not worth the thread startup for small buffers
+	if(nthreads <= 1 || chunk < 4*overlap) {
+		modes_find_preambles(in, inavg, 0, end, 0, INT_MAX, samples_per_chip, threshold, found);
+		return;
+	}
+
+	std::vector<std::vector<modes_preamble_candidate> > results(nthreads);
+	boost::thread_group workers;
+	for(int t=0; t < nthreads; t++) {
+		int start = t * chunk;
+		int stop = (t == nthreads-1) ? end : start + chunk;
+		int keep_to = (t == nthreads-1) ? INT_MAX : stop; //the last chunk keeps climbs that run off the end
+		workers.create_thread(boost::bind(&modes_find_preambles, in, inavg,
+		                                  std::max(0, start - overlap), stop, start, keep_to,
+		                                  samples_per_chip, threshold, boost::ref(results[t])));
+	}
+	workers.join_all();
+
+	for(int t=0; t < nthreads; t++)
+		found.insert(found.end(), results[t].begin(), results[t].end());
+}
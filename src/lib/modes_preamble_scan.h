@@ -0,0 +1,55 @@
+/*
+# Copyright 2010 Nick Foster
+# 
+# This file is part of gr-air-modes
+# 
+# gr-air-modes is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+# 
+# gr-air-modes is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with gr-air-modes; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+# 
+*/
+
+#ifndef INCLUDED_MODES_PREAMBLE_SCAN_H
+#define INCLUDED_MODES_PREAMBLE_SCAN_H
+
+#include <vector>
+
+//a preamble found by modes_find_preambles. index is the sample at the
+//correlation peak, i.e. where the packet starts.
+struct modes_preamble_candidate {
+	int index;
+	float space_threshold; //what the spaces in the preamble had to stay under
+};
+
+//scan for preambles at every starting sample in [begin, end), keeping
+//the ones whose peak lands in [keep_from, keep_to). results are in
+//sample order.
+void modes_find_preambles(const float *in, const float *inavg,
+                          int begin, int end, int keep_from, int keep_to,
+                          int samples_per_chip, float threshold,
+                          std::vector<modes_preamble_candidate> &found);
+
+//the same search done one sample at a time, for benchmarking against
+void modes_find_preambles_scalar(const float *in, const float *inavg,
+                                 int begin, int end, int keep_from, int keep_to,
+                                 int samples_per_chip, float threshold,
+                                 std::vector<modes_preamble_candidate> &found);
+
+//same thing, split across nthreads worker threads
+void modes_find_preambles_threaded(const float *in, const float *inavg,
+                                   int end, int samples_per_chip, float threshold,
+                                   int nthreads,
+                                   std::vector<modes_preamble_candidate> &found);
+
+#endif
@@ -0,0 +1,73 @@
+/*
+# Copyright 2010 Nick Foster
+# 
+# This file is part of gr-air-modes
+# 
+# gr-air-modes is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+# 
+# gr-air-modes is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with gr-air-modes; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+# 
+*/
+
+//runs packets through the same slicing, parity, timestamp and packing steps
+//as air_modes_slicer and writes out the frame records it would have queued,
+//so the python side can be checked against the real thing without GNU Radio.
+//frame-record-test.py builds and drives it. not installed.
+//
+//  modes_records channel_rate ref_secs ref_frac ref_sample < packets > records
+//
+//each packet on stdin is its sample number in the stream (a uint64) and then
+//the 240 floats the preamble detector puts out for it, one per chip. the time
+//reference is the same as an rx_time tag's: sample ref_sample was taken at
+//ref_secs + ref_frac.
+
+#ifdef HAVE_CONFIG_H
+#include "config.h"
+#endif
+
+#include <modes_slice.h>
+#include <modes_parity.h>
+#include <stdio.h>
+#include <stdlib.h>
+
+int main(int argc, char **argv)
+{
+	if(argc != 5) {
+		fprintf(stderr, "usage: %s channel_rate ref_secs ref_frac ref_sample < packets > records\n", argv[0]);
+		return 2;
+	}
+	int channel_rate = atoi(argv[1]);
+	uint64_t ref_secs = strtoull(argv[2], NULL, 10);
+	double ref_frac = atof(argv[3]);
+	uint64_t ref_sample = strtoull(argv[4], NULL, 10);
+
+	uint64_t sample;
+	float chips[240];
+	while(fread(&sample, sizeof(sample), 1, stdin) == 1) {
+		if(fread(chips, sizeof(float), 240, stdin) != 240) {
+			fprintf(stderr, "short packet on stdin\n");
+			return 1;
+		}
+		modes_packet rx_packet;
+		modes_slice_packet(chips, rx_packet);
+		rx_packet.parity = modes_check_parity(rx_packet.data, (rx_packet.type == Short_Packet) ? 56 : 112);
+		modes_sample_time(ref_secs, ref_frac, ref_sample, sample, channel_rate,
+		                  rx_packet.timestamp_secs, rx_packet.timestamp_frac);
+
+		modes_frame_record record;
+		modes_pack_record(rx_packet, record);
+		fwrite(&record, sizeof(record), 1, stdout);
+	}
+	return 0;
+}
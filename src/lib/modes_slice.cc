@@ -0,0 +1,127 @@
+/*
+# Copyright 2010 Nick Foster
+# 
+# This file is part of gr-air-modes
+# 
+# gr-air-modes is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+# 
+# gr-air-modes is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with gr-air-modes; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+# 
+*/
+
+#ifdef HAVE_CONFIG_H
+#include "config.h"
+#endif
+
+#include <modes_slice.h>
+#include <string.h>
+
+//this slicer is courtesy of Lincoln Labs. supposedly it is more resistant to mode A/C FRUIT.
+//see http://adsb.tc.faa.gov/WG3_Meetings/Meeting8/Squitter-Lon.pdf
+static inline slice_result_t slicer(const float bit0, const float bit1, const float ref) {
+	slice_result_t result;
+
+	//3dB limits for bit slicing and confidence measurement
+	float highlimit=ref*2;
+	float lowlimit=ref*0.5;
+	
+	bool firstchip_inref  = ((bit0 > lowlimit) && (bit0 < highlimit));
+	bool secondchip_inref = ((bit1 > lowlimit) && (bit1 < highlimit));
+
+	if(firstchip_inref && !secondchip_inref) {
+		result.decision = 1;
+		result.confidence = 1;
+	}
+	else if(secondchip_inref && !firstchip_inref) {
+		result.decision = 0;
+		result.confidence = 1;
+	} 
+	else if(firstchip_inref && secondchip_inref) {
+		result.decision = bit0 > bit1;
+		result.confidence = 0;
+	}
+	else {//if(!firstchip_inref && !secondchip_inref) {
+		result.decision = bit0 > bit1;
+		if(result.decision) {
+			if(bit1 < lowlimit * 0.5) result.confidence = 1;
+			else result.confidence = 0;
+		} else {
+			if(bit0 < lowlimit * 0.5) result.confidence = 1;
+			else result.confidence = 0;
+		}
+	}
+	return result;
+}
+
+//slices the bits [from, to) onto the end of byte, storing each byte
+//into the packet as it fills up
+static inline void slice_bits(const float *in, int from, int to, unsigned int &byte, modes_packet &rx_packet) {
+	for(int j=from; j < to; j++) {
+		slice_result_t slice_result = slicer(in[j*2], in[j*2+1], rx_packet.reference_level);
+		byte = (byte << 1) | slice_result.decision;
+		if((j & 7) == 7) rx_packet.data[j >> 3] = byte;
+
+		if(!slice_result.confidence && rx_packet.numlowconf < 24)
+			rx_packet.lowconfbits[rx_packet.numlowconf++] = j;
+	}
+}
+
+void modes_slice_packet(const float *in, modes_packet &rx_packet) {
+	//let's use the preamble to get a reference level for the packet
+	//fixme: a better thing to do is create a bi-level avg 1 and avg 0
+	//through simple statistics, then take the median for your slice level
+	//this won't improve decoding but will improve confidence
+	rx_packet.reference_level = (in[0]
+	                           + in[2]
+	                           + in[7]
+	                           + in[9]) / 4.0;
+	rx_packet.numlowconf = 0;
+
+	in += 16; //move on up to the first bit of the packet data
+
+	//slice the header first so we know if it's a short pkt or a long pkt,
+	//then carry on from there. everything is sliced exactly once.
+	unsigned int byte = 0;
+	slice_bits(in, 0, 5, byte, rx_packet);
+	rx_packet.message_type = byte; //the first five bits are the downlink format
+	if(rx_packet.message_type == 17) rx_packet.type = Long_Packet;
+	else rx_packet.type = Short_Packet;
+	int packet_length = (rx_packet.type == Short_Packet) ? 56 : 112;
+
+	slice_bits(in, 5, packet_length, byte, rx_packet);
+	if(packet_length == 56) memset(&rx_packet.data[7], 0x00, 7); //the frame record is always 14 bytes
+}
+
+void modes_sample_time(uint64_t ref_secs, double ref_frac, uint64_t ref_sample,
+                       uint64_t sample, int channel_rate, uint64_t &secs, double &frac)
+{
+	uint64_t age = sample - ref_sample;
+	secs = ref_secs + age / channel_rate;
+	frac = ref_frac + (double) (age % channel_rate) / channel_rate;
+	if(frac >= 1.0) {
+		secs += 1;
+		frac -= 1.0;
+	}
+}
+
+void modes_pack_record(const modes_packet &rx_packet, modes_frame_record &record)
+{
+	memcpy(record.data, rx_packet.data, 14);
+	record.message_type = rx_packet.message_type;
+	record.type = rx_packet.type;
+	record.parity = rx_packet.parity;
+	record.reference_level = rx_packet.reference_level;
+	record.timestamp_secs = rx_packet.timestamp_secs;
+	record.timestamp_frac = rx_packet.timestamp_frac;
+}
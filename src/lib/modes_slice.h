@@ -0,0 +1,43 @@
+/*
+# Copyright 2010 Nick Foster
+# 
+# This file is part of gr-air-modes
+# 
+# gr-air-modes is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+# 
+# gr-air-modes is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with gr-air-modes; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+# 
+*/
+
+#ifndef INCLUDED_MODES_SLICE_H
+#define INCLUDED_MODES_SLICE_H
+
+#include <air_modes_types.h>
+
+//slices one packet out of the preamble detector's output. in points at the
+//start of the preamble, one sample per chip. fills in everything in
+//rx_packet except the parity and the timestamp; the parity is left for
+//after the checks that throw out most false detections.
+void modes_slice_packet(const float *in, modes_packet &rx_packet);
+
+//the time of the sample'th sample of a stream at channel_rate, given that sample
+//ref_sample was taken at ref_secs + ref_frac. the whole seconds are worked out in
+//integers so a long run doesn't cost any precision.
+void modes_sample_time(uint64_t ref_secs, double ref_frac, uint64_t ref_sample,
+                       uint64_t sample, int channel_rate, uint64_t &secs, double &frac);
+
+//packs a sliced and checked packet into the record the slicer puts on the queue
+void modes_pack_record(const modes_packet &rx_packet, modes_frame_record &record);
+
+#endif
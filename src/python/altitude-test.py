@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+#
+# Copyright 2010 Nick Foster
+# 
+# This file is part of gr-air-modes
+# 
+# gr-air-modes is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+# 
+# gr-air-modes is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with gr-air-modes; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+# 
+
+
+#checks the table-driven altitude decoder two ways: against a frozen copy of the
+#arithmetic decoder as it was before the tables, for every 13-bit and 12-bit
+#code, and against altitudes encoded here from scratch, Gillham (100ft) and
+#Q-bit (25ft), so the tables aren't just compared with the code that built them.
+
+from altitude import decode_alt
+import sys
+
+failures = 0
+def check(what, ok):
+	global failures
+	if not ok:
+		print "FAILED: %s" % what
+		failures += 1
+
+#the decoder before the tables went in, left exactly as it was. it has one bug:
+#the 12-bit Gillham case reads (alt & 0x0FC0 << 1), which never shifts anything,
+#so those codes are checked against the 13-bit decode with the M bit put back in.
+def baseline_decode_alt(alt, bit13):
+	if alt & 0x40 and bit13 is True:
+		return "METRIC ERROR"
+
+	if alt & 0x10:
+		if bit13 is True:
+			tmp1 = (alt & 0x1F80) >> 2
+			tmp2 = (alt & 0x20) >> 1
+		else:
+			tmp1 = (alt & 0x0FE0) >> 1
+			tmp2 = 0
+
+		decoded_alt = ((alt & 0x0F) | tmp1 | tmp2) * 25 - 1000
+
+	else:
+		if bit13 is False:
+			alt = (alt & 0x003F) | (alt & 0x0FC0 << 1)
+
+		bigpart =  ((alt & 0x0002) >> 1) + ((alt & 0x0008) >> 2) + ((alt & 0x0020) >> 3) + ((alt & 0x0080) >> 4) + ((alt & 0x0200) >> 5) + ((alt & 0x0800) >> 6) + ((alt & 0x0001) << 6) + ((alt & 0x0004) << 5)
+		decoded_alt = baseline_gray2bin(bigpart)
+
+		cbits =   ((alt & 0x0100) >> 8) + ((alt & 0x0400) >> 9) + ((alt & 0x1000) >> 10)
+		cval = baseline_gray2bin(cbits)
+
+		if cval == 7:
+			cval = 5
+
+		if decoded_alt % 2:
+			cval = 6 - cval
+
+		decoded_alt *= 500
+		decoded_alt += cval * 100
+		decoded_alt -= 1300
+
+	return decoded_alt
+
+def baseline_gray2bin(gray):
+	i = gray >> 1
+	while i != 0:
+		gray ^= i
+		i >>= 1
+	return gray
+
+#the 12-bit field is the 13-bit one without the M bit (0x40)
+def to13(alt):
+	return ((alt & 0x0FC0) << 1) | (alt & 0x003F)
+
+def to12(alt):
+	return ((alt & 0x1F80) >> 1) | (alt & 0x003F)
+
+#every code, valid or not, against the baseline
+for alt in range(0, 1 << 13):
+	check("13-bit code %04x: table gives %s, baseline gives %s" % (alt, decode_alt(alt, True), baseline_decode_alt(alt, True)),
+	      decode_alt(alt, True) == baseline_decode_alt(alt, True))
+
+for alt in range(0, 1 << 12):
+	if alt & 0x10:
+		expected = baseline_decode_alt(alt, False)
+	else:
+		expected = baseline_decode_alt(to13(alt), True)
+	check("12-bit code %03x: table gives %s, baseline gives %s" % (alt, decode_alt(alt, False), expected),
+	      decode_alt(alt, False) == expected)
+
+#Gillham encoding, bit by bit from the field layout:
+#C1 A1 C2 A2 C4 A4 M B1 Q B2 D2 B4 D4
+bit = {"C1": 12, "A1": 11, "C2": 10, "A2": 9, "C4": 8, "A4": 7, "M": 6,
+       "B1": 5, "Q": 4, "B2": 3, "D2": 2, "B4": 1, "D4": 0}
+
+def bin2gray(n):
+	return n ^ (n >> 1)
+
+#500ft steps are Gray coded over D2 D4 A1 A2 A4 B1 B2 B4 (D1 only matters above
+#126700ft), the 100ft steps within them over C1 C2 C4, running backwards in the
+#odd 500ft steps
+def gillham(feet):
+	(n500, n100) = divmod(feet + 1200, 500)
+	n100 /= 100
+	if n500 % 2:
+		n100 = 4 - n100
+	code = 0
+	for (i, name) in enumerate(["D2", "D4", "A1", "A2", "A4", "B1", "B2", "B4"]):
+		if bin2gray(n500) >> (7 - i) & 1:
+			code |= 1 << bit[name]
+	for (i, name) in enumerate(["C1", "C2", "C4"]):
+		if [1, 3, 2, 6, 4][n100] >> (2 - i) & 1:
+			code |= 1 << bit[name]
+	return code
+
+#25ft steps from -1000ft, an 11-bit count with the M and Q bits spliced in
+def qbit(feet):
+	n = (feet + 1000) / 25
+	return ((n >> 5) << 7) | (((n >> 4) & 1) << 5) | (1 << bit["Q"]) | (n & 0x0F)
+
+for feet in range(-1200, 126800, 100):
+	check("Gillham %ift in 13 bits" % feet, decode_alt(gillham(feet), True) == feet)
+	check("Gillham %ift in 12 bits" % feet, decode_alt(to12(gillham(feet)), False) == feet)
+
+for feet in range(-1000, 50176, 25):
+	check("Q-bit %ift in 13 bits" % feet, decode_alt(qbit(feet), True) == feet)
+	check("Q-bit %ift in 12 bits" % feet, decode_alt(to12(qbit(feet)), False) == feet)
+
+#a few from real DF4 and DF17 replies
+known = [(0x1838, True, 38000), (0x1cb0, True, 45000), (0xc38, False, 38000)]
+for (alt, bit13, expected) in known:
+	check("code %04x: expected %s, got %s" % (alt, expected, decode_alt(alt, bit13)), decode_alt(alt, bit13) == expected)
+
+#invalid codes: the metric flag only exists in the 13-bit field, and a Gillham
+#code is only real if its C bits are one of the five the encoder uses. the rest
+#(none, C1 and C4, all three) decode however the baseline did, checked above.
+check("metric flag", decode_alt(0x1878, True) == "METRIC ERROR" and decode_alt(gillham(10000) | 0x40, True) == "METRIC ERROR")
+check("no metric flag in 12 bits", decode_alt(to12(qbit(38000)) | 0x40, False) != "METRIC ERROR")
+valid = set(gillham(feet) for feet in range(-1200, 126800, 100))
+cmask = (1 << bit["C1"]) | (1 << bit["C2"]) | (1 << bit["C4"])
+invalid_c = [0, (1 << bit["C1"]) | (1 << bit["C4"]), cmask]
+for alt in range(0, 1 << 13):
+	if alt & 0x50:
+		continue
+	check("Gillham code %04x is valid only if its C bits are" % alt, (alt in valid) == (alt & cmask not in invalid_c))
+
+if failures:
+	print "%i failures" % failures
+	sys.exit(1)
+
+print "All %i altitude codes match" % ((1 << 13) + (1 << 12))
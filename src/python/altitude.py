@@ -23,10 +23,19 @@
 #!/usr/bin/env python
 #from string import split, join
 
-#betcha this would be faster if you used a table for mode C
-#you could strip out D1 since it's never used, that leaves 11 bits (table is 2048 entries)
-#on the other hand doing it this way is educational for others
+#decode_alt is table-driven: every possible 13-bit (DF0/4/20) and 12-bit (DF17 airborne)
+#altitude code is decoded once at import time by decode_alt_arith below, which covers
+#the Q-bit (25ft), Gillham (100ft) and metric cases. 8192+4096 entries is nothing
+#and it's a lot cheaper than doing the Gray code dance for every frame.
 def decode_alt(alt, bit13):
+	if bit13 is True:
+		return _alt_table_13[alt]
+	else:
+		return _alt_table_12[alt]
+
+#this is the arithmetic decoder the tables are built from. doing it this way is
+#educational for others.
+def decode_alt_arith(alt, bit13):
 	if alt & 0x40 and bit13 is True:
 		return "METRIC ERROR"
 
@@ -48,7 +57,7 @@ def decode_alt(alt, bit13):
     	  #so we'll reassemble into a Gray-coded representation
 
 		if bit13 is False:
-			alt = (alt & 0x003F) | (alt & 0x0FC0 << 1)
+			alt = (alt & 0x003F) | ((alt & 0x0FC0) << 1) #make room for the M bit the 12-bit field doesn't have
 
 		C1 = 0x1000
 		A1 = 0x0800
@@ -92,3 +101,6 @@ def gray2bin(gray):
 		i >>= 1
 
 	return gray
+
+_alt_table_13 = [decode_alt_arith(alt, True) for alt in range(1 << 13)]
+_alt_table_12 = [decode_alt_arith(alt, False) for alt in range(1 << 12)]
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+#
+# Copyright 2010 Nick Foster
+# 
+# This file is part of gr-air-modes
+# 
+# gr-air-modes is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+# 
+# gr-air-modes is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with gr-air-modes; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+# 
+
+#writes reports through modes_output_columnar on a fake clock and reads them back
+#with read_columns: the round trip, chunking, flushing a quiet chunk out after
+#flush_interval, and rolling to a new file.
+
+from modes_columnar import *
+from modes_frame import modes_frame, frame_record, Long_Packet
+import os, sys, glob, tempfile, shutil, math
+
+class fake_clock:
+	def __init__(self):
+		self.now = 1350000000.0
+	def __call__(self):
+		return self.now
+
+failures = 0
+def check(what, ok):
+	global failures
+	if not ok:
+		print "FAILED: %s" % what
+		failures += 1
+
+def frame(now, reference):
+	return modes_frame(frame_record.pack("\0" * 14, 17, Long_Packet, 0, reference, int(now), now - int(now)))
+
+def same(a, b):
+	return a == b or (math.isnan(a) and math.isnan(b))
+
+#alternating positions and velocities, with the values that should come back
+def report(i, now):
+	if i % 2:
+		return (velocity(frame(now, i), 0x100000 + i, 1, 400.0 + i, 90.0, -500.0),
+		        [0x100000 + i, now, 17, float("nan"), float("nan"), float("nan"), 400.0 + i, 90.0, -500.0, i])
+	return (airborne_position(frame(now, i), 0x100000 + i, 11, 1000 * i, 37.0 + i / 1000.0, -122.0, None, None),
+	        [0x100000 + i, now, 17, 1000 * i, 37.0 + i / 1000.0, -122.0, float("nan"), float("nan"), float("nan"), i])
+
+def files(directory):
+	return sorted([os.path.basename(f) for f in glob.glob(os.path.join(directory, "*"))])
+
+tmpdir = tempfile.mkdtemp()
+try:
+	clock = fake_clock()
+	out = modes_output_columnar(tmpdir, roll_interval=600, chunk_rows=10, flush_interval=60, parquet=False, clock=clock)
+	expected = []
+	for i in range(0, 25):
+		(r, row) = report(i, clock())
+		out.output(r)
+		expected.append(row)
+		clock.now += 1
+	#the file's named for when the first chunk filled up
+	first = time.strftime("modes-%Y%m%d-%H%M%S.npz", time.gmtime(clock() - 16))
+	check("full chunks are written as they fill", files(tmpdir) == [first + ".part"])
+	check("the rest wait for more", len(read_columns(os.path.join(tmpdir, files(tmpdir)[0]))["icao"]) == 20)
+
+	#quiet: nothing more comes in, but update() gets the rows out once they've waited long enough
+	clock.now += 30 #the oldest has waited 35 seconds
+	out.update()
+	check("rows wait up to flush_interval", len(read_columns(os.path.join(tmpdir, files(tmpdir)[0]))["icao"]) == 20)
+	clock.now += 25
+	out.update()
+	check("and no longer", len(read_columns(os.path.join(tmpdir, files(tmpdir)[0]))["icao"]) == 25)
+
+	#a roll on time, with nothing waiting
+	clock.now += 600
+	out.update()
+	check("the file is finished on time", files(tmpdir) == [first])
+
+	for i in range(25, 30):
+		(r, row) = report(i, clock())
+		out.output(r)
+		expected.append(row)
+	out.close()
+	names = files(tmpdir)
+	check("the next rows start another file", len(names) == 2 and not [name for name in names if name.endswith(".part")])
+
+	#everything comes back, in order, with NaN where a report didn't have the column
+	got = [read_columns(os.path.join(tmpdir, name)) for name in names]
+	got = dict([(name, numpy.concatenate([g[name] for g in got])) for (name, dtype) in columns])
+	check("every row is read back", len(got["icao"]) == len(expected))
+	for (i, row) in enumerate(expected):
+		for (j, (name, dtype)) in enumerate(columns):
+			value = numpy.array([row[j]], dtype=dtype)[0]
+			if not same(got[name][i], value):
+				check("row %i %s: %r, expected %r" % (i, name, got[name][i], value), False)
+	check("columns keep their types", [got[name].dtype for (name, dtype) in columns] == [numpy.dtype(dtype) for (name, dtype) in columns])
+
+	some = read_columns(os.path.join(tmpdir, names[0]), ["icao", "time"])
+	check("reading some columns only reads those", sorted(some.keys()) == ["icao", "time"] and len(some["icao"]) == 25)
+finally:
+	shutil.rmtree(tmpdir)
+
+if failures:
+	print "%i failures" % failures
+	sys.exit(1)
+
+print "Columnar export OK"
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+#
+# Copyright 2010 Nick Foster
+# 
+# This file is part of gr-air-modes
+# 
+# gr-air-modes is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+# 
+# gr-air-modes is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with gr-air-modes; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+# 
+#synthetic multi-station test for mlat_correlator.py. a few hundred aircraft
+#reply to interrogations over a handful of receivers; each receiver hears
+#most of them, stamps them with the propagation delay plus some clock noise,
+#and delivers them late by its own network delay. every group that comes out
+#has to be exactly the receivers that heard one transmission, and mlat_batch
+#has to put it where the aircraft was.
+
+import mlat, mlat_correlator
+import numpy, random, struct, sys, time
+
+random.seed(1090)
+stations = dict(("rx%i" % i, [37.5 + random.uniform(-1, 1), -122 + random.uniform(-1, 1), random.uniform(0, 300)]) for i in range(0, 8))
+xyz = dict((name, numpy.array(mlat.llh2geoid(pos))) for (name, pos) in stations.items())
+names = dict((tuple(pos), name) for (name, pos) in stations.items()) #groups come out with positions, not names
+latency = dict((name, random.uniform(0, 0.2)) for name in stations) #each feed's network delay
+
+#each aircraft mostly says the same few things over and over, so identical
+#frames are common and only the timing tells transmissions apart
+aircraft = []
+for i in range(0, 300):
+	icao = random.randrange(1 << 24)
+	payloads = [struct.pack(">BI2s", 0x58, icao, struct.pack(">H", random.randrange(1 << 16))) for j in range(0, 3)]
+	llh = [37.5 + random.uniform(-2, 2), -122 + random.uniform(-2, 2), random.uniform(1000, 12000)]
+	aircraft.append((payloads, numpy.array(mlat.llh2ecef(llh)), llh[2]))
+
+duration = 20.0
+receptions = [] #(arrival, station, payload, timestamp)
+heard = {} #(station, timestamp) to the transmission it came from
+expected = {} #transmission to how many receivers heard it
+truth = {} #transmission to where it came from and the altitude it reported
+tx = 0
+for (payloads, plane, altitude) in aircraft:
+	t = random.uniform(0, 0.2)
+	while t < duration:
+		payload = random.choice(payloads)
+		n = 0
+		for (name, pos) in xyz.items():
+			if random.random() < 0.7:
+				timestamp = 1000 + t + numpy.linalg.norm(plane - pos) / mlat.c + random.gauss(0, 50e-9)
+				receptions.append((timestamp + latency[name] + random.uniform(0, 0.01), name, payload, timestamp))
+				heard[(name, timestamp)] = tx
+				n += 1
+		if n >= 3:
+			expected[tx] = n
+			truth[tx] = (plane, altitude)
+		tx += 1
+		t += random.uniform(0.05, 0.2) #no aircraft replies faster than this
+receptions.sort()
+
+failures = 0
+solvable = [] #(replies, transmission) for each good group, for mlat
+def check(groups):
+	global failures
+	for (data, replies) in groups:
+		txs = set()
+		for (station, timestamp) in replies:
+			txs.add(heard[(names[tuple(station)], timestamp)])
+		if len(txs) != 1:
+			print "Group mixes %i transmissions" % len(txs)
+			failures += 1
+			continue
+		tx = txs.pop()
+		if expected.get(tx) != len(replies):
+			print "Group has %i of the receivers that heard it" % len(replies)
+			failures += 1
+		else:
+			solvable.append((replies, tx))
+
+correlator = mlat_correlator.mlat_correlator(stations)
+emitted = 0
+start = time.time()
+for (arrival, station, payload, timestamp) in receptions:
+	groups = correlator.add(station, payload, timestamp)
+	check(groups)
+	emitted += len(groups)
+groups = correlator.flush()
+check(groups)
+emitted += len(groups)
+elapsed = time.time() - start
+stats = correlator.stats()
+
+print "%i frames from %i receivers, %i transmissions heard by 3 or more" % (len(receptions), len(stations), len(expected))
+print "%i groups in %.2fs (%.0f frames/s), window %.1fus" % (emitted, elapsed, len(receptions) / elapsed, correlator.window * 1e6)
+print "Stats: %s" % stats
+if emitted != len(expected) or stats["late"] or stats["evicted"] or stats["pending"]:
+	print "Expected %i groups with nothing late, evicted or left over" % len(expected)
+	failures += 1
+
+#the groups are what mlat_batch takes: solve some and see how close they come to
+#where the aircraft were. with three receivers there are two places that fit the
+#timestamps equally well, so only the groups with four or more are held to it. the
+#ones well outside the receivers are only good to a km or so, so the error's judged
+#against the covariance that comes with each fix. the timestamps are good to 50ns,
+#15m, and the altitudes are exact.
+sample = random.sample([(replies, tx) for (replies, tx) in solvable if len(replies) >= 4], 5000)
+start = time.time()
+(positions, converged, quality) = mlat.mlat_batch([replies for (replies, tx) in sample], [truth[tx][1] for (replies, tx) in sample], sigma=15.0, sigma_alt=1.0)
+elapsed = time.time() - start
+errors = numpy.array([numpy.linalg.norm(numpy.array(mlat.llh2ecef(list(pos))) - truth[tx][0]) for (pos, (replies, tx)) in zip(positions, sample)])
+predicted = numpy.sqrt(numpy.trace(quality["cov"], axis1=1, axis2=2))
+(errors, predicted) = (errors[converged], predicted[converged])
+print "Solved %i groups in %.2fs: %i converged, median error %.0fm, %.1f%% within 3 sigma, %.1f%% beyond 5" % \
+	(len(sample), elapsed, converged.sum(), numpy.median(errors), 100 * numpy.mean(errors < 3 * predicted), 100 * numpy.mean(errors > 5 * predicted))
+if converged.sum() < 0.99 * len(sample) or numpy.median(errors) > 100 or numpy.mean(errors < 3 * predicted) < 0.9 or numpy.mean(errors > 5 * predicted) > 0.01:
+	print "mlat didn't find the aircraft"
+	failures += 1
+
+#now with too little room: the oldest get finished early, but the memory stays put
+correlator = mlat_correlator.mlat_correlator(stations, max_pending=500)
+most = 0
+for (arrival, station, payload, timestamp) in receptions:
+	check(correlator.add(station, payload, timestamp))
+	most = max(most, correlator.stats()["pending"])
+check(correlator.flush())
+if most > 500 or not correlator.stats()["evicted"]:
+	print "Bounded correlator held %i groups, evicted %i" % (most, correlator.stats()["evicted"])
+	failures += 1
+
+if failures:
+	print "%i failures" % failures
+	sys.exit(1)
+
+print "Every group is one transmission"
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+#
+# Copyright 2010 Nick Foster
+# 
+# This file is part of gr-air-modes
+# 
+# gr-air-modes is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+# 
+# gr-air-modes is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with gr-air-modes; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+# 
+
+#checks cpr_decode_batch against a row-at-a-time reference built on the scalar
+#decoders in cpr.py, using synthetic traffic encoded with cpr_encode.
+
+from cpr import *
+import numpy, random, sys, time
+
+my_location = [37.76225, -122.44254]
+random.seed(1090)
+
+#synthetic traffic: aircraft wandering around the receiver, squittering even and odd
+#airborne positions at random intervals, with some surface traffic and some long gaps.
+#the surface traffic stays near the receiver, since that's the only place it can be heard.
+rows = []
+for icao in range(0x100000, 0x100000 + 200):
+	surface = 1 if random.random() < 0.1 else 0
+	spread = 0.3 if surface else 3
+	lat = my_location[0] + random.uniform(-spread, spread)
+	lon = my_location[1] + random.uniform(-spread, spread)
+	vlat = random.uniform(-0.002, 0.002) * spread / 3
+	vlon = random.uniform(-0.002, 0.002) * spread / 3
+	t = random.uniform(0, 100)
+	for i in range(0, 50):
+		t += random.choice([0.5, 0.5, 1.0, 2.0, 15.0])
+		lat += vlat
+		lon += vlon
+		ctype = random.randint(0, 1)
+		(enclat, enclon) = cpr_encode(lat, lon, ctype, surface)
+		rows.append((icao, enclat, enclon, ctype, surface, t, lat, lon))
+random.shuffle(rows) #the batch decoder shouldn't care what order things come in
+
+[icao, enclat, enclon, fmt, surf, stamps, truelat, truelon] = [list(col) for col in zip(*rows)]
+rows = [row[0:6] for row in rows]
+start = time.time()
+(lat, lon, status) = cpr_decode_batch(icao, enclat, enclon, fmt, surf, stamps, my_location)
+elapsed = time.time() - start
+
+#reference: walk each aircraft's frames in time order, remembering the last even and odd
+expected = {}
+last = {}
+for (i, row) in sorted(enumerate(rows), key=lambda r: (r[1][0], r[1][4], r[1][5])):
+	(a, elat_, elon_, ctype, s, t) = row
+	key = (a, s, 1 - ctype)
+	other = last.get(key)
+	last[(a, s, ctype)] = row
+	if other is not None and abs(t - other[5]) < 10:
+		if ctype == 1:
+			(even, odd) = (other, row)
+		else:
+			(even, odd) = (row, other)
+		newer = (odd[5] - even[5]) > 0
+		(rlat, rlon) = cpr_resolve_global([even[1], even[2]], [odd[1], odd[2]], newer, s)
+		if rlat is None:
+			expected[i] = (CPR_STRADDLE, None, None)
+		else:
+			expected[i] = (CPR_GLOBAL, rlat, rlon)
+	else:
+		(llat, llon) = cpr_resolve_local(my_location, [elat_, elon_], ctype, s)
+		if range_bearing(my_location, [llat, llon])[0] < (45 if s == 1 else 180):
+			expected[i] = (CPR_LOCAL, llat, llon)
+		else:
+			expected[i] = (CPR_REJECTED, None, None)
+
+failures = 0
+for i in range(0, len(rows)):
+	(st, elat_, elon_) = expected[i]
+	if status[i] != st:
+		print "row %i: status %i, expected %i" % (i, status[i], st)
+		failures += 1
+	elif st in [CPR_GLOBAL, CPR_LOCAL] and (lat[i] != elat_ or lon[i] != elon_):
+		print "row %i: (%r, %r), expected (%r, %r)" % (i, lat[i], lon[i], elat_, elon_)
+		failures += 1
+
+#and everything that decoded should be where the aircraft really was, to within
+#the CPR encoding's resolution: one step of a zone's worth of encoded position.
+#a global surface decode can only say which 90 degrees of longitude it's in
+#relative to the others, so those are compared modulo 90.
+for i in range(0, len(rows)):
+	if status[i] not in [CPR_GLOBAL, CPR_LOCAL]:
+		continue
+	scale = 2.0**nbits(surf[i])
+	tol_lat = dlat(fmt[i], surf[i]) / scale
+	tol_lon = dlon(truelat[i], fmt[i], surf[i]) / scale
+	dlon_err = lon[i] - truelon[i]
+	if surf[i] and status[i] == CPR_GLOBAL:
+		dlon_err = (dlon_err + 45) % 90 - 45
+	if abs(lat[i] - truelat[i]) > tol_lat or abs(dlon_err) > tol_lon:
+		print "row %i: (%r, %r), really at (%r, %r)" % (i, lat[i], lon[i], truelat[i], truelon[i])
+		failures += 1
+
+counts = numpy.bincount(status, minlength=4)
+print "%i rows in %.3fs: %i global, %i local, %i straddle, %i rejected" % (len(rows), elapsed, counts[0], counts[1], counts[2], counts[3])
+
+if failures:
+	print "%i mismatches" % failures
+	sys.exit(1)
+
+print "Batch CPR decode matches the scalar decoders"
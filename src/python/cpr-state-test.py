@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+#
+# Copyright 2010 Nick Foster
+# 
+# This file is part of gr-air-modes
+# 
+# gr-air-modes is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+# 
+# gr-air-modes is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with gr-air-modes; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+# 
+
+#exercises the CPR state store with a fake clock: expiry, lazy eviction,
+#and the even/odd pairing window in cpr_decode.
+
+from cpr import *
+import sys
+
+class fake_clock:
+	def __init__(self):
+		self.now = 1000.0
+	def __call__(self):
+		return self.now
+
+failures = 0
+def check(what, ok):
+	global failures
+	if not ok:
+		print "FAILED: %s" % what
+		failures += 1
+
+clock = fake_clock()
+state = cpr_state(expiry=900, pair_window=10, clock=clock)
+
+state.put(EVEN, 0xabcdef, 1, 2, clock())
+check("fresh entry is visible", state.get(EVEN, 0xabcdef, clock()) == (1, 2, 1000.0))
+check("other slots are empty", state.get(ODD, 0xabcdef, clock()) is None)
+
+clock.now += 901
+check("stale entry is hidden before it's reclaimed", state.get(EVEN, 0xabcdef, clock()) is None)
+state.expire(clock())
+check("stale entry is reclaimed", len(state) == 0 and 0xabcdef not in state._slots[EVEN])
+
+#an entry that keeps getting refreshed is never evicted and is only queued once
+for i in range(0, 100):
+	state.put(LKP, 0x123456, i, i, clock())
+	clock.now += 30
+	state.expire(clock())
+check("refreshed entry survives", state.get(LKP, 0x123456, clock()) is not None)
+check("refreshed entry is queued once", len(state) == 1 and len(state._slots[LKP]._queue) == 1)
+
+#lots of aircraft that go away all get reclaimed
+for icao in range(0, 1000):
+	state.put(EVEN, icao, 0, 0, clock())
+clock.now += 2000
+state.expire(clock())
+check("all idle aircraft reclaimed", len(state) == 0)
+
+#pairing window: even and odd 5s apart get paired, 20s apart they don't.
+#without a receiver location there's nothing else to decode an unpaired report against,
+#so only a global decode can come back with a position.
+clock.now = 5000.0
+longdata_even = 0x58c382d690c8ac
+longdata_odd = 0x58c386435cc412
+def fields(longdata):
+	return ((longdata >> 17) & 0x1FFFF, longdata & 0x1FFFF)
+def decode(longdata, location):
+	(enclat, enclon) = fields(longdata)
+	return cpr_decode(location, 0x40621d, enclat, enclon, (longdata >> 34) & 1, state, 0, longdata)
+
+(expected_lat, expected_lon) = cpr_resolve_global(fields(longdata_even), fields(longdata_odd), True, 0)
+
+state = cpr_state(pair_window=10, clock=clock)
+decode(longdata_even, None)
+clock.now += 5
+check("paired within the window", decode(longdata_odd, None)[0:2] == [expected_lat, expected_lon])
+
+state = cpr_state(pair_window=10, clock=clock)
+decode(longdata_even, None)
+clock.now += 20
+check("not paired outside the window", decode(longdata_odd, None)[0] is None)
+
+state = cpr_state(pair_window=1, clock=clock)
+decode(longdata_even, None)
+clock.now += 5
+check("window is configurable", decode(longdata_odd, None)[0] is None)
+
+if failures:
+	print "%i failures" % failures
+	sys.exit(1)
+
+print "CPR state store OK"
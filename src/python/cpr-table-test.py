@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+#
+# Copyright 2010 Nick Foster
+# 
+# This file is part of gr-air-modes
+# 
+# gr-air-modes is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+# 
+# gr-air-modes is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with gr-air-modes; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+# 
+
+#differential test for the table-driven CPR code in cpr.py. the reference
+#functions below are the straight formulas cpr.py used before the tables.
+
+import cpr
+import math, random, struct, sys
+
+def ref_nl(declat_in):
+	return math.floor( (2.0*math.pi) * pow(math.acos(1.0- (1.0-math.cos(math.pi/(2.0*cpr.latz))) / pow( math.cos( (math.pi/180.0)*abs(declat_in) ) ,2.0) ),-1.0))
+
+def ref_dlat(ctype, surface):
+	if surface == 1:
+		tmp = 90.0
+	else:
+		tmp = 360.0
+	return tmp / (4 * cpr.latz - ctype)
+
+def ref_dlon(declat_in, ctype, surface):
+	if surface == 1:
+		tmp = 90.0
+	else:
+		tmp = 360.0
+	nlcalc = ref_nl(declat_in) - ctype
+	if nlcalc == 0:
+		return tmp
+	else:
+		return tmp / nlcalc
+
+def ref_nbits(surface):
+	if surface == 1:
+		return 19
+	else:
+		return 17
+
+def ref_resolve_local(my_location, encoded_location, ctype, surface):
+	[my_lat, my_lon] = my_location
+	[enclat, enclon] = encoded_location
+
+	tmp1 = ref_dlat(ctype, surface)
+	tmp2 = float(enclat) / (2**ref_nbits(surface))
+	j = math.floor(my_lat/tmp1) + math.floor(0.5 + (cpr.mod(my_lat, tmp1) / tmp1) - tmp2)
+	lat = tmp1 * (j + tmp2)
+
+	tmp1 = ref_dlon(lat, ctype, surface)
+	tmp2 = float(enclon) / (2.0**ref_nbits(surface))
+	m = math.floor(my_lon / tmp1) + math.floor(0.5 + (cpr.mod(my_lon, tmp1) / tmp1) - tmp2)
+	return [lat, tmp1 * (m + tmp2)]
+
+def ref_resolve_global(evenpos, oddpos, mostrecent, surface):
+	dlateven = ref_dlat(0, surface);
+	dlatodd  = ref_dlat(1, surface);
+	evenpos = [float(evenpos[0]), float(evenpos[1])]
+	oddpos = [float(oddpos[0]), float(oddpos[1])]
+	highest_measure_value = float(2**ref_nbits(surface))
+
+	j = math.floor(((59*evenpos[0] - 60*oddpos[0])/highest_measure_value) + 0.5)
+	rlateven = dlateven * (cpr.mod(j, 60)+evenpos[0]/highest_measure_value)
+	rlatodd  = dlatodd  * (cpr.mod(j, 59)+ oddpos[0]/highest_measure_value)
+	if ( rlateven >= 270 ):
+		rlateven -= 360
+	if ( rlatodd  >= 270 ):
+		rlatodd  -= 360
+	if ref_nl(rlateven) != ref_nl(rlatodd):
+		return [None, None]
+
+	if mostrecent == 0:
+		rlat = rlateven
+		enclon = evenpos[1]
+	else:
+		rlat = rlatodd
+		enclon = oddpos[1]
+	dl = ref_dlon(rlat, mostrecent, surface)
+	nlthing = ref_nl(rlat) - mostrecent
+	#the old code used nlthing here too, which is wrong when the odd report is newer
+	m = math.floor((evenpos[1]*(ref_nl(rlat)-1)-oddpos[1]*ref_nl(rlat))/highest_measure_value+0.5)
+	if nlthing < 1:
+		nlthing = 1
+	rlon = dl * (cpr.mod(m, nlthing)+enclon/highest_measure_value)
+	if rlon > 180:
+		rlon = rlon - 360.0
+	return [rlat, rlon]
+
+#the formula blows up (acos of less than -1) above about 87 degrees, where NL is 1 anyway
+def ref_nl_safe(lat):
+	try:
+		return ref_nl(lat)
+	except ValueError:
+		return 1.0
+
+def next_float(x, steps):
+	bits = struct.unpack("<q", struct.pack("<d", x))[0]
+	return struct.unpack("<d", struct.pack("<q", bits + steps))[0]
+
+failures = 0
+def check(what, got, expected):
+	global failures
+	if got != expected:
+		print "%s: got %s, expected %s" % (what, repr(got), repr(expected))
+		failures += 1
+
+#dense latitude grid, both hemispheres
+for i in range(-900000, 900001):
+	lat = i * 1e-4
+	check("nl(%r)" % lat, cpr.nl(lat), ref_nl_safe(lat))
+
+#the exact transition latitudes and a few ulps either side of them
+for boundary in cpr._nl_lats:
+	for steps in range(-4, 5):
+		lat = next_float(boundary, steps)
+		check("nl(%r)" % lat, cpr.nl(lat), ref_nl_safe(lat))
+		check("nl(%r)" % -lat, cpr.nl(-lat), ref_nl_safe(-lat))
+
+for surface in [0, 1]:
+	for ctype in [0, 1]:
+		check("dlat(%i, %i)" % (ctype, surface), cpr.dlat(ctype, surface), ref_dlat(ctype, surface))
+		for i in range(-869, 870):
+			lat = i * 0.1
+			check("dlon(%r, %i, %i)" % (lat, ctype, surface), cpr.dlon(lat, ctype, surface), ref_dlon(lat, ctype, surface))
+
+#local and global decodes on random positions
+random.seed(1090)
+for i in range(0, 20000):
+	surface = random.randint(0, 1)
+	ctype = random.randint(0, 1)
+	scale = 2**ref_nbits(surface)
+	my_location = [random.uniform(-80, 80), random.uniform(-180, 180)]
+	enc = [random.randrange(scale), random.randrange(scale)]
+	check("local %r %r %i %i" % (my_location, enc, ctype, surface), cpr.cpr_resolve_local(my_location, enc, ctype, surface), ref_resolve_local(my_location, enc, ctype, surface))
+
+	evenpos = [random.randrange(scale), random.randrange(scale)]
+	oddpos = [random.randrange(scale), random.randrange(scale)]
+	try:
+		expected = ref_resolve_global(evenpos, oddpos, ctype, surface)
+	except ValueError:
+		continue #polar garbage the old code couldn't decode at all
+	check("global %r %r %i %i" % (evenpos, oddpos, ctype, surface), cpr.cpr_resolve_global(evenpos, oddpos, ctype, surface), expected)
+
+if failures:
+	print "%i mismatches" % failures
+	sys.exit(1)
+
+print "Table-driven CPR matches the reference formulas"
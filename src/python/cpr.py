@@ -24,52 +24,80 @@
 #from string import split, join
 #from math import pi, floor, cos, acos
 import math, time
+from collections import deque
+from bisect import bisect_right
 #this implements CPR position decoding.
 
 latz = 15
 
+#surface and airborne CPR differ only in the number of bits and the size of a zone.
+#all the per-frame constants are indexed by [surface] or [surface][ctype].
+_nbits = [17, 19]
+_cpr_scale = [float(2**17), float(2**19)]
+_zone = [360.0, 90.0]
+_dlat = [[360.0 / (4*latz), 360.0 / (4*latz - 1)],
+         [90.0 / (4*latz), 90.0 / (4*latz - 1)]]
+
 def nbits(surface):
-       if surface == 1:
-               return 19
-       else:
-               return 17
+        return _nbits[surface]
 
 def nz(ctype):
         return 4 * latz - ctype
 
 def dlat(ctype, surface):
-        if surface == 1:
-                tmp = 90.0
-        else:
-                tmp = 360.0
-
-        nzcalc = nz(ctype)
-        if nzcalc == 0:
-                return tmp
-        else:
-                return tmp / nzcalc
+        return _dlat[surface][ctype]
 
 def nl_eo(declat_in, ctype):
         return nl(declat_in) - ctype
 
-# This should be a look up table for speed
-def nl(declat_in):
+#this is the textbook NL(lat) formula. it's only used to build the transition
+#latitude table below, and as the reference for cpr-table-test.py.
+def nl_formula(declat_in):
         return math.floor( (2.0*math.pi) * pow(math.acos(1.0- (1.0-math.cos(math.pi/(2.0*latz))) / pow( math.cos( (math.pi/180.0)*abs(declat_in) ) ,2.0) ),-1.0))
 
+#NL only changes at 58 latitudes, so we store those and bisect instead of doing
+#acos/cos/pow for every decode. the closed-form transition latitude is only good to
+#a few ulps, so each one gets nudged to the exact float where nl_formula changes,
+#which keeps nl() bit-for-bit identical to the formula.
+def _nl_transition(n):
+        a = (1.0 - math.cos(math.pi/(2.0*latz))) / (1.0 - math.cos(2.0*math.pi/n))
+        guess = math.degrees(math.acos(math.sqrt(a)))
+        lo = guess - 1e-6 #nl_formula(lo) >= n
+        hi = guess + 1e-6 #nl_formula(hi) < n
+        while True:
+                mid = (lo + hi) / 2.0
+                if mid == lo or mid == hi:
+                        return hi
+                try:
+                        below = nl_formula(mid) < n
+                except ValueError: #past the NL=1 latitude the formula takes acos of less than -1
+                        below = True
+                if below:
+                        hi = mid
+                else:
+                        lo = mid
+
+#_nl_lats[i] is the lowest latitude with NL < 59-i. above the last one NL is 1,
+#which is also where the formula itself gives up (acos of less than -1).
+_nl_lats = [_nl_transition(n) for n in range(4*latz - 1, 1, -1)]
+_nl_values = [float(4*latz - 1 - i) for i in range(0, len(_nl_lats) + 1)]
+
+def nl(declat_in):
+        lat = abs(declat_in)
+        if lat > 90.0: #garbage global decodes end up here; keep them as garbage as they always were
+                return nl_formula(declat_in)
+        return _nl_values[bisect_right(_nl_lats, lat)]
+
 def dlon(declat_in, ctype, surface):
-        if surface == 1:
-                tmp = 90.0
-        else:
-                tmp = 360.0
-        nlcalc = nl_eo(declat_in, ctype)
+        nlcalc = nl(declat_in) - ctype
         if nlcalc == 0:
-                return tmp
+                return _zone[surface]
         else:
-                return tmp / nlcalc
+                return _zone[surface] / nlcalc
 
 def decode_lat(enclat, ctype, my_lat, surface):
-        tmp1 = dlat(ctype, surface)
-        tmp2 = float(enclat) / (2**nbits(surface))
+        tmp1 = _dlat[surface][ctype]
+        tmp2 = enclat / _cpr_scale[surface]
         j = math.floor(my_lat/tmp1) + math.floor(0.5 + (mod(my_lat, tmp1) / tmp1) - tmp2)
 #       print "dlat gives " + "%.6f " % tmp1 + "with j = " + "%.6f " % j + " and tmp2 = " + "%.6f" % tmp2 + " given enclat " + "%x" % enclat
 
@@ -77,7 +105,7 @@ def decode_lat(enclat, ctype, my_lat, surface):
 
 def decode_lon(declat, enclon, ctype, my_lon, surface):
         tmp1 = dlon(declat, ctype, surface)
-        tmp2 = float(enclon) / (2.0**nbits(surface))
+        tmp2 = enclon / _cpr_scale[surface]
         m = math.floor(my_lon / tmp1) + math.floor(0.5 + (mod(my_lon, tmp1) / tmp1) - tmp2)
 #       print "dlon gives " + "%.6f " % tmp1 + "with m = " + "%.6f " % m + " and tmp2 = " + "%.6f" % tmp2 + " given enclon " + "%x" % enclon
 
@@ -91,25 +119,35 @@ def cpr_resolve_local(my_location, encoded_location, ctype, surface):
         [my_lat, my_lon] = my_location
         [enclat, enclon] = encoded_location
 
+        return list(_resolve_local(my_lat, my_lon, enclat, enclon, ctype, surface))
+
+def cpr_resolve_global(evenpos, oddpos, mostrecent, surface): #ok this is considered working, tentatively
+        return list(_resolve_global(evenpos[0], evenpos[1], oddpos[0], oddpos[1], mostrecent, surface))
+
+#the fast paths behind cpr_resolve_local and cpr_resolve_global. they take and
+#return plain scalars so cpr_decode doesn't build and unpack lists for every frame.
+def _resolve_local(my_lat, my_lon, enclat, enclon, ctype, surface):
         decoded_lat = decode_lat(enclat, ctype, my_lat, surface)
         decoded_lon = decode_lon(decoded_lat, enclon, ctype, my_lon, surface)
 
-        return [decoded_lat, decoded_lon]
+        return (decoded_lat, decoded_lon)
 
-def cpr_resolve_global(evenpos, oddpos, mostrecent, surface): #ok this is considered working, tentatively
-        dlateven = dlat(0, surface);
-        dlatodd  = dlat(1, surface);
+def _resolve_global(evenlat, evenlon, oddlat, oddlon, mostrecent, surface):
+        dlateven = _dlat[surface][0]
+        dlatodd  = _dlat[surface][1]
 
-        evenpos = [float(evenpos[0]), float(evenpos[1])]
-        oddpos = [float(oddpos[0]), float(oddpos[1])]
+        evenlat = float(evenlat)
+        evenlon = float(evenlon)
+        oddlat = float(oddlat)
+        oddlon = float(oddlon)
 
-        highest_measure_value = float(2**nbits(surface))
+        highest_measure_value = _cpr_scale[surface]
 
-        j = math.floor(((59*evenpos[0] - 60*oddpos[0])/highest_measure_value) + 0.5) #latitude index
-        print "Latitude index %i" % j
+        j = math.floor(((59*evenlat - 60*oddlat)/highest_measure_value) + 0.5) #latitude index
+        #print "Latitude index %i" % j
 
-        rlateven = dlateven * (mod(j, 60)+evenpos[0]/highest_measure_value)
-        rlatodd  = dlatodd  * (mod(j, 59)+ oddpos[0]/highest_measure_value)
+        rlateven = dlateven * (mod(j, 60)+evenlat/highest_measure_value)
+        rlatodd  = dlatodd  * (mod(j, 59)+ oddlat/highest_measure_value)
 
         # Southern hemisphere fix
         if ( rlateven >= 270 ):
@@ -119,22 +157,26 @@ def cpr_resolve_global(evenpos, oddpos, mostrecent, surface): #ok this is consid
 
         # Nothing can be done about a boundary straddle, you should
         # try a different method for decoding.
-        if nl(rlateven) != nl(rlatodd):
+        nlcalc = nl(rlateven)
+        if nlcalc != nl(rlatodd):
                 #print "Boundary straddle!"
                 return (None, None,)
 
         if mostrecent == 0:
                 rlat = rlateven
-                enclon = evenpos[1]
+                enclon = evenlon
         else:
                 rlat = rlatodd
-                enclon = oddpos[1]
-
-        dl = dlon(rlat, mostrecent, surface)
+                enclon = oddlon
 
-        # Longitude index
-        nlthing = nl_eo(rlat,mostrecent)
-        m = math.floor((evenpos[1]*(nlthing-1)-oddpos[1]*nlthing)/highest_measure_value+0.5)
+        # Longitude index. m always comes from NL itself; only the zone count
+        # and width depend on which report is newer.
+        nlthing = nlcalc - mostrecent
+        if nlthing == 0:
+                dl = _zone[surface]
+        else:
+                dl = _zone[surface] / nlthing
+        m = math.floor((evenlon*(nlcalc-1)-oddlon*nlcalc)/highest_measure_value+0.5)
 
         if nlthing < 1:
                 nlthing = 1
@@ -143,63 +185,307 @@ def cpr_resolve_global(evenpos, oddpos, mostrecent, surface): #ok this is consid
         if rlon > 180:
                 rlon = rlon - 360.0
 
-        return [rlat, rlon]
+        return (rlat, rlon)
+
+#the other direction, for building test data. returns (enclat, enclon) for a position.
+def cpr_encode(lat, lon, ctype, surface):
+        scale = _cpr_scale[surface]
+        dlati = _dlat[surface][ctype]
+        yz = math.floor(scale * mod(lat, dlati) / dlati + 0.5)
+        rlat = dlati * (yz / scale + math.floor(lat / dlati))
+        nlcalc = nl(rlat) - ctype
+        if nlcalc > 0:
+                dloni = _zone[surface] / nlcalc
+        else:
+                dloni = _zone[surface]
+        xz = math.floor(scale * mod(lon, dloni) / dloni + 0.5)
+        return (int(yz) % int(scale), int(xz) % int(scale))
+
+#batch decoding for replaying archived frames. cpr_decode_batch takes equal-length
+#arrays (one row per position frame) and pairs each frame with the latest earlier frame
+#of the other format from the same aircraft (airborne and surface are kept apart) within
+#pair_window seconds. paired rows get a global decode; unpaired rows get a local decode
+#against my_location if there is one and it's within range. every row gets a status:
+CPR_GLOBAL = 0
+CPR_LOCAL = 1
+CPR_STRADDLE = 2 #paired, but the two frames are on opposite sides of a zone boundary
+CPR_REJECTED = 3 #unpaired and out of local range, no location, or a garbage decode
+#lat and lon come back NaN for anything that isn't CPR_GLOBAL or CPR_LOCAL.
+#the arithmetic is the same as _resolve_global and _resolve_local, row for row. unlike
+#cpr_decode there's no emitter-centered decoding, since that depends on the previous row.
+def cpr_decode_batch(icao, encoded_lat, encoded_lon, cpr_format, surface, stamps, my_location=None, pair_window=10):
+        import numpy
+
+        icao = numpy.asarray(icao, dtype=numpy.int64)
+        n = len(icao)
+        order = numpy.lexsort((numpy.asarray(stamps), numpy.asarray(surface), icao))
+        icao = icao[order]
+        surf = numpy.asarray(surface, dtype=numpy.int64)[order]
+        stamps = numpy.asarray(stamps, dtype=numpy.float64)[order]
+        fmt = numpy.asarray(cpr_format, dtype=numpy.int64)[order]
+        enclat = numpy.asarray(encoded_lat, dtype=numpy.float64)[order]
+        enclon = numpy.asarray(encoded_lon, dtype=numpy.float64)[order]
+
+        status = numpy.empty(n, dtype=numpy.int8)
+        status.fill(CPR_REJECTED)
+        lat = numpy.empty(n)
+        lat.fill(numpy.nan)
+        lon = numpy.empty(n)
+        lon.fill(numpy.nan)
+
+        scale = numpy.where(surf == 1, _cpr_scale[1], _cpr_scale[0])
+        zone = numpy.where(surf == 1, _zone[1], _zone[0])
+
+        #pairing. rows are sorted by aircraft, then surface, then time, so the latest earlier
+        #frame of the other format is a running maximum of row indices, as long as it doesn't
+        #reach back past the start of this row's group.
+        idx = numpy.arange(n)
+        newgroup = numpy.ones(n, dtype=bool)
+        newgroup[1:] = (icao[1:] != icao[:-1]) | (surf[1:] != surf[:-1])
+        groupstart = numpy.maximum.accumulate(numpy.where(newgroup, idx, 0))
+        last_even = numpy.maximum.accumulate(numpy.where(fmt == 0, idx, -1))
+        last_odd = numpy.maximum.accumulate(numpy.where(fmt == 1, idx, -1))
+        partner = numpy.where(fmt == 1, last_even, last_odd)
+        paired = partner >= groupstart
+        paired[paired] &= numpy.abs(stamps[paired] - stamps[partner[paired]]) < pair_window
+
+        #global decode for the paired rows
+        p = numpy.nonzero(paired)[0]
+        if len(p):
+                q = partner[p]
+                isodd = fmt[p] == 1
+                elat = numpy.where(isodd, enclat[q], enclat[p])
+                elon = numpy.where(isodd, enclon[q], enclon[p])
+                olat = numpy.where(isodd, enclat[p], enclat[q])
+                olon = numpy.where(isodd, enclon[p], enclon[q])
+                etime = numpy.where(isodd, stamps[q], stamps[p])
+                otime = numpy.where(isodd, stamps[p], stamps[q])
+                newer = (otime - etime) > 0
+                sc = scale[p]
+                zn = zone[p]
+                issurf = surf[p] == 1
+
+                j = numpy.floor(((59*elat - 60*olat)/sc) + 0.5)
+                rlateven = numpy.where(issurf, _dlat[1][0], _dlat[0][0]) * (_mod(j, 60) + elat/sc)
+                rlatodd = numpy.where(issurf, _dlat[1][1], _dlat[0][1]) * (_mod(j, 59) + olat/sc)
+                rlateven[rlateven >= 270] -= 360
+                rlatodd[rlatodd >= 270] -= 360
+
+                garbage = (numpy.abs(rlateven) > 90) | (numpy.abs(rlatodd) > 90)
+                nlcalc = _nl_batch(rlateven)
+                straddle = ~garbage & (nlcalc != _nl_batch(rlatodd))
+                good = ~garbage & ~straddle
+
+                rlat = numpy.where(newer, rlatodd, rlateven)
+                lonsel = numpy.where(newer, olon, elon)
+                nlthing = nlcalc - newer
+                dl = zn / numpy.where(nlthing == 0, 1, nlthing)
+                m = numpy.floor((elon*(nlcalc-1) - olon*nlcalc)/sc + 0.5)
+                nlthing = numpy.maximum(nlthing, 1)
+                rlon = dl * (_mod(m, nlthing) + lonsel/sc)
+                rlon[rlon > 180] -= 360.0
+
+                lat[p[good]] = rlat[good]
+                lon[p[good]] = rlon[good]
+                status[p[good]] = CPR_GLOBAL
+                status[p[straddle]] = CPR_STRADDLE
+
+        #local decode against the receiver for everything that wasn't paired
+        u = numpy.nonzero(~paired)[0]
+        if my_location is not None and len(u):
+                [my_lat, my_lon] = my_location
+                sc = scale[u]
+                ctype = fmt[u]
+                issurf = surf[u] == 1
+
+                tmp1 = numpy.where(issurf, numpy.where(ctype == 1, _dlat[1][1], _dlat[1][0]), numpy.where(ctype == 1, _dlat[0][1], _dlat[0][0]))
+                tmp2 = enclat[u] / sc
+                j = numpy.floor(my_lat/tmp1) + numpy.floor(0.5 + (_mod(my_lat, tmp1) / tmp1) - tmp2)
+                llat = tmp1 * (j + tmp2)
+
+                nlcalc = _nl_batch(llat) - ctype
+                tmp1 = zone[u] / numpy.where(nlcalc == 0, 1, nlcalc)
+                tmp2 = enclon[u] / sc
+                m = numpy.floor(my_lon / tmp1) + numpy.floor(0.5 + (_mod(my_lon, tmp1) / tmp1) - tmp2)
+                llon = tmp1 * (m + tmp2)
+
+                rnge = _range_batch(my_location, llat, llon)
+                good = rnge < numpy.where(issurf, 45, 180)
+                lat[u[good]] = llat[good]
+                lon[u[good]] = llon[good]
+                status[u[good]] = CPR_LOCAL
+
+        #put everything back in the order it came in
+        out_lat = numpy.empty(n)
+        out_lon = numpy.empty(n)
+        out_status = numpy.empty(n, dtype=numpy.int8)
+        out_lat[order] = lat
+        out_lon[order] = lon
+        out_status[order] = status
+        return (out_lat, out_lon, out_status)
+
+def _mod(a, b):
+        import numpy
+        return a - b * numpy.floor(a / b)
+
+def _nl_batch(lats):
+        import numpy
+        return numpy.array(_nl_values)[numpy.searchsorted(numpy.array(_nl_lats), numpy.abs(lats), side="right")]
+
+#range_bearing's range, for arrays of points
+def _range_batch(loc_a, b_lat, b_lon):
+        import numpy
+        [a_lat, a_lon] = loc_a
 
-def weed_poslist(poslist):
-        for key, item in poslist.items():
-                if time.time() - item[2] > 900:
-                        del poslist[key]
+        esquared = (1/298.257223563)*(2-(1/298.257223563))
+        earth_radius_mi = 3963.19059 * (math.pi / 180)
+
+        delta_lat = b_lat - a_lat
+        delta_lon = b_lon - a_lon
+        avg_lat = (a_lat + b_lat) / 2.0
+
+        R1 = earth_radius_mi*(1.0-esquared)/pow((1.0-esquared*pow(numpy.sin(avg_lat),2)),1.5)
+        R2 = earth_radius_mi/numpy.sqrt(1.0-esquared*pow(numpy.sin(avg_lat),2))
+
+        return numpy.hypot(R2*numpy.cos(avg_lat)*delta_lon, R1*delta_lat)
+
+#a dict whose entries go stale ttl seconds after they were last written. entries are
+#tuples ending in the time they were written, and lookups never see a stale one. stale
+#entries are reclaimed from a time-ordered queue that holds each key at most once, so
+#eviction is amortized O(1) per call to expire() rather than a sweep over every key:
+#anything queued more than ttl seconds ago gets looked at, and if it hasn't been written
+#since it goes, otherwise it goes back on the end of the queue.
+class expiring_map:
+        def __init__(self, ttl):
+                self.ttl = ttl
+                self._entries = {}
+                self._queue = deque() #(time queued, key), oldest first
+
+        def get(self, key, now):
+                entry = self._entries.get(key)
+                if entry is None or now - entry[-1] > self.ttl:
+                        return None
+                return entry
+
+        def put(self, key, entry):
+                entries = self._entries
+                if key not in entries:
+                        self._queue.append((entry[-1], key))
+                entries[key] = entry
+
+        def expire(self, now):
+                horizon = now - self.ttl
+                queue = self._queue
+                entries = self._entries
+                while queue and queue[0][0] < horizon:
+                        key = queue.popleft()[1]
+                        if entries[key][-1] < horizon:
+                                del entries[key]
+                        else:
+                                queue.append((now, key))
+
+        def __contains__(self, key):
+                return key in self._entries
+
+        def __len__(self):
+                return len(self._entries)
+
+#per-aircraft CPR state: the last even and odd encoded positions (airborne and surface
+#are kept apart) and the last known decoded position, each as a (lat, lon, time) tuple
+#in an expiring_map, so nothing older than expiry seconds is ever used.
+#the clock is only for cpr_decode calls that don't say what time it is.
+EVEN = 0
+ODD = 1
+EVEN_SURFACE = 2
+ODD_SURFACE = 3
+LKP = 4
+
+class cpr_state:
+        def __init__(self, expiry=900, pair_window=10, clock=time.time):
+                self.expiry = expiry
+                self.pair_window = pair_window #even and odd reports further apart than this don't get globally decoded
+                self.clock = clock
+                self._slots = [expiring_map(expiry) for i in range(0, 5)]
+
+        def get(self, slot, icao24, now):
+                return self._slots[slot].get(icao24, now)
+
+        def put(self, slot, icao24, lat, lon, now):
+                self._slots[slot].put(icao24, (lat, lon, now))
+
+        def expire(self, now):
+                for entries in self._slots:
+                        entries.expire(now)
+
+        def __len__(self):
+                return sum([len(entries) for entries in self._slots])
+
+#now is when the report was received; by default it's the state's clock.
+def cpr_decode(my_location, icao24, encoded_lat, encoded_lon, cpr_format, state, surface, longdata, now=None):
+        if now is None:
+                now = state.clock()
+
+        #okay, let's weed out those entries that are older than 15 minutes, as they're unlikely to be useful.
+        state.expire(now)
 
-def cpr_decode(my_location, icao24, encoded_lat, encoded_lon, cpr_format, evenlist, oddlist, lkplist, surface, longdata):
         #add the info to the position reports list for global decoding
+        if surface==1:
+                evenslot = EVEN_SURFACE
+                oddslot = ODD_SURFACE
+        else:
+                evenslot = EVEN
+                oddslot = ODD
+
         if cpr_format==1:
-                oddlist[icao24] = [encoded_lat, encoded_lon, time.time()]
+                state.put(oddslot, icao24, encoded_lat, encoded_lon, now)
         else:
-                evenlist[icao24] = [encoded_lat, encoded_lon, time.time()]
+                state.put(evenslot, icao24, encoded_lat, encoded_lon, now)
 
-        [decoded_lat, decoded_lon] = [None, None]
+        even = state.get(evenslot, icao24, now)
+        odd = state.get(oddslot, icao24, now)
+        lkp = state.get(LKP, icao24, now)
 
-        #okay, let's traverse the lists and weed out those entries that are older than 15 minutes, as they're unlikely to be useful.
-        weed_poslist(lkplist)
-        weed_poslist(evenlist)
-        weed_poslist(oddlist)
+        decoded_lat = None
+        decoded_lon = None
 
         if surface==1:
                 validrange = 45
         else:
                 validrange = 180
 
-        if ((icao24 in evenlist) and (icao24 in oddlist) and abs(evenlist[icao24][2] - oddlist[icao24][2]) < 10):
-                print "debug: valid even/odd positions, performing global decode."
-                newer = (oddlist[icao24][2] - evenlist[icao24][2]) > 0 #figure out which report is newer
-                [decoded_lat, decoded_lon] = cpr_resolve_global(evenlist[icao24][0:2], oddlist[icao24][0:2], newer, surface) #do a global decode
+        if even is not None and odd is not None and abs(even[2] - odd[2]) < state.pair_window:
+                #print "debug: valid even/odd positions, performing global decode."
+                newer = (odd[2] - even[2]) > 0 #figure out which report is newer
+                (decoded_lat, decoded_lon) = _resolve_global(even[0], even[1], odd[0], odd[1], newer, surface) #do a global decode
 
                 # Try local decoding if the above failed. The above
                 # will fail if the even and odd frames are on opposite
                 # sides of a zone boundary
-                if decode_lat is None and icao24 in lkplist and lkplist[icao24][2] - time.time() < 10:
-                       print "Failed, trying emitter local"
-                       [decoded_lat, decoded_lon] = cpr_resolve_local(lkplist[icao24][0:2], [encoded_lat, encoded_lon], cpr_format, surface)
-                else:
-                       print "Failed, trying local"
-                       [decoded_lat, decoded_lon] = cpr_resolve_local(my_location, [encoded_lat, encoded_lon], cpr_format, surface)
-                lkplist[icao24] = [decoded_lat, decoded_lon, time.time()]
-
-        elif icao24 in lkplist and lkplist[icao24][2] - time.time() < 10:
-               print "emitter side"
+                if decoded_lat is None and lkp is not None and lkp[2] - now < 10:
+                       #print "Failed, trying emitter local"
+                       (decoded_lat, decoded_lon) = _resolve_local(lkp[0], lkp[1], encoded_lat, encoded_lon, cpr_format, surface)
+                elif decoded_lat is None and my_location is not None:
+                       #print "Failed, trying local"
+                       (decoded_lat, decoded_lon) = _resolve_local(my_location[0], my_location[1], encoded_lat, encoded_lon, cpr_format, surface)
+                if decoded_lat is not None:
+                       state.put(LKP, icao24, decoded_lat, decoded_lon, now)
+
+        elif lkp is not None and lkp[2] - now < 10:
+               #print "emitter side"
                #do emitter-centered local decoding
-               [decoded_lat, decoded_lon] = cpr_resolve_local(lkplist[icao24][0:2], [encoded_lat, encoded_lon], cpr_format, surface)
-               lkplist[icao24] = [decoded_lat, decoded_lon, time.time()] #update the local position for next time
+               (decoded_lat, decoded_lon) = _resolve_local(lkp[0], lkp[1], encoded_lat, encoded_lon, cpr_format, surface)
+               state.put(LKP, icao24, decoded_lat, decoded_lon, now) #update the local position for next time
 
         elif my_location is not None: #if we have a location, use it
-               print "local side"
-               [local_lat, local_lon] = cpr_resolve_local(my_location, [encoded_lat, encoded_lon], cpr_format, surface) #try local decoding
+               #print "local side"
+               (local_lat, local_lon) = _resolve_local(my_location[0], my_location[1], encoded_lat, encoded_lon, cpr_format, surface) #try local decoding
                [rnge, bearing] = range_bearing(my_location, [local_lat, local_lon])
                if rnge < validrange: #if the local decoding can be guaranteed valid
-                      lkplist[icao24] = [local_lat, local_lon, time.time()] #update the local position for next time
-                      [decoded_lat, decoded_lon] = [local_lat, local_lon]
+                      state.put(LKP, icao24, local_lat, local_lon, now) #update the local position for next time
+                      decoded_lat = local_lat
+                      decoded_lon = local_lon
 
-        if decoded_lat is not None:
+        if decoded_lat is not None and my_location is not None:
                 [rnge, bearing] = range_bearing(my_location, [decoded_lat, decoded_lon])
         else:
                 rnge = None
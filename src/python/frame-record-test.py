@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+#
+# Copyright 2010 Nick Foster
+# 
+# This file is part of gr-air-modes
+# 
+# gr-air-modes is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+# 
+# gr-air-modes is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with gr-air-modes; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+# 
+
+#checks the frame records the slicer sends against modes_frame.py's reading of
+#them. modes_records (in src/lib) runs packets through the slicer's own slicing,
+#parity, timestamp and packing code, with no GNU Radio needed, and writes out the
+#records; this reads them back and checks every field, the timestamps to the bit.
+#it uses the modes_records "make check" built, or builds its own with $CXX.
+
+from modes_frame import modes_frame, frame_record, Short_Packet, Long_Packet
+from modes_iqgen import df17, df11, df4, modulate
+from modes_parse import modes_parse, all_call_reply, altitude_reply
+import numpy, os, struct, subprocess, sys, tempfile, shutil
+
+failures = 0
+def check(what, ok):
+	global failures
+	if not ok:
+		print "FAILED: %s" % what
+		failures += 1
+
+lib = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib")
+tmpdir = tempfile.mkdtemp()
+try:
+	program = os.path.join(lib, "modes_records")
+	if not os.path.exists(program):
+		program = os.path.join(tmpdir, "modes_records")
+		sources = [os.path.join(lib, name) for name in ("modes_records.cc", "modes_slice.cc", "modes_parity.cc")]
+		subprocess.check_call([os.environ.get("CXX", "c++"), "-O2", "-Wall", "-I" + lib, "-o", program] + sources)
+
+	#(bits, length, sample number, what the syndrome should be)
+	packets = [(df17(0x40621d, 0x58c382d690c8ac), 112, 0, 0),
+	           (df11(0x4840d6), 56, 1234567, 0),
+	           (df4(0x4840d6, 10000), 56, 8000000 * 86400 + 12345, 0x4840d6), #a day in, past 32 bits of samples
+	           (df11(0x4840d6) ^ (1 << 40), 56, 8000000 * 86400 * 365 + 7, None)] #a bit error
+
+	def run(rate, ref_secs, ref_frac, ref_sample, amplitude):
+		feed = ""
+		for (bits, nbits, sample, syndrome) in packets:
+			chips = numpy.zeros(240, dtype=numpy.float32)
+			chips[:16 + 2*nbits] = modulate(bits, nbits, 1) * amplitude
+			feed += struct.pack("=Q", sample) + chips.tostring()
+		process = subprocess.Popen([program, str(rate), str(ref_secs), repr(ref_frac), str(ref_sample)],
+		                           stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+		(out, err) = process.communicate(feed)
+		check("modes_records runs", process.returncode == 0)
+		check("one record of frame_record.size per packet", len(out) == frame_record.size * len(packets))
+		return [modes_frame(out[i:i+frame_record.size]) for i in range(0, len(out), frame_record.size)]
+
+	#the same arithmetic as modes_sample_time, so the times should come out identical
+	def expected_time(rate, ref_secs, ref_frac, ref_sample, sample):
+		age = sample - ref_sample
+		(secs, frac) = (ref_secs + age // rate, ref_frac + float(age % rate) / rate)
+		if frac >= 1.0:
+			(secs, frac) = (secs + 1, frac - 1.0)
+		return (secs, frac)
+
+	#counting from a start time, from an rx_time tag partway in, and one where
+	#the fraction carries into the seconds
+	for (rate, ref_secs, ref_frac, ref_sample) in [(8000000, 1350000000, 0.25, 0),
+	                                               (4000000, 1350000000, 0.5, 0),
+	                                               (8000000, 1350000123, 0.999999999, 1234000),
+	                                               (2000000, 0, 0.0, 0)]:
+		amplitude = 12.5
+		frames = run(rate, ref_secs, ref_frac, ref_sample, amplitude)
+		for (frame, (bits, nbits, sample, syndrome)) in zip(frames, packets):
+			what = "%i-bit DF%i at sample %i, %i sps" % (nbits, bits >> (nbits - 5), sample, rate)
+			if sample < ref_sample:
+				continue #never happens: a tag's only used for the samples after it
+			check("%s: data" % what, frame.data == ("%0*x" % (nbits / 4, bits)).decode("hex").ljust(14, "\0"))
+			check("%s: downlink format" % what, frame.msgtype == bits >> (nbits - 5))
+			check("%s: length" % what, frame.long == (nbits == 112))
+			if syndrome is not None:
+				check("%s: syndrome" % what, frame.ecc == syndrome)
+			else:
+				check("%s: syndrome of a bad frame" % what, frame.ecc not in (0, 0x4840d6))
+			check("%s: reference level" % what, frame.reference == amplitude)
+			(secs, frac) = expected_time(rate, ref_secs, ref_frac, ref_sample, sample)
+			check("%s: time %i + %r, got %i + %r" % (what, secs, frac, frame.timestamp_secs, frame.timestamp_frac),
+			      frame.timestamp_secs == secs and frame.timestamp_frac == frac and 0 <= frame.timestamp_frac < 1)
+
+	#and through the decoder, the way uhd_modes uses them
+	frames = run(8000000, 1350000000, 0.25, 0, 12.5)
+	decoder = modes_parse(None)
+	report = decoder.decode(frames[1])
+	check("the DF11 decodes", isinstance(report, all_call_reply) and report.icao == 0x4840d6)
+	check("the DF4 a day later is past the address cache", decoder.decode(frames[2]) is None)
+	report = modes_parse(None, ap_filter=False).decode(frames[2])
+	check("and decodes without it", isinstance(report, altitude_reply) and report.icao == 0x4840d6 and report.altitude == 10000)
+finally:
+	shutil.rmtree(tmpdir)
+
+if failures:
+	print "%i failures" % failures
+	sys.exit(1)
+
+print "Frame records from the slicer code match modes_frame"
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+#
+# Copyright 2010 Nick Foster
+# 
+# This file is part of gr-air-modes
+# 
+# gr-air-modes is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+# 
+# gr-air-modes is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with gr-air-modes; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+# 
+#checks the geoid heights in mlat.py against the cubic spline scipy's map_coordinates
+#gives for the same table, which is what mlat.py used before it did its own.
+
+import sys
+import mlat
+
+if "scipy" in sys.modules:
+	print "Importing mlat pulled in scipy"
+	sys.exit(1)
+
+import numpy
+from scipy.ndimage import map_coordinates
+
+def ref_height(lat, lon):
+	return map_coordinates(mlat.wgs84_geoid, [9-lat/10.0, 18+lon/10.0])
+
+failures = 0
+def check(what, got, expected):
+	global failures
+	if abs(got - expected) > 1e-9:
+		print "%s: got %r, expected %r" % (what, got, expected)
+		failures += 1
+
+#global grid, everywhere the table covers, as arrays and one point at a time
+(lat, lon) = numpy.meshgrid(numpy.arange(-90, 90.01, 0.25), numpy.arange(-180, 170.01, 0.25))
+error = numpy.abs(mlat.wgs84_height(lat, lon) - ref_height(lat, lon))
+if error.max() > 1e-9:
+	print "wgs84_height(array) off by up to %r" % error.max()
+	failures += 1
+
+for lat in range(-90, 91, 2):
+	for lon in range(-180, 171, 2):
+		check("wgs84_height(%r, %r)" % (lat, lon), mlat.wgs84_height(lat, lon), float(ref_height(numpy.array([lat]), numpy.array([lon]))))
+
+#past 170E the table runs out, and the heights should head back round to 180W
+for lat in range(-90, 91):
+	west = mlat.wgs84_height(lat, 170)
+	east = mlat.wgs84_height(lat, -180)
+	check("wgs84_height(%r, 180)" % lat, mlat.wgs84_height(lat, 180), east)
+	for lon in numpy.arange(170, 180, 0.5):
+		height = mlat.wgs84_height(lat, lon)
+		if not min(west, east) - 1e-9 <= height <= max(west, east) + 1e-9:
+			print "wgs84_height(%r, %r): %r isn't between %r and %r" % (lat, lon, height, west, east)
+			failures += 1
+
+if failures:
+	print "%i mismatches" % failures
+	sys.exit(1)
+
+print "Geoid heights match map_coordinates"
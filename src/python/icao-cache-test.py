@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+#
+# Copyright 2010 Nick Foster
+# 
+# This file is part of gr-air-modes
+# 
+# gr-air-modes is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+# 
+# gr-air-modes is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with gr-air-modes; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+# 
+
+#exercises the address/parity filter in modes_parse: addresses heard in clean
+#DF11/DF17 frames are believed for ttl seconds, address/parity frames from
+#anyone else are thrown out unless the filter's turned off.
+
+from modes_parse import *
+from modes_frame import modes_frame, frame_record, Short_Packet, Long_Packet
+from modes_parity import modes_append_parity
+import struct, sys
+
+failures = 0
+def check(what, ok):
+	global failures
+	if not ok:
+		print "FAILED: %s" % what
+		failures += 1
+
+#a short frame as the slicer would send it. ecc is the syndrome: 0 for a clean
+#DF11, the address for a clean address/parity frame.
+def short_frame(df, data, address, now):
+	bits = modes_append_parity((df << 27) | data, 32, address)
+	packed = struct.pack(">Q", bits)[1:] + "\0" * 7
+	ecc = address
+	if df == 11:
+		ecc = 0
+	return modes_frame(frame_record.pack(packed, df, Short_Packet, ecc, 0.0, int(now), now - int(now)))
+
+def all_call(icao24, now):
+	return short_frame(11, (5 << 24) | icao24, 0, now)
+
+def altitude(icao24, now):
+	return short_frame(4, 0x0006b8, icao24, now) #fs 0, 10000ft
+
+#a DF17 with this ME field, from the same aircraft as cpr-state-test's pair
+def extended_squitter(icao24, longdata, now):
+	bits = modes_append_parity((17 << 83) | (5 << 80) | (icao24 << 56) | longdata, 88)
+	packed = ("%028x" % bits).decode("hex")
+	return modes_frame(frame_record.pack(packed, 17, Long_Packet, 0, 0.0, int(now), now - int(now)))
+
+#the cache on its own
+now = 1000.0
+cache = icao_cache(ttl=60)
+cache.add(0xabcdef, now)
+check("fresh address is known", cache.known(0xabcdef, now))
+check("other addresses aren't", not cache.known(0x123456, now))
+now += 61
+check("stale address is forgotten before it's reclaimed", not cache.known(0xabcdef, now))
+cache.expire(now)
+check("stale address is reclaimed", len(cache) == 0)
+
+#an address that keeps coming back is never evicted
+for i in range(0, 100):
+	cache.add(0x123456, now)
+	now += 30
+	cache.expire(now)
+check("refreshed address survives", cache.known(0x123456, now) and len(cache) == 1)
+
+#through the parser, which goes by when each frame was received. these were
+#recorded in 2012 and are decoded straight after one another.
+now = 1350000000.0
+parser = modes_parse(None, icaos=icao_cache(ttl=60))
+check("address/parity frame from an unknown aircraft is rejected", parser.decode(altitude(0x4840d6, now)) is None)
+check("and counted", parser.rejected == 1)
+
+report = parser.decode(all_call(0x4840d6, now))
+check("clean DF11 decodes", isinstance(report, all_call_reply) and report.icao == 0x4840d6)
+now += 30
+report = parser.decode(altitude(0x4840d6, now))
+check("address/parity frame from a known aircraft decodes", isinstance(report, altitude_reply) and report.icao == 0x4840d6 and report.altitude == 10000)
+check("someone else's is still rejected", parser.decode(altitude(0x4840d7, now)) is None)
+
+now += 61
+check("rejected again once the address has expired", parser.decode(altitude(0x4840d6, now)) is None)
+check("rejections counted", parser.rejected == 3)
+
+#with the filter off everything gets through, and nothing's counted
+parser = modes_parse(None, icaos=icao_cache(ttl=60), ap_filter=False)
+report = parser.decode(altitude(0x4840d6, now))
+check("unfiltered address/parity frame decodes", isinstance(report, altitude_reply) and report.icao == 0x4840d6)
+check("unfiltered rejects nothing", parser.rejected == 0)
+
+#CPR pairs are timed by the frames too: an even and odd 5s apart in the recording
+#make a global decode, 20s apart they don't, however quickly they're replayed
+(even, odd) = (0x58c382d690c8ac, 0x58c386435cc412)
+parser = modes_parse(None)
+parser.decode(extended_squitter(0x40621d, even, now))
+report = parser.decode(extended_squitter(0x40621d, odd, now + 5))
+check("replayed pair 5s apart decodes", isinstance(report, airborne_position) and report.lat is not None)
+parser = modes_parse(None)
+parser.decode(extended_squitter(0x40621d, even, now))
+report = parser.decode(extended_squitter(0x40621d, odd, now + 20))
+check("replayed pair 20s apart doesn't", isinstance(report, airborne_position) and report.lat is None)
+
+if failures:
+	print "%i failures" % failures
+	sys.exit(1)
+
+print "Address/parity filter OK"
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+#
+# Copyright 2010 Nick Foster
+# 
+# This file is part of gr-air-modes
+# 
+# gr-air-modes is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+# 
+# gr-air-modes is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with gr-air-modes; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+# 
+
+#checks modes_kml_live.updates() with simulated NetworkLink clients: each one
+#starts from a snapshot, polls for updates every so often and applies the
+#Delete/Create/Change operations it gets, and has to end up with exactly what a
+#fresh snapshot shows. some poll too rarely for the history, to cover the path
+#that replaces the whole folder, and aircraft come and go and expire throughout.
+
+from modes_kml import *
+from modes_frame import modes_frame, frame_record, Long_Packet
+import xml.etree.ElementTree as ET
+import random, sys, time
+
+class fake_clock:
+	def __init__(self):
+		self.now = 1350000000.0
+	def __call__(self):
+		return self.now
+
+failures = 0
+def check(what, ok):
+	global failures
+	if not ok:
+		print "FAILED: %s" % what
+		failures += 1
+
+def tag(element):
+	return element.tag.split("}")[-1] #drop the namespace
+
+def child(element, name):
+	for c in element:
+		if tag(c) == name:
+			return c
+	return None
+
+#what a client shows for a placemark: the text of the fields a Change can touch
+def placemark_fields(placemark):
+	fields = {}
+	for name in ["name", "description"]:
+		c = child(placemark, name)
+		if c is not None:
+			fields[name] = (c.text or "").strip()
+	for name in ["Point", "LineString"]:
+		c = child(placemark, name)
+		if c is not None:
+			fields[name] = (child(c, "coordinates").text or "").strip()
+	return fields
+
+#the aircraft folder of a whole document, as placemark id to fields
+def snapshot(kml):
+	root = ET.fromstring("".join(kml.genkml()[0]))
+	for folder in root.iter():
+		if tag(folder) == "Folder" and folder.get("id") == "aircraft":
+			return dict([(p.get("id"), placemark_fields(p)) for p in folder if tag(p) == "Placemark"])
+	return None
+
+class client:
+	def __init__(self, kml, every):
+		self.every = every
+		self.placemarks = snapshot(kml)
+		self.seq = kml._seq
+		self.replaced = 0
+
+	def poll(self, kml):
+		(updates, seq) = kml.updates(self.seq)
+		self.seq = seq
+		for op in ET.fromstring("<Update>%s</Update>" % ("".join(updates),)):
+			for target in op:
+				targetid = target.get("targetId")
+				if tag(op) == "Delete":
+					if tag(target) == "Folder" and targetid == "aircraft":
+						self.placemarks = None
+					else:
+						del self.placemarks[targetid] #a KeyError here is a Delete of something the client never had
+				elif tag(op) == "Create":
+					if tag(target) == "Document" and targetid == "modes":
+						folder = child(target, "Folder")
+						self.placemarks = {}
+						self.replaced += 1
+					else:
+						folder = target
+					for p in folder:
+						if tag(p) != "Placemark":
+							continue
+						if p.get("id") in self.placemarks:
+							raise Exception("created %s twice" % (p.get("id"),))
+						self.placemarks[p.get("id")] = placemark_fields(p)
+				elif tag(op) == "Change":
+					self.placemarks[targetid].update(placemark_fields(target))
+
+def frame(now):
+	return modes_frame(frame_record.pack("\0" * 14, 17, Long_Packet, 0, 0.0, int(now), now - int(now)))
+
+clock = fake_clock()
+kml = modes_kml_live(None, [37.76225, -122.44254], timeout=1e6, active=12, track_age=30, track_length=20, history=5, clock=clock)
+while kml._seq == 0: #let the thread do its first refresh and go to sleep
+	time.sleep(0.01)
+
+random.seed(1090)
+clients = [client(kml, every) for every in [1, 2, 3, 7, 11]]
+aircraft = {} #icao to [lat, lon, still talking]
+for step in range(1, 200):
+	#a few seconds of traffic
+	for i in range(0, random.randint(0, 40)):
+		clock.now += random.uniform(0, 0.2)
+		if random.random() < 0.05 or not aircraft:
+			aircraft[random.randint(0, 0xffffff)] = [37.8 + random.uniform(-1, 1), -122.4 + random.uniform(-1, 1), True]
+		icao = random.choice(aircraft.keys())
+		(lat, lon, talking) = aircraft[icao]
+		if not talking:
+			continue
+		if random.random() < 0.01:
+			aircraft[icao][2] = False #goes quiet, so it'll expire
+		kind = random.random()
+		if kind < 0.6:
+			aircraft[icao][0] += random.uniform(-0.01, 0.01)
+			aircraft[icao][1] += random.uniform(-0.01, 0.01)
+			kml.output(airborne_position(frame(clock()), icao, 11, random.randint(0, 400) * 100, aircraft[icao][0], aircraft[icao][1], None, None))
+		elif kind < 0.8:
+			kml.output(velocity(frame(clock()), icao, 1, random.uniform(100, 500), random.uniform(0, 360), random.uniform(-2000, 2000)))
+		else:
+			kml.output(identification(frame(clock()), icao, 4, random.choice(["UAL123  ", "SWA456  ", "N1090   "])))
+	clock.now += 5
+	kml.refresh()
+
+	expected = snapshot(kml)
+	for c in clients:
+		if step % c.every == 0:
+			c.poll(kml)
+			check("client polling every %i refreshes matches at refresh %i" % (c.every, kml._seq), c.placemarks == expected)
+
+check("some aircraft expired", len(kml._aircraft) < len(aircraft))
+check("aircraft are showing at the end", len(expected) > 0)
+check("clients inside the history never had the folder replaced", [c.replaced for c in clients if c.every < 5] == [0, 0, 0])
+check("clients outside it did", min([c.replaced for c in clients if c.every > 5]) > 0)
+
+#a client from before a restart gets the whole folder too
+c = client(kml, 1)
+c.seq = kml._seq + 10
+c.poll(kml)
+check("client from the future is brought up to date", c.replaced == 1 and c.placemarks == snapshot(kml))
+
+if failures:
+	print "%i failures" % failures
+	sys.exit(1)
+
+print "KML updates OK"
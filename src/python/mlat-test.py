@@ -1,13 +1,53 @@
 #!/usr/bin/python
 import mlat
 import numpy
+import sys
 
 replies = []
 for i in range(0, len(mlat.teststations)):
     replies.append((mlat.teststations[i], mlat.teststamps[i]))
 
-ans = mlat.mlat(replies, mlat.testalt)
+(ans, quality) = mlat.mlat(replies, mlat.testalt)
 error = numpy.linalg.norm(numpy.array(mlat.llh2ecef(ans))-numpy.array(mlat.testplane))
 range = numpy.linalg.norm(mlat.llh2geoid(ans)-numpy.array(mlat.llh2geoid(mlat.teststations[0])))
 print "Error: %.2fm" % (error)
 print "Range: %.2fkm (from first station in list)" % (range/1000)
+print "HDOP: %.2f VDOP: %.2f RMS: %.2fm Iterations: %i" % (quality["hdop"], quality["vdop"], quality["rms"], quality["rounds"])
+print "Position sigma: %.0fm horizontal (for %.0fm of pseudorange error)" % (30.0 * quality["hdop"], 30.0)
+
+#the test stamps are when the reply really got to each station, so with no noise
+#the answer should be spot on
+if error > 1.0:
+    print "Error too large"
+    sys.exit(1)
+
+#the covariance should agree with the DOPs: its trace is sigma^2 * (HDOP^2 + VDOP^2)
+if abs(numpy.trace(quality["cov"]) - 30.0**2 * (quality["hdop"]**2 + quality["vdop"]**2)) > 1e-6 * numpy.trace(quality["cov"]):
+    print "Covariance doesn't match HDOP/VDOP"
+    sys.exit(1)
+
+#and it should be the covariance you really get: solve the same reply with noise on
+#each timestamp and on the altitude, and the scatter of the answers should match
+numpy.random.seed(1090)
+(sigma, sigma_alt) = (30.0, 100.0)
+trials = 2000
+stamps = numpy.array(mlat.teststamps) + numpy.random.normal(0, sigma / mlat.c, (trials, len(mlat.teststamps)))
+altitudes = mlat.testalt + numpy.random.normal(0, sigma_alt, trials)
+groups = [zip(mlat.teststations, row) for row in stamps]
+(positions, converged, batch_quality) = mlat.mlat_batch(groups, altitudes, sigma=sigma, sigma_alt=sigma_alt)
+xyz = numpy.array([mlat.llh2ecef(list(pos)) for pos in positions[converged]])
+scatter = numpy.cov(xyz.T)
+print "Covariance trace: %.0fm^2 predicted, %.0fm^2 from %i noisy solves" % (numpy.trace(quality["cov"]), numpy.trace(scatter), len(xyz))
+if not converged.all() or abs(numpy.trace(scatter) / numpy.trace(quality["cov"]) - 1) > 0.15:
+    print "Covariance doesn't match the scatter of noisy solves"
+    sys.exit(1)
+
+#three stations in a line can't fix a position, and shouldn't be tried
+inline = [mlat.teststations[0], mlat.teststations[1],
+          [(mlat.teststations[0][0] + mlat.teststations[1][0]) / 2, (mlat.teststations[0][1] + mlat.teststations[1][1]) / 2, 100]]
+try:
+    mlat.mlat([(inline[i], mlat.teststamps[i]) for i in (0, 1, 2)], mlat.testalt)
+    print "Solved with collinear stations"
+    sys.exit(1)
+except Exception, e:
+    print "Collinear stations: %s" % e
@@ -1,13 +1,13 @@
 #!/usr/bin/python
 import math
 import numpy
-from scipy.ndimage import map_coordinates
 
 #functions for multilateration.
 
 #NB: because of the way this solver works, at least 3 stations and timestamps
 #are required. this function will not return hyperbolae for underconstrained systems.
-#TODO: get HDOP out of this so we can draw circles of likely position and indicate constraint
+#along with each position you get the covariance and HDOP/VDOP from the final Jacobian,
+#so you can draw circles of likely position and see how well constrained a fix is.
 
 ##########################NOTES#########################################
 #you should test your solver with a reference dataset that you've calculated. let's put one together.
@@ -89,13 +89,54 @@ wgs84_geoid = numpy.array([[13,13,13,13,13,13,13,13,13,13,13,13,13,13,13,13,13,1
                [-53,-54,-55,-52,-48,-42,-38,-38,-29,-26,-26,-24,-23,-21,-19,-16,-12,-8,-4,-1,1,4,4,6,5,4,2,-6,-15,-24,-33,-40,-48,-50,-53,-52],     #80S
                [-30,-30,-30,-30,-30,-30,-30,-30,-30,-30,-30,-30,-30,-30,-30,-30,-30,-30,-30,-30,-30,-30,-30,-30,-30,-30,-30,-30,-30,-30,-30,-30,-30,-30,-30,-30]], #90S
                dtype=numpy.float)
-               
+
+#the spline goes through every point in the table, so it isn't the table itself that
+#gets interpolated but a set of cubic B-spline coefficients worked out from it. the
+#table doesn't change, so do that once here. the ends of each axis are mirrored, so
+#the coefficients solve one small tridiagonal system per axis.
+def _mirror(i, n):
+    i = numpy.abs(i)
+    return numpy.where(i > n-1, 2*(n-1) - i, i)
+
+def _bspline_filter(n):
+    A = numpy.zeros((n, n))
+    for i in range(0, n):
+        A[i, i] = 4/6.0
+        A[i, _mirror(i-1, n)] += 1/6.0
+        A[i, _mirror(i+1, n)] += 1/6.0
+    return A
+
+wgs84_geoid_coefs = numpy.linalg.solve(_bspline_filter(wgs84_geoid.shape[0]), wgs84_geoid)
+wgs84_geoid_coefs = numpy.linalg.solve(_bspline_filter(wgs84_geoid.shape[1]), wgs84_geoid_coefs.T).T
+
+#cubic B-spline weights and mirrored table indices for the four taps around each of x
+def _bspline_taps(x, n):
+    taps = numpy.floor(x).astype(int)[..., None] + numpy.arange(-1, 3)
+    t = numpy.abs(x[..., None] - taps)
+    weights = numpy.where(t < 1, 2/3.0 - t**2 + t**3/2, (2 - numpy.minimum(t, 2))**3 / 6)
+    return (_mirror(taps, n), weights)
+
+def _geoid_spline(yi, xi):
+    (ytaps, yweights) = _bspline_taps(yi, wgs84_geoid.shape[0])
+    (xtaps, xweights) = _bspline_taps(xi, wgs84_geoid.shape[1])
+    coefs = wgs84_geoid_coefs[ytaps[..., :, None], xtaps[..., None, :]]
+    return numpy.einsum("...i,...ij,...j->...", yweights, coefs, xweights)
+
 #ok this calculates the geoid offset from the reference ellipsoid
 #combined with LLH->ECEF this gets you XYZ for a ground-referenced point
+#lat and lon can be numbers or arrays; you get back the same.
+#the table stops at 170E, so between there and 180 go straight across to the other edge.
 def wgs84_height(lat, lon):
-    yi = numpy.array([9-lat/10.0])
-    xi = numpy.array([18+lon/10.0])
-    return float(map_coordinates(wgs84_geoid, [yi, xi]))
+    if numpy.isscalar(lat) and numpy.isscalar(lon):
+        return float(_wgs84_height(numpy.array(lat, dtype=float), numpy.array(lon, dtype=float)))
+    return _wgs84_height(numpy.asarray(lat, dtype=float), numpy.asarray(lon, dtype=float))
+
+def _wgs84_height(lat, lon):
+    yi = 9 - lat/10.0
+    xi = (18 + lon/10.0) % 36
+    wrap = numpy.clip(xi - 35, 0, 1)
+    xi = numpy.minimum(xi, 35)
+    return (1 - wrap) * _geoid_spline(yi, xi) + wrap * _geoid_spline(yi, numpy.zeros(xi.shape))
 
 #WGS84 reference ellipsoid constants
 wgs84_a = 6378137.0
@@ -139,18 +180,70 @@ def llh2geoid((lat, lon, alt)):
     (x,y,z) = llh2ecef((lat, lon, alt + wgs84_height(lat, lon)))
     return [x,y,z]
 
+#array versions of ecef2llh and llh2ecef, for doing lots of positions at once.
+#xyz is (..., 3); lat, lon and alt are arrays of the same shape.
+def ecef2llh_array(xyz):
+    (x, y, z) = (xyz[..., 0], xyz[..., 1], xyz[..., 2])
+    ep  = math.sqrt((wgs84_a2 - wgs84_b2) / wgs84_b2)
+    p   = numpy.hypot(x, y)
+    th  = numpy.arctan2(wgs84_a*z, wgs84_b*p)
+    lon = numpy.arctan2(y, x)
+    lat = numpy.arctan2(z+ep**2*wgs84_b*numpy.sin(th)**3, p-wgs84_e2*wgs84_a*numpy.cos(th)**3)
+    N   = wgs84_a / numpy.sqrt(1-wgs84_e2*numpy.sin(lat)**2)
+    alt = p / numpy.cos(lat) - N
+
+    return (numpy.degrees(lat), numpy.degrees(lon), alt)
+
+def llh2ecef_array(lat, lon, alt):
+    lat = numpy.radians(lat)
+    lon = numpy.radians(lon)
+    n = wgs84_a / numpy.sqrt(1 - wgs84_e2*(numpy.sin(lat)**2))
+
+    x = (n + alt)*numpy.cos(lat)*numpy.cos(lon)
+    y = (n + alt)*numpy.cos(lat)*numpy.sin(lon)
+    z = (n*(1-wgs84_e2)+alt)*numpy.sin(lat)
+
+    return numpy.concatenate([x[..., None], y[..., None], z[..., None]], axis=-1)
+
+#stations don't move, so there's no need to look up the geoid for each one every time.
+#this is the only place positions are remembered: there are only ever as many as
+#there are receivers, where aircraft positions would pile up without end.
+_station_cache = {}
+def station_ecef(station):
+    key = tuple(station)
+    xyz = _station_cache.get(key)
+    if xyz is None:
+        xyz = numpy.array(llh2geoid(station))
+        _station_cache[key] = xyz
+    return xyz
+
 
 c = 299792458 / 1.0003 #modified for refractive index of air, why not
 
-#here's some test data to validate the algorithm
+#here's some test data to validate the algorithm: the reply goes out at t=10 and
+#each station stamps it when it gets there
 teststations = [[37.76225, -122.44254, 100], [37.409044, -122.077748, 100], [37.585085, -121.986395, 100]]
 testalt      = 8000
 testplane    = numpy.array(llh2ecef([37.617175,-122.380843, testalt]))
 testme       = llh2geoid(teststations[0])
-teststamps   = [10, 
-                10 + numpy.linalg.norm(testplane-numpy.array(llh2geoid(teststations[1]))) / c,
-                10 + numpy.linalg.norm(testplane-numpy.array(llh2geoid(teststations[2]))) / c,
-               ]
+teststamps   = [10 + numpy.linalg.norm(testplane-numpy.array(llh2geoid(station))) / c for station in teststations]
+
+#the measurement model. nobody knows when the aircraft transmitted, only when each
+#station heard it, so what the timestamps give us is how much further the aircraft is
+#from each station than from the first one: c*(t_i - t_0) = |s_i - x| - |x|, with
+#x and the stations relative to the first station. the last row of rel_stations is
+#the center of the earth, and its observation is the plain distance to it, from the
+#aircraft's altitude. returns the modelled observations and their Jacobian for each
+#solve, for positions xguess (solves, 3).
+def mlat_model(rel_stations, xguess):
+    diff = rel_stations - xguess[:, None, :]
+    ranges = numpy.sqrt(numpy.sum(diff**2, axis=2))
+    H = -diff / ranges[..., None]
+    r0 = numpy.sqrt(numpy.sum(xguess**2, axis=1))
+    est = ranges.copy()
+    est[:, :-1] -= r0[:, None]
+    H[:, :-1] -= (xguess / r0[:, None])[:, None, :]
+    return (est, H)
 
 #this function is the iterative solver core of the mlat function below
 #we use limit as a goal to stop solving when we get "close enough" (error magnitude in meters for that iteration)
@@ -158,78 +251,279 @@ teststamps   = [10,
 #it's possible this could fail in situations where the solution converges slowly
 #because the change in ERROR is not necessarily the error itself
 #still, it should converge quickly when close, so it SHOULDN'T give more than 2-3x the precision in total error
-def mlat_iter(rel_stations, prange_obs, xguess = [0,0,0], limit = 20, maxrounds = 50):
-    xerr = [1e9, 1e9, 1e9]
-    rounds = 0
-    while numpy.linalg.norm(xerr) > limit:
-        prange_est = []
-        for station in rel_stations:
-            prange_est.append([numpy.linalg.norm(station - xguess)])
-        dphat = prange_obs - prange_est
-        H = []
-        for row in range(0,len(rel_stations)):
-            H.append((numpy.array(-rel_stations[row,:])-xguess) / prange_est[row])
-        H = numpy.array(H)
-        #now we have H, the Jacobian, and can solve for residual error
-        xerr = numpy.dot(numpy.linalg.solve(numpy.dot(H.T,H), H.T), dphat).flatten()
-        xguess += xerr
-        rounds += 1
-        if rounds > maxrounds:
-            raise Exception("Failed to converge!")
-            break
-    return xguess
+#prange_obs is the range differences to the stations and then the range to the center
+#of the earth, as in mlat_model. the guess can't be the first station itself, where
+#the range difference has no gradient; by default it's the middle of the stations.
+def mlat_iter(rel_stations, prange_obs, xguess = None, limit = 20, maxrounds = 50):
+    rel_stations = numpy.array(rel_stations, dtype=float)[None, ...]
+    prange_obs = numpy.array(prange_obs, dtype=float).reshape(1, -1)
+    if xguess is None:
+        xguess = numpy.sum(rel_stations[0, :-1], axis=0) / len(rel_stations[0])
+    xguess = numpy.array(xguess, dtype=float).reshape(1, 3)
+    (xguess, converged, rounds) = mlat_solve(rel_stations, prange_obs, xguess, limit, maxrounds)
+    if not converged[0]:
+        raise Exception("Failed to converge!")
+    return xguess[0]
+
+#the same thing for a whole batch of solves with the same number of stations.
+#rel_stations is (solves, stations, 3), prange_obs is (solves, stations) and xguess is
+#(solves, 3). each round works out the residuals and Jacobians for every solve that
+#hasn't converged yet as arrays, and takes the least-squares step with an SVD rather
+#than going through H'H. returns the positions, an array saying which converged and
+#how many rounds each one took. weights, from mlat_weights, whitens the rows first so
+#each counts for what it's worth; without it they're all taken as equally good.
+def mlat_solve(rel_stations, prange_obs, xguess, limit = 20, maxrounds = 50, weights = None):
+    xguess = xguess.copy()
+    converged = numpy.zeros(len(xguess), dtype=bool)
+    iterations = numpy.zeros(len(xguess), dtype=int)
+    active = numpy.arange(len(xguess)) #the ones still going
+
+    with numpy.errstate(divide="ignore", invalid="ignore"): #a degenerate geometry just won't converge
+        for rounds in range(0, maxrounds):
+            if len(active) == 0:
+                break
+            (prange_est, H) = mlat_model(rel_stations[active], xguess[active])
+            dphat = prange_obs[active] - prange_est
+            if weights is not None:
+                H = numpy.einsum("ij,gjk->gik", weights, H)
+                dphat = numpy.einsum("ij,gj->gi", weights, dphat)
+
+            #anything that's blown up is never going to converge, and would take the
+            #SVD of the whole batch down with it
+            finite = numpy.isfinite(H).all(axis=2).all(axis=1) & numpy.isfinite(dphat).all(axis=1)
+            if not finite.all():
+                (active, H, dphat) = (active[finite], H[finite], dphat[finite])
+                if len(active) == 0:
+                    break
+
+            (u, sv, vt) = numpy.linalg.svd(H, full_matrices=False)
+            xerr = numpy.einsum("gik,gi->gk", vt, numpy.einsum("gji,gj->gi", u, dphat) / sv)
+            xguess[active] += xerr
+            iterations[active] += 1
+
+            done = numpy.sqrt(numpy.sum(xerr**2, axis=1)) <= limit
+            converged[active[done]] = True
+            active = active[~done]
+
+    return (xguess, converged, iterations)
+
+#how well the stations pin down a position, worked out before solving anything.
+#the rows here are the unit vectors from the first station to the others and straight
+#up. if those hardly span three dimensions (stations all in a line, or two of them in
+#the same place) no amount of iterating will give a good fix. returns the ratio of the
+#smallest to the largest singular value for each solve: 1 is ideal, 0 is hopeless.
+min_geometry = 0.02
+
+def mlat_geometry(rel_stations):
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        H = rel_stations / numpy.sqrt(numpy.sum(rel_stations**2, axis=2))[..., None]
+    geometry = numpy.zeros(len(rel_stations))
+    finite = numpy.isfinite(H).all(axis=2).all(axis=1)
+    if finite.any():
+        sv = numpy.linalg.svd(H[finite], compute_uv=False)
+        geometry[finite] = sv[:, -1] / sv[:, 0]
+    return geometry
+
+#how much each observation can be trusted. every timestamp is off by sigma meters
+#or so, independently, but every range difference shares the first station's
+#timestamp, so their errors are correlated: between them they have a covariance of
+#sigma^2 * (I + 11'). the altitude row is a different thing altogether, good to
+#sigma_alt meters and independent of the rest. returns W = L^-1, where LL' is that
+#covariance: W times the residuals are uncorrelated with unit variance.
+def mlat_weights(nstations, sigma, sigma_alt):
+    R = numpy.zeros((nstations, nstations))
+    R[:-1, :-1] = sigma**2 * (numpy.eye(nstations - 1) + 1)
+    R[-1, -1] = sigma_alt**2
+    return numpy.linalg.inv(numpy.linalg.cholesky(R))
+
+#the quality of a set of solutions from mlat_solve, from the Jacobian at the solution.
+#with the rows whitened by W from mlat_weights, (H'W'WH)^-1 is the covariance of the
+#position in ECEF, in meters^2. rotated into east/north/up at the solution, over sigma,
+#it gives HDOP and VDOP, so sigma*HDOP is the radius of likely position.
+#rms is what's left of the residuals, in meters. it's zero for three stations, since
+#then there's exactly one answer whether the timestamps are any good or not.
+def mlat_quality(rel_stations, prange_obs, xyzpos, lat, lon, sigma, sigma_alt):
+    (prange_est, H) = mlat_model(rel_stations, xyzpos)
+    rms = numpy.sqrt(numpy.mean((prange_obs - prange_est)**2, axis=1))
+
+    #V diag(1/s^2) V' is (H'W'WH)^-1 without forming H'W'WH
+    H = numpy.einsum("ij,gjk->gik", mlat_weights(H.shape[1], sigma, sigma_alt), H)
+    (u, sv, vt) = numpy.linalg.svd(H, full_matrices=False)
+    cov = numpy.einsum("gki,gk,gkj->gij", vt, 1.0 / sv**2, vt)
+
+    (lat, lon) = (numpy.radians(lat), numpy.radians(lon))
+    enu = numpy.empty((len(xyzpos), 3, 3))
+    enu[:, 0] = numpy.column_stack([-numpy.sin(lon), numpy.cos(lon), numpy.zeros(len(lon))])
+    enu[:, 1] = numpy.column_stack([-numpy.sin(lat)*numpy.cos(lon), -numpy.sin(lat)*numpy.sin(lon), numpy.cos(lat)])
+    enu[:, 2] = numpy.column_stack([numpy.cos(lat)*numpy.cos(lon), numpy.cos(lat)*numpy.sin(lon), numpy.sin(lat)])
+    cov_enu = numpy.einsum("gik,gkl,gjl->gij", enu, cov, enu)
+
+    hdop = numpy.sqrt(cov_enu[:, 0, 0] + cov_enu[:, 1, 1]) / sigma
+    vdop = numpy.sqrt(cov_enu[:, 2, 2]) / sigma
+    return (cov, hdop, vdop, rms)
 
 #func mlat:
 #uses a modified GPS pseudorange solver to locate aircraft by multilateration.
 #replies is a list of reports, in ([lat, lon, alt], timestamp) format
 #altitude is the barometric altitude of the aircraft as returned by the aircraft
-#returns the estimated position of the aircraft in (lat, lon, alt) geoid-corrected WGS84.
+#returns the estimated position of the aircraft in (lat, lon, alt) geoid-corrected WGS84,
+#and a dict saying how good it is (see mlat_batch).
 #let's make it take a list of tuples so we can sort by them
-def mlat(replies, altitude):
-    sorted_replies = sorted(replies, key=lambda time: time[1])
-
-    stations = []
-    timestamps = []
-    #i really couldn't figure out how to unpack this, sorry
-    for i in range(0, len(replies)):
-        stations.append( sorted_replies[i][0] )
-        timestamps.append( sorted_replies[i][1] )
-    
-    me_llh = stations[0]
-    me = llh2geoid(stations[0])
-    
-    rel_stations = [] #list of stations in XYZ relative to me
-    for station in stations[1:]:
-        rel_stations.append(numpy.array(llh2geoid(station)) - numpy.array(me))
-    rel_stations.append([0,0,0]-numpy.array(me)) #arne saknussemm, reporting in
-    rel_stations = numpy.array(rel_stations) #convert list of arrays to 2d array
-    
-    tdoa = []
-    for stamp in timestamps[1:]:
-        tdoa.append(stamp - timestamps[0])
-    
-    prange_obs = []
-    for stamp in tdoa:
-        prange_obs.append([c * stamp])
-
-    #so here we calc the estimated pseudorange to the center of the earth, using station[0] as a reference point for the geoid
-    #this is a necessary approximation since we don't know the location of the aircraft yet
-    #if the dang earth were actually round this wouldn't be an issue
-    prange_obs.append( [numpy.linalg.norm(llh2ecef((me_llh[0], me_llh[1], altitude)))] ) #use ECEF not geoid since alt is MSL not GPS
-    #prange_obs.append( [numpy.linalg.norm(testplane)]) #test for error
-    prange_obs = numpy.array(prange_obs)
-    
-    xyzpos = mlat_iter(rel_stations, prange_obs)
-    llhpos = ecef2llh(xyzpos+me)
-    
-    #now, we could return llhpos right now and be done with it.
-    #but the assumption we made above, namely that the aircraft is directly above the
-    #nearest station, results in significant error due to the oblateness of the Earth's geometry.
-    #so now we solve AGAIN, but this time with the corrected pseudorange of the aircraft altitude
-    #this might not be really useful in practice but the sim shows >50m errors without it
-    prange_obs[-1] = [numpy.linalg.norm(llh2ecef((llhpos[0], llhpos[1], altitude)))]
-    
-    xyzpos_corr = mlat_iter(rel_stations, prange_obs, xyzpos) #start off with a really close guess
-    llhpos = ecef2llh(xyzpos_corr+me)
-    
-    return llhpos
+def mlat(replies, altitude, sigma = 30.0, sigma_alt = 100.0):
+    (positions, converged, quality) = mlat_batch([replies], [altitude], sigma = sigma, sigma_alt = sigma_alt)
+    if not converged[0]:
+        if quality["geometry"][0] < min_geometry:
+            raise Exception("Station geometry too poor to solve!")
+        raise Exception("Failed to converge!")
+    return (list(positions[0]), dict((key, value[0]) for (key, value) in quality.items()))
+
+#func mlat_batch:
+#solves a lot of aircraft at once. groups is a list of reply lists, each one like
+#mlat's replies, and altitudes is the barometric altitude for each group.
+#returns (positions, converged, quality): an array with a [lat, lon, alt] for each
+#group, an array of bools saying which groups converged, and a dict of arrays:
+#  cov:      3x3 ECEF position covariance in meters^2, for an error of sigma meters
+#            in each timestamp (30m is about 100ns) and of sigma_alt meters in
+#            the altitude; see mlat_weights
+#  hdop:     horizontal position sigma over the timestamp sigma
+#  vdop:     vertical position sigma over the timestamp sigma
+#  rms:      RMS residual in meters
+#  rounds:   iterations the solver took
+#  geometry: the pre-solve check from mlat_geometry
+#groups that didn't converge, that have fewer than three replies, or whose stations
+#are too badly placed to bother trying get NaN instead of an exception.
+#the fixes are weighted the same way, so a barometric altitude that's well off
+#doesn't drag the position around as much as a good timestamp would.
+def mlat_batch(groups, altitudes, limit = 20, maxrounds = 50, sigma = 30.0, sigma_alt = 100.0):
+    positions = numpy.empty((len(groups), 3))
+    positions.fill(numpy.nan)
+    converged = numpy.zeros(len(groups), dtype=bool)
+    quality = _no_quality(len(groups))
+
+    #groups with the same number of stations can be solved as one set of arrays
+    sizes = {}
+    for (i, replies) in enumerate(groups):
+        if len(replies) >= 3:
+            sizes.setdefault(len(replies), []).append(i)
+
+    for indices in sizes.values():
+        (positions[indices], converged[indices], batch_quality) = _mlat_batch([groups[i] for i in indices],
+                                                                              numpy.array([altitudes[i] for i in indices], dtype=float),
+                                                                              limit, maxrounds, sigma, sigma_alt)
+        for (key, value) in batch_quality.items():
+            quality[key][indices] = value
+    return (positions, converged, quality)
+
+def _no_quality(n):
+    quality = {"cov":      numpy.empty((n, 3, 3)),
+               "hdop":     numpy.empty(n),
+               "vdop":     numpy.empty(n),
+               "rms":      numpy.empty(n),
+               "rounds":   numpy.zeros(n, dtype=int),
+               "geometry": numpy.zeros(n)}
+    for key in ("cov", "hdop", "vdop", "rms"):
+        quality[key].fill(numpy.nan)
+    return quality
+
+#the residuals left over at xyzpos, RMS in meters
+def mlat_rms(rel_stations, prange_obs, xyzpos):
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        (prange_est, H) = mlat_model(rel_stations, xyzpos)
+        return numpy.sqrt(numpy.mean((prange_obs - prange_est)**2, axis=1))
+
+#where _mlat_batch tries again from: every 45 degrees around the middle of the
+#stations, 100km and 250km out, as (north, east) in meters
+_restart_ring = [(d*math.cos(b), d*math.sin(b)) for d in (100e3, 250e3) for b in numpy.radians(range(0, 360, 45))]
+
+#returns the positions after another go from each point in _restart_ring, whether
+#each has converged now, and how many more rounds that took
+def _mlat_restart(rel_stations, prange_obs, me, lat, lon, altitudes, xyzpos, solved, rms, limit, maxrounds, weights):
+    (north, east) = numpy.array(_restart_ring).T
+    (n, starts) = (len(xyzpos), len(north))
+    lat_s = lat[:, None] + numpy.degrees(north[None, :] / wgs84_a)
+    lon_s = lon[:, None] + numpy.degrees(east[None, :] / (wgs84_a * numpy.cos(numpy.radians(lat))[:, None]))
+    xguess = llh2ecef_array(lat_s, lon_s, numpy.repeat(altitudes[:, None], starts, axis=1)) - me[:, None, :]
+
+    rel_stations = numpy.repeat(rel_stations, starts, axis=0)
+    prange_obs = numpy.repeat(prange_obs, starts, axis=0)
+    (xyz, ok, rounds) = mlat_solve(rel_stations, prange_obs, xguess.reshape(-1, 3), limit, maxrounds, weights)
+    fit = mlat_rms(rel_stations, prange_obs, xyz)
+    fit[~ok | ~numpy.isfinite(fit)] = numpy.inf
+
+    best = numpy.argmin(fit.reshape(n, starts), axis=1) + numpy.arange(n) * starts
+    better = numpy.isfinite(fit[best]) & (~solved | (fit[best] < rms))
+    xyzpos = numpy.where(better[:, None], xyz[best], xyzpos)
+    return (xyzpos, solved | better, rounds.reshape(n, starts).sum(axis=1))
+
+def _mlat_batch(groups, altitudes, limit, maxrounds, sigma, sigma_alt):
+    nstations = len(groups[0])
+    stations = numpy.empty((len(groups), nstations, 3))
+    timestamps = numpy.empty((len(groups), nstations))
+    for (i, replies) in enumerate(groups):
+        sorted_replies = sorted(replies, key=lambda time: time[1])
+        for (j, (station, timestamp)) in enumerate(sorted_replies):
+            stations[i, j] = station_ecef(station)
+            timestamps[i, j] = timestamp
+
+    #stations in XYZ relative to the first one to hear it, and the center of the earth
+    me = stations[:, 0, :]
+    rel_stations = numpy.empty(stations.shape)
+    rel_stations[:, :-1] = stations[:, 1:] - me[:, None, :]
+    rel_stations[:, -1] = -me #arne saknussemm, reporting in
+    middle = numpy.mean(stations, axis=1) - me
+
+    llhpos = numpy.empty((len(groups), 3))
+    llhpos.fill(numpy.nan)
+    converged = numpy.zeros(len(groups), dtype=bool)
+    quality = _no_quality(len(groups))
+    quality["geometry"] = mlat_geometry(rel_stations)
+
+    #don't waste any iterations on stations that can't give a decent answer
+    good = numpy.flatnonzero(quality["geometry"] >= min_geometry)
+    if len(good) == 0:
+        return (llhpos, converged, quality)
+    (me, middle, altitudes) = (me[good], middle[good], altitudes[good])
+    (rel_stations, timestamps) = (rel_stations[good], timestamps[good])
+
+    weights = mlat_weights(nstations, sigma, sigma_alt)
+    prange_obs = numpy.empty(timestamps.shape)
+    prange_obs[:, :-1] = c * (timestamps[:, 1:] - timestamps[:, :1])
+
+    #see mlat_iter's notes: solve once with the aircraft's altitude as though it were
+    #above the middle of the stations, starting from there, then again with it above
+    #where we think it is. use ECEF not geoid since alt is MSL not GPS
+    (lat, lon, alt) = ecef2llh_array(middle + me)
+    xguess = llh2ecef_array(lat, lon, altitudes)
+    prange_obs[:, -1] = numpy.sqrt(numpy.sum(xguess**2, axis=1))
+    (xyzpos, solved, rounds) = mlat_solve(rel_stations, prange_obs, xguess - me, limit, maxrounds, weights)
+
+    #an aircraft well outside the stations can leave the solver stuck somewhere that
+    #isn't the answer. with more than three stations that shows as residuals far bigger
+    #than the timing error, so those (and any that didn't converge) get another go from
+    #a ring of starting points around the stations, keeping whichever fits best.
+    rms = mlat_rms(rel_stations, prange_obs, xyzpos)
+    rms[~numpy.isfinite(rms)] = numpy.inf
+    retry = ~solved
+    if nstations > 3:
+        retry |= rms > 3*sigma
+    retry = numpy.flatnonzero(retry)
+    if len(retry):
+        (xyzpos[retry], solved[retry], more) = _mlat_restart(rel_stations[retry], prange_obs[retry], me[retry], lat[retry], lon[retry],
+                                                             altitudes[retry], xyzpos[retry], solved[retry], rms[retry], limit, maxrounds, weights)
+        rounds[retry] += more
+    (lat, lon, alt) = ecef2llh_array(xyzpos + me)
+
+    prange_obs[:, -1] = numpy.sqrt(numpy.sum(llh2ecef_array(lat, lon, altitudes)**2, axis=1))
+    (xyzpos, solved_corr, rounds_corr) = mlat_solve(rel_stations, prange_obs, xyzpos, limit, maxrounds, weights) #start off with a really close guess
+    solved &= solved_corr
+    quality["rounds"][good] = rounds + rounds_corr
+
+    (lat, lon, alt) = ecef2llh_array(xyzpos + me)
+    done = numpy.flatnonzero(solved)
+    if len(done):
+        (cov, hdop, vdop, rms) = mlat_quality(rel_stations[done], prange_obs[done], xyzpos[done], lat[done], lon[done], sigma, sigma_alt)
+        for (key, value) in (("cov", cov), ("hdop", hdop), ("vdop", vdop), ("rms", rms)):
+            quality[key][good[done]] = value
+        llhpos[good[done]] = numpy.column_stack([lat[done], lon[done], alt[done]])
+    converged[good] = solved
+    return (llhpos, converged, quality)
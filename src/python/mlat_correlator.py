@@ -0,0 +1,167 @@
+#
+# Copyright 2010 Nick Foster
+#
+# This file is part of gr-air-modes
+#
+# gr-air-modes is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# gr-air-modes is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with gr-air-modes; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+#matches up the same reply heard by several receivers, for mlat.
+#every receiver feeds in its frames with their timestamps; any frames with
+#identical bytes that arrive within the time it takes a reply to cross the
+#receiver network are the same transmission, and once three or more receivers
+#have heard one it comes out in the (station, timestamp) reply format mlat()
+#and mlat_batch() take.
+
+import heapq
+import numpy
+import mlat
+
+#one transmission and the receivers that have heard it so far
+class reply_group(object):
+    __slots__ = ["data", "tmin", "tmax", "replies"]
+
+    def __init__(self, data, station, timestamp):
+        self.data = data
+        self.tmin = timestamp
+        self.tmax = timestamp
+        self.replies = {station: timestamp}
+
+#stations is a dict of station name to [lat, lon, alt], the same as in mlat()'s replies.
+#window is how far apart in time two copies of a reply can be; by default it's
+#the time light takes to cross the longest baseline, plus clock_error for the
+#receivers' clocks. the feeds won't arrive in step, so a group isn't finished
+#until frames from delay seconds after it have been seen from some receiver.
+#
+#pending groups are indexed by the frame bytes, for matching, and by the time
+#they started in buckets bucket seconds wide, for finishing them off in order.
+#no more than max_pending are kept; past that the oldest are finished early.
+class mlat_correlator:
+    def __init__(self, stations = {}, window = None, delay = 0.5, min_stations = 3,
+                 max_pending = 100000, bucket = 0.01, clock_error = 1e-5):
+        self._stations = {}
+        self._fixed_window = window
+        self._delay = delay
+        self._min_stations = min_stations
+        self._max_pending = max_pending
+        self._bucket = bucket
+        self._clock_error = clock_error
+
+        self._pending = {} #frame bytes to the groups waiting with those bytes
+        self._buckets = {} #bucket number to the groups that started in it
+        self._heap = [] #bucket numbers, so the oldest is always first
+        self._npending = 0
+        self._epoch = None #whole seconds add_frame counts from, see there
+        self._watermark = float("-inf") #groups that ended before this are finished
+        self._horizon = float("-inf") #frames before this are too late to group
+
+        self._stats = {"frames": 0, "groups": 0, "emitted": 0, "too_few": 0,
+                       "late": 0, "evicted": 0}
+
+        self.window = window or 0
+        for (station, position) in stations.items():
+            self.add_station(station, position)
+
+    def add_station(self, station, position):
+        self._stations[station] = list(position)
+        if self._fixed_window is None:
+            xyz = numpy.array([mlat.station_ecef(p) for p in self._stations.values()])
+            baseline = numpy.sqrt(numpy.sum((xyz[:, None, :] - xyz[None, :, :])**2, axis=2)).max()
+            self.window = baseline / mlat.c + self._clock_error
+
+    #a modes_frame; short packets only fill the first 7 bytes. frame.timestamp is
+    #only good to a few hundred ns that far from 1970, so the timestamps are counted
+    #from the first frame's second instead, which is plenty for mlat's differences.
+    def add_frame(self, station, frame):
+        if self._epoch is None:
+            self._epoch = frame.timestamp_secs
+        timestamp = (frame.timestamp_secs - self._epoch) + frame.timestamp_frac
+        if frame.long:
+            return self.add(station, frame.data, timestamp)
+        return self.add(station, frame.data[:7], timestamp)
+
+    #returns a list of the groups finished by this frame coming in, as
+    #(data, replies) with replies in mlat()'s format
+    def add(self, station, data, timestamp):
+        if station not in self._stations:
+            raise KeyError("Unknown station %s" % (station,))
+        self._stats["frames"] += 1
+        if timestamp < self._horizon:
+            self._stats["late"] += 1
+            return []
+
+        groups = self._pending.get(data)
+        if groups is None:
+            groups = self._pending[data] = []
+        for group in groups:
+            if station not in group.replies \
+               and max(timestamp, group.tmax) - min(timestamp, group.tmin) <= self.window:
+                group.replies[station] = timestamp
+                group.tmin = min(group.tmin, timestamp)
+                group.tmax = max(group.tmax, timestamp)
+                break
+        else:
+            group = reply_group(data, station, timestamp)
+            groups.append(group)
+            b = int(timestamp // self._bucket)
+            bucket = self._buckets.get(b)
+            if bucket is None:
+                bucket = self._buckets[b] = []
+                heapq.heappush(self._heap, b)
+            bucket.append(group)
+            self._npending += 1
+            self._stats["groups"] += 1
+
+        if timestamp - self._delay > self._watermark:
+            self._watermark = timestamp - self._delay
+
+        done = []
+        #a bucket's done when everything in it is more than a window older than the watermark
+        limit = (self._watermark - self.window) / self._bucket - 1
+        while self._heap and self._heap[0] <= limit:
+            self._close(heapq.heappop(self._heap), done)
+        while self._npending > self._max_pending:
+            self._stats["evicted"] += len(self._buckets[self._heap[0]])
+            self._close(heapq.heappop(self._heap), done)
+        return done
+
+    #finish everything that's still waiting, for when the feeds stop
+    def flush(self):
+        done = []
+        while self._heap:
+            self._close(heapq.heappop(self._heap), done)
+        return done
+
+    def _close(self, b, done):
+        for group in self._buckets.pop(b):
+            groups = self._pending[group.data]
+            groups.remove(group)
+            if not groups:
+                del self._pending[group.data]
+            self._npending -= 1
+
+            if len(group.replies) >= self._min_stations:
+                replies = [(self._stations[station], timestamp) for (station, timestamp) in group.replies.items()]
+                done.append((group.data, replies))
+                self._stats["emitted"] += 1
+            else:
+                self._stats["too_few"] += 1
+        self._horizon = max(self._horizon, (b + 1) * self._bucket)
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats["pending"] = self._npending
+        return stats
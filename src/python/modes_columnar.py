@@ -0,0 +1,199 @@
+#
+# Copyright 2010 Nick Foster
+# 
+# This file is part of gr-air-modes
+# 
+# gr-air-modes is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+# 
+# gr-air-modes is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with gr-air-modes; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+# 
+
+
+import time, os, sys, zipfile
+from cStringIO import StringIO
+from modes_parse import *
+import numpy
+import numpy.lib.format
+
+#pyarrow is optional. without it we write .npz files instead of Parquet.
+try:
+  import pyarrow
+  import pyarrow.parquet
+except ImportError:
+  pyarrow = None
+
+#every decoded report, one row each, in column files for offline analysis. a column
+#a report doesn't have (lat and lon in a velocity report, say) is NaN.
+columns = [("icao", numpy.uint32),
+           ("time", numpy.float64),    #seconds since the epoch
+           ("df", numpy.uint8),
+           ("altitude", numpy.float32),#feet
+           ("lat", numpy.float64),
+           ("lon", numpy.float64),
+           ("velocity", numpy.float32),#knots
+           ("heading", numpy.float32), #degrees
+           ("vertical", numpy.float32),#feet per minute
+           ("signal", numpy.float32)]  #the frame's reference level
+
+#rows are collected chunk_rows at a time and each chunk is compressed and appended to
+#the current file: a row group in a Parquet file, or one .npy per column in an .npz,
+#which is just a zip (icao.000000.npy, time.000000.npy, icao.000001.npy...). either
+#way a reader can load only the columns it wants; read_columns() does that for both.
+#when traffic is light, update() writes out a short chunk once the oldest row has
+#waited flush_interval seconds, so a crash never loses more than that.
+#a new file is started every roll_interval seconds or once the current one is
+#roll_size bytes. files are named for when they were started, and carry a .part
+#suffix until they're finished, so anything without one won't change again.
+class modes_output_columnar:
+  def __init__(self, directory, roll_interval=3600, roll_size=256*1024*1024, chunk_rows=65536, flush_interval=60,
+               parquet=None, clock=time.time):
+    if parquet is None:
+      parquet = pyarrow is not None
+    elif parquet and pyarrow is None:
+      raise ImportError("Parquet output needs pyarrow")
+
+    self._directory = directory
+    self._roll_interval = roll_interval
+    self._roll_size = roll_size
+    self._chunk_rows = chunk_rows
+    self._flush_interval = flush_interval
+    self._parquet = parquet
+    self._clock = clock
+    self._rows = dict([(name, []) for (name, dtype) in columns])
+    self._nrows = 0
+    self._waiting = None #when the oldest row not yet written came in
+    self._filename = None #the file being written, without the .part
+    self._started = None
+    self._nchunks = 0
+    self._writer = None #the ParquetWriter, if we're writing Parquet
+
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+
+  def output(self, report):
+    rows = self._rows
+    frame = report.frame
+    nan = float("nan")
+
+    altitude = getattr(report, "altitude", None)
+    if not isinstance(altitude, int): #missing, or a string for metric altitudes
+      altitude = nan
+    lat = getattr(report, "lat", None)
+    lon = getattr(report, "lon", None)
+    if lat is None:
+      (lat, lon) = (nan, nan)
+    if isinstance(report, velocity):
+      (speed, heading, vertical) = (report.velocity, report.heading, report.vert_spd)
+    else:
+      (speed, heading, vertical) = (nan, nan, nan)
+
+    rows["icao"].append(report.icao)
+    rows["time"].append(frame.timestamp)
+    rows["df"].append(frame.msgtype)
+    rows["altitude"].append(altitude)
+    rows["lat"].append(lat)
+    rows["lon"].append(lon)
+    rows["velocity"].append(speed)
+    rows["heading"].append(heading)
+    rows["vertical"].append(vertical)
+    rows["signal"].append(frame.reference)
+    if not self._nrows:
+      self._waiting = self._clock()
+    self._nrows += 1
+
+    if self._nrows >= self._chunk_rows:
+      self.flush()
+
+  def update(self):
+    #writes out rows that have waited long enough, and starts a new file on time
+    #even if nothing's come in to notice
+    now = self._clock()
+    if self._nrows and now - self._waiting >= self._flush_interval:
+      self.flush()
+    if self._filename is not None and now - self._started >= self._roll_interval:
+      self.flush()
+      self.roll()
+
+  def flush(self):
+    #appends whatever rows are waiting to the current file
+    if not self._nrows:
+      return
+    if self._filename is None:
+      self.open()
+
+    arrays = [(name, numpy.array(self._rows[name], dtype=dtype)) for (name, dtype) in columns]
+    part = self._filename + ".part"
+    if self._parquet:
+      table = pyarrow.Table.from_arrays([pyarrow.array(array) for (name, array) in arrays], [name for (name, array) in arrays])
+      self._writer.write_table(table)
+    else:
+      f = zipfile.ZipFile(part, "a", zipfile.ZIP_DEFLATED, True)
+      for (name, array) in arrays:
+        npy = StringIO()
+        numpy.lib.format.write_array(npy, array)
+        f.writestr("%s.%06i.npy" % (name, self._nchunks), npy.getvalue())
+      f.close()
+    self._nchunks += 1
+
+    for (name, dtype) in columns:
+      self._rows[name] = []
+    self._nrows = 0
+
+    if self._clock() - self._started >= self._roll_interval or os.path.getsize(part) >= self._roll_size:
+      self.roll()
+
+  def open(self):
+    self._started = self._clock()
+    base = os.path.join(self._directory, time.strftime("modes-%Y%m%d-%H%M%S", time.gmtime(self._started)))
+    ext = self._parquet and ".parquet" or ".npz"
+    self._filename = base + ext
+    n = 1
+    while os.path.exists(self._filename) or os.path.exists(self._filename + ".part"): #more than one in a second
+      self._filename = "%s-%i%s" % (base, n, ext)
+      n += 1
+    self._nchunks = 0
+    if self._parquet:
+      schema = pyarrow.schema([(name, pyarrow.from_numpy_dtype(dtype)) for (name, dtype) in columns])
+      self._writer = pyarrow.parquet.ParquetWriter(self._filename + ".part", schema)
+
+  def roll(self):
+    #finishes the current file; the next chunk starts another
+    if self._filename is None:
+      return
+    if self._writer is not None:
+      self._writer.close()
+      self._writer = None
+    os.rename(self._filename + ".part", self._filename)
+    self._filename = None
+
+  def close(self):
+    self.flush()
+    self.roll()
+
+def read_columns(filename, names=None):
+  #returns {column name: numpy array} from a file modes_output_columnar wrote,
+  #reading only the columns in names (or all of them)
+  if names is None:
+    names = [name for (name, dtype) in columns]
+
+  if filename.endswith(".parquet") or filename.endswith(".parquet.part"):
+    table = pyarrow.parquet.read_table(filename, columns=names)
+    return dict([(name, table.column(name).to_pandas().values) for name in names])
+
+  npz = numpy.load(filename)
+  chunks = sorted(npz.files)
+  retval = {}
+  for name in names:
+    retval[name] = numpy.concatenate([npz[chunk] for chunk in chunks if chunk.rsplit(".", 1)[0] == name])
+  return retval
@@ -0,0 +1,75 @@
+#
+# Copyright 2010 Nick Foster
+#
+# This file is part of gr-air-modes
+#
+# gr-air-modes is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# gr-air-modes is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with gr-air-modes; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+import struct
+from binascii import hexlify
+
+#this is the binary frame record the slicer puts on the message queue.
+#it has to match struct modes_frame_record in air_modes_types.h:
+#14 raw packet bytes, downlink format, packet type, parity syndrome,
+#reference level and timestamp (whole seconds and fraction), packed with no padding.
+frame_record = struct.Struct("=14sBBIfQd")
+
+#framer_packet_type values from air_modes_types.h
+Short_Packet = 1
+Long_Packet = 3
+
+#a decoded frame. the slicer output is unpacked exactly once into one of
+#these and the same object is handed to every output plugin.
+#shortdata is the first 32 bits (DF + 24 bits of data), longdata is the
+#56-bit ME field of a long packet (0 for short packets), parity is the
+#last 24 bits of the packet and ecc is the syndrome the slicer computed.
+#timestamp is when the preamble arrived, in seconds since the epoch, from the
+#sample count and the receiver's clock. a double that size only goes down to a
+#few hundred ns, so for mlat use timestamp_secs and timestamp_frac instead.
+class modes_frame(object):
+  __slots__ = ["data", "msgtype", "long", "shortdata", "longdata", "parity", "ecc", "reference",
+               "timestamp", "timestamp_secs", "timestamp_frac"]
+
+  def __init__(self, record):
+    [data, msgtype, ptype, ecc, reference, secs, frac] = frame_record.unpack(record)
+
+    self.data = data
+    self.msgtype = msgtype
+    self.long = (ptype == Long_Packet)
+    self.ecc = ecc
+    self.reference = reference
+    self.timestamp_secs = secs
+    self.timestamp_frac = frac
+    self.timestamp = secs + frac
+
+    if self.long:
+      bits = long(hexlify(data), 16)
+      self.shortdata = bits >> 80
+      self.longdata = (bits >> 24) & 0xFFFFFFFFFFFFFF
+    else:
+      bits = long(hexlify(data[0:7]), 16)
+      self.shortdata = bits >> 24
+      self.longdata = 0
+    self.parity = bits & 0xFFFFFF
+
+  def __str__(self):
+    #same layout as the old text format, handy for logging and debugging
+    return "%02i %08x %014x %06x %06x %f %i.%09i" % (self.msgtype, self.shortdata, self.longdata, self.parity, self.ecc, self.reference,
+                                                    self.timestamp_secs, int(self.timestamp_frac * 1e9))
+
+def from_message(msg):
+  return modes_frame(msg.to_string())
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+#
+# Copyright 2010 Nick Foster
+#
+# This file is part of gr-air-modes
+#
+# gr-air-modes is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# gr-air-modes is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with gr-air-modes; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+#writes a file of synthetic Mode S traffic, as complex floats, that uhd_modes.py
+#can replay with -F. every frame is built from scratch with a correct CRC, so the
+#file doubles as a known-answer test and as a benchmark load when there's no radio.
+#noise power is 1, so a frame at S dB SNR has a pulse amplitude of 10^(S/20).
+
+my_position = [37.76225, -122.44254]
+
+from optparse import OptionParser
+import numpy, random, math, sys
+from modes_parity import modes_append_parity
+from cpr import cpr_encode
+
+chip_rate = 2000000
+
+def df17(icao, me):
+  return modes_append_parity((((17 << 3) | 5) << 80) | (icao << 56) | me, 88)
+
+def df11(icao, ca=5):
+  return modes_append_parity((((11 << 3) | ca) << 24) | icao, 32)
+
+def df4(icao, altitude):
+  return modes_append_parity((4 << 27) | encode_alt13(altitude), 32, icao)
+
+def df5(icao, squawk):
+  return modes_append_parity((5 << 27) | encode_squawk(squawk), 32, icao)
+
+#12-bit AC field with the Q bit set, 25ft resolution
+def encode_alt12(altitude):
+  n = int((altitude + 1000) / 25)
+  return ((n >> 4) << 5) | 0x10 | (n & 0x0F)
+
+#13-bit AC field as seen in DF0/4/20: the 12-bit field with M=0 slotted in at bit 6
+def encode_alt13(altitude):
+  ac = encode_alt12(altitude)
+  return ((ac & 0xFC0) << 1) | (ac & 0x3F)
+
+#13-bit ID field, bits in the order C1 A1 C2 A2 C4 A4 X B1 D1 B2 D2 B4 D4
+def encode_squawk(squawk):
+  [a, b, c, d] = [int(x) for x in "%04o" % squawk]
+  order = [(c,1), (a,1), (c,2), (a,2), (c,4), (a,4), (0,0), (b,1), (d,1), (b,2), (d,2), (b,4), (d,4)]
+  field = 0
+  for (digit, weight) in order:
+    field = (field << 1) | int(bool(digit & weight))
+  return field
+
+_charset = "#ABCDEFGHIJKLMNOPQRSTUVWXYZ##### ###############0123456789######"
+
+def ident_me(callsign):
+  me = 4 << 51
+  for i in range(0, 8):
+    me |= _charset.index(callsign.ljust(8)[i]) << (42-6*i)
+  return me
+
+def position_me(lat, lon, altitude, ctype):
+  [enclat, enclon] = cpr_encode(lat, lon, ctype, 0)
+  return (11 << 51) | (encode_alt12(altitude) << 36) | (ctype << 34) | (enclat << 17) | enclon
+
+def velocity_me(ns_vel, ew_vel, vert_spd):
+  me = (19 << 51) | (1 << 48)
+  me |= (int(ew_vel < 0) << 42) | ((abs(int(ew_vel)) + 1) << 32)
+  me |= (int(ns_vel < 0) << 31) | ((abs(int(ns_vel)) + 1) << 21)
+  me |= (int(vert_spd < 0) << 19) | ((abs(int(vert_spd)) / 64 + 1) << 10)
+  return me
+
+#a made-up aircraft somewhere within ~150km of the receiver. it doesn't move;
+#each call to next_frame() hands out the next reply in a fixed rotation.
+class aircraft:
+  def __init__(self, rng, location):
+    self.icao = rng.randint(0x000001, 0xFFFFFF)
+    self.callsign = "".join([rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for i in range(3)]) + "%i" % rng.randint(1, 9999)
+    self.lat = location[0] + rng.uniform(-1.3, 1.3)
+    self.lon = location[1] + rng.uniform(-1.6, 1.6)
+    self.altitude = rng.randint(40, 1600) * 25
+    self.ns_vel = rng.randint(-400, 400)
+    self.ew_vel = rng.randint(-400, 400)
+    self.vert_spd = rng.randint(-30, 30) * 64
+    self.squawk = rng.randint(0, 07777)
+    self.seq = 0
+
+  def next_frame(self):
+    self.seq += 1
+    which = self.seq % 7
+    if which == 0:
+      return (17, True, df17(self.icao, ident_me(self.callsign)))
+    elif which == 1:
+      return (17, True, df17(self.icao, position_me(self.lat, self.lon, self.altitude, 0)))
+    elif which == 2:
+      return (17, True, df17(self.icao, position_me(self.lat, self.lon, self.altitude, 1)))
+    elif which == 3:
+      return (17, True, df17(self.icao, velocity_me(self.ns_vel, self.ew_vel, self.vert_spd)))
+    elif which == 4:
+      return (11, False, df11(self.icao))
+    elif which == 5:
+      return (4, False, df4(self.icao, self.altitude))
+    else:
+      return (5, False, df5(self.icao, self.squawk))
+
+#pulse-position modulates a packet, preamble included, at samples_per_chip
+def modulate(bits, nbits, samples_per_chip):
+  chips = numpy.zeros(16 + 2*nbits, dtype=numpy.float32)
+  chips[[0, 2, 7, 9]] = 1.0
+  data = numpy.array([(bits >> (nbits-1-i)) & 1 for i in range(0, nbits)], dtype=numpy.float32)
+  chips[16::2] = data
+  chips[17::2] = 1.0 - data
+  return numpy.repeat(chips, samples_per_chip)
+
+def noise(nprng, n):
+  return ((nprng.standard_normal(n) + 1j * nprng.standard_normal(n)) * math.sqrt(0.5)).astype(numpy.complex64)
+
+if __name__ == '__main__':
+  usage = "%prog: [options] output filename"
+  parser = OptionParser(usage=usage)
+  parser.add_option("-r", "--rate", type="float", default=4000000,
+                      help="sample rate, a multiple of 2MHz [default=%default]")
+  parser.add_option("-s", "--snr", type="string", default="10,15,20,30",
+                      help="comma-separated list of SNRs in dB [default=%default]")
+  parser.add_option("-c", "--count", type="int", default=1000,
+                      help="number of frames at each SNR [default=%default]")
+  parser.add_option("-g", "--gap", type="float", default=400,
+                      help="microseconds of noise between frames [default=%default]")
+  parser.add_option("-a", "--aircraft", type="int", default=20,
+                      help="number of aircraft to make up [default=%default]")
+  parser.add_option("-l","--location", type="string", default=None,
+                      help="GPS coordinates the aircraft are scattered around, in format xx.xxxxx,xx.xxxxx (latlon)")
+  parser.add_option("-m", "--manifest", type="string", default=None,
+                      help="also write a list of sample offset, SNR and hex for every frame to this file")
+  parser.add_option("-S", "--seed", type="int", default=0,
+                      help="random seed [default=%default]")
+  (options, args) = parser.parse_args()
+
+  if len(args) != 1:
+    parser.error("need an output filename")
+
+  rate = int(options.rate)
+  if rate % chip_rate:
+    parser.error("rate must be a multiple of %i" % chip_rate)
+  samples_per_chip = rate / chip_rate
+
+  if options.location is not None:
+    my_position = [float(x) for x in options.location.split(",")]
+
+  snrs = [float(x) for x in options.snr.split(",")]
+  rng = random.Random(options.seed)
+  nprng = numpy.random.RandomState(options.seed)
+  planes = [aircraft(rng, my_position) for i in range(0, options.aircraft)]
+  gap = int(round(options.gap * 1e-6 * rate))
+
+  outfile = open(args[0], "wb")
+  manifest = None
+  if options.manifest is not None:
+    manifest = open(options.manifest, "w")
+
+  offset = 0
+  dfcounts = {}
+  for snr in snrs:
+    amplitude = 10 ** (snr / 20.0)
+    for n in range(0, options.count):
+      (df, islong, bits) = rng.choice(planes).next_frame()
+      nbits = 112 if islong else 56
+      pulses = modulate(bits, nbits, samples_per_chip) * amplitude * numpy.exp(1j * rng.uniform(0, 2*math.pi))
+      chunk = noise(nprng, gap + len(pulses))
+      chunk[gap:] += pulses.astype(numpy.complex64)
+      chunk.tofile(outfile)
+
+      if manifest is not None:
+        manifest.write("%i %.1f %0*x\n" % (offset + gap, snr, nbits/4, bits))
+      offset += len(chunk)
+      dfcounts[df] = dfcounts.get(df, 0) + 1
+
+  #trailing noise so the last frame isn't cut off by the flowgraph's lookahead
+  noise(nprng, gap).tofile(outfile)
+  offset += gap
+  outfile.close()
+  if manifest is not None:
+    manifest.close()
+
+  print "Wrote %i frames at %s dB SNR" % (sum(dfcounts.values()), ", ".join(["%g" % x for x in snrs]))
+  for df in sorted(dfcounts.keys()):
+    print "  DF%i: %i" % (df, dfcounts[df])
+  print "%i samples, %.3f seconds at %i samples/sec" % (offset, float(offset) / rate, rate)
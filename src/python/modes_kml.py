@@ -19,136 +19,345 @@
 # Boston, MA 02110-1301, USA.
 # 
 
-import sqlite3
-import string, math, threading, time
+import string, math, threading, time, os, urllib, cgi
+import BaseHTTPServer
+from collections import deque
+from modes_parse import *
 
-class modes_kml(threading.Thread):
-    def __init__(self, dbfile, filename, localpos, timeout=5):
+#the pieces of the document. the header (styles and range rings) never changes once
+#we know where we are, so it's built once; each aircraft's placemarks are built from
+#aircraft_fields() and only rebuilt when something about that aircraft changes.
+kml_folder_end = '\n\t</Folder>'
+kml_document_end = '\n</Document>\n</kml>'
+kml_footer = kml_folder_end + kml_document_end
+
+def draw_circle(center, rng):
+    retstr = ""
+    steps=30
+    #so we're going to do this by computing a bearing angle based on the steps, and then compute the coordinate of a line extended from the center point to that range.
+    [center_lat, center_lon] = center
+    esquared = (1/298.257223563)*(2-(1/298.257223563))
+    earth_radius_mi = 3963.19059
+
+    #here we figure out the circumference of the latitude ring
+    #which tells us how wide one line of longitude is at our latitude
+    lat_circ = earth_radius_mi * math.cos(center_lat)
+    #the circumference of the longitude ring will be equal to the circumference of the earth
+
+    lat_rad = math.radians(center_lat)
+    lon_rad = math.radians(center_lon)
+
+    tmp0 = rng / earth_radius_mi
+
+    for i in range(0, steps+1):
+        bearing = i*(2*math.pi/steps) #in radians
+        lat_out = math.degrees(math.asin(math.sin(lat_rad)*math.cos(tmp0) + math.cos(lat_rad)*math.sin(tmp0)*math.cos(bearing)))
+        lon_out = center_lon + math.degrees(math.atan2(math.sin(bearing)*math.sin(tmp0)*math.cos(lat_rad), math.cos(tmp0)-math.sin(lat_rad)*math.sin(math.radians(lat_out))))
+        retstr += " %.8f, %.8f, 0" % (lon_out, lat_out,)
+
+    retstr = string.lstrip(retstr)
+    return retstr
+
+def kml_header(localpos):
+    #first let's draw the static content
+    retstr="""<?xml version="1.0" encoding="UTF-8"?>\n<kml xmlns="http://www.opengis.net/kml/2.2">\n<Document id="modes">\n\t<Style id="airplane">\n\t\t<IconStyle>\n\t\t\t<Icon><href>airports.png</href></Icon>\n\t\t</IconStyle>\n\t</Style>\n\t<Style id="rangering">\n\t<LineStyle>\n\t\t<color>9f4f4faf</color>\n\t\t<width>2</width>\n\t</LineStyle>\n\t</Style>\n\t<Style id="track">\n\t<LineStyle>\n\t\t<color>5fff8f8f</color>\n\t\t<width>4</width>\n\t</LineStyle>\n\t</Style>"""
+    retstr += """\t<Folder>\n\t\t<name>Range rings</name>\n\t\t<open>0</open>"""
+
+    for rng in [100, 200, 300]:
+            retstr += """\n\t\t<Placemark>\n\t\t\t<name>%inm</name>\n\t\t\t<styleUrl>#rangering</styleUrl>\n\t\t\t<LinearRing>\n\t\t\t\t<coordinates>%s</coordinates>\n\t\t\t</LinearRing>\n\t\t</Placemark>""" % (rng, draw_circle(localpos, rng),)
+
+    retstr += """\t</Folder>\n\t<Folder id="aircraft">\n\t\t<name>Aircraft locations</name>\n\t\t<open>0</open>"""
+    return retstr
+
+def aircraft_fields(icao, ident, alt, lat, lon, heading, speed, vertical, seen, track):
+    #the parts of an aircraft's placemarks that change: its name, description, position
+    #and track. track is a list of (alt, lat, lon), newest first.
+    if lat is None: lat = 0
+    if lon is None: lon = 0
+    if alt is None: alt = 0
+
+    metric_alt = alt * 0.3048 #google earth takes meters, the commie bastards
+
+    description = "<![CDATA[Altitude: %s<br/>Heading: %i<br/>Speed: %i<br/>Vertical speed: %i<br/>ICAO: %x<br/>Last seen: %s]]>" % (alt, heading, speed, vertical, icao, seen, )
+    coordinates = "%s,%s,%i" % (lon, lat, metric_alt, )
+    trackstr = " ".join(["%f, %f, %f" % (pos[2], pos[1], (pos[0] or 0)*0.3048) for pos in track])
+    return (ident, description, coordinates, trackstr)
+
+def placemark_kml(fields, icao=None):
+    #the aircraft and its track. with an icao, the placemarks get ids (see placemark_ids)
+    #so a NetworkLinkControl update can find them later.
+    (ident, description, coordinates, trackstr) = fields
+    if icao is None:
+        (aircraft_id, track_id) = ("", "")
+    else:
+        (aircraft_id, track_id) = [' id="%s"' % (id,) for id in placemark_ids(icao)]
+
+    retstr = "\n\t\t<Placemark%s>\n\t\t\t<name>%s</name>\n\t\t\t<styleUrl>#airplane</styleUrl>\n\t\t\t<description>\n\t\t\t\t%s\n\t\t\t</description>\n\t\t\t<Point>\n\t\t\t\t<altitudeMode>absolute</altitudeMode>\n\t\t\t\t<extrude>1</extrude>\n\t\t\t\t<coordinates>%s</coordinates>\n\t\t\t</Point>\n\t\t</Placemark>" % (aircraft_id, ident, description, coordinates, )
+
+    retstr+= "\n\t\t<Placemark%s>\n\t\t\t<styleUrl>#track</styleUrl>\n\t\t\t<LineString>\n\t\t\t\t<extrude>0</extrude>\n\t\t\t\t<altitudeMode>absolute</altitudeMode>\n\t\t\t\t<coordinates>%s</coordinates>\n\t\t\t</LineString>\n\t\t</Placemark>" % (track_id, trackstr,)
+    return retstr
+
+def placemark_ids(icao):
+    #(aircraft, track)
+    return ("a%06x" % (icao,), "t%06x" % (icao,))
+
+def placemark_change(fields, icao):
+    #the <Change> body that brings an aircraft's placemarks up to date
+    (ident, description, coordinates, trackstr) = fields
+    (aircraft_id, track_id) = placemark_ids(icao)
+    return "\n\t\t<Placemark targetId=\"%s\">\n\t\t\t<name>%s</name>\n\t\t\t<description>\n\t\t\t\t%s\n\t\t\t</description>\n\t\t\t<Point>\n\t\t\t\t<coordinates>%s</coordinates>\n\t\t\t</Point>\n\t\t</Placemark>\n\t\t<Placemark targetId=\"%s\">\n\t\t\t<LineString>\n\t\t\t\t<coordinates>%s</coordinates>\n\t\t\t</LineString>\n\t\t</Placemark>" % (aircraft_id, ident, description, coordinates, track_id, trackstr, )
+
+def placemark_delete(icao):
+    return "".join(["\n\t\t<Placemark targetId=\"%s\"/>" % (id,) for id in placemark_ids(icao)])
+
+def write_atomic(filename, pieces):
+    #write to a temporary file and rename it over the old one, so anything reading
+    #the file sees either the whole old document or the whole new one
+    tmpname = filename + ".tmp"
+    f = open(tmpname, 'w')
+    f.writelines(pieces)
+    f.close()
+    os.rename(tmpname, filename)
+
+def seen_str(seen):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(seen))
+
+#one aircraft, as modes_kml_live knows it
+class kml_aircraft:
+    def __init__(self, icao, track_length):
+        self.icao = icao
+        self.ident = ""
+        self.track = deque(maxlen=track_length) #(seen, alt, lat, lon), oldest first
+        self.vector = (0, 0, 0, 0) #(seen, speed, heading, vertical) from the latest velocity report
+        self.dirty = True #something's changed since the placemarks were last rendered
+        self.kml = None #the rendered placemarks
+        self.change = None #the same, as the body of a <Change>
+        self.created = None #the sequence number it was first rendered at
+        self.changed = None #the sequence number it was last rendered at
+
+    def render(self, seq):
+        (alt, lat, lon) = self.track[-1][1:]
+        (seen, speed, heading, vertical) = self.vector
+        if seen:
+            seen = seen_str(seen)
+        track = [pos[1:] for pos in reversed(self.track)]
+        fields = aircraft_fields(self.icao, self.ident, alt, lat, lon, heading, speed, vertical, seen, track)
+        self.kml = placemark_kml(fields, self.icao)
+        self.change = placemark_change(fields, self.icao)
+        if self.created is None:
+            self.created = seq
+        self.changed = seq
+        self.dirty = False
+
+#generates KML straight from decoded reports, without going through the database.
+#output() is an output plugin like the others: it updates the aircraft a report is
+#about and marks it as changed. every timeout seconds the thread calls refresh(),
+#which re-renders just the aircraft that changed and drops the ones we haven't had a
+#position from in active seconds, then writes the file. tracks keep at most
+#track_length points and none older than track_age seconds. positions and vectors
+#are timed by the frames they came in; clock is only for aging aircraft between
+#reports, going by how far behind it the receiver's clock was on the last one.
+#
+#each refresh gets a sequence number, and every aircraft remembers the ones it was
+#created and last changed at, so updates() can say what's changed since any refresh
+#in the last history refreshes. modes_kml_networklink uses that to serve updates.
+class modes_kml_live(threading.Thread):
+    def __init__(self, filename, localpos, timeout=5, active=5*60, track_age=2*60*60, track_length=1000, history=100, clock=time.time):
         threading.Thread.__init__(self)
         self._filename = filename
-        self._dbfile = dbfile
-        self.my_coords = localpos
         self._timeout = timeout
+        self._active = active
+        self._track_age = track_age
+        self._track_length = track_length
+        self._history = history
+        self._clock = clock
+        self._skew = 0 #how far the receiver's clock is behind ours, so old aircraft expire on its time
+        self._header = kml_header(localpos)
+        self._aircraft = {} #icao to kml_aircraft
+        self._deleted = deque() #(seq, icao, created) for each aircraft dropped, oldest first
+        self._seq = 0
+        self._lock = threading.Lock()
         self.done = False
         self.setDaemon(1)
         self.start()
-    
+
     def run(self):
         while self.done is False:
-            self.output()
-            time.sleep(self._timeout) 
-                
+            self.refresh()
+            self.write()
+            time.sleep(self._timeout)
+
         self.done = True
-    
-    def output(self):
-        self._db = sqlite3.connect(self._dbfile)
-        kmlstr = self.genkml()
-        if kmlstr is not None:
-            f = open(self._filename, 'w')
-            f.write(kmlstr)
-            f.close()
-        self._db.close()
-    
-    def draw_circle(self, center, rng):
-        retstr = ""
-        steps=30
-        #so we're going to do this by computing a bearing angle based on the steps, and then compute the coordinate of a line extended from the center point to that range.
-        [center_lat, center_lon] = center
-        esquared = (1/298.257223563)*(2-(1/298.257223563))
-        earth_radius_mi = 3963.19059
-
-        #here we figure out the circumference of the latitude ring
-        #which tells us how wide one line of longitude is at our latitude
-        lat_circ = earth_radius_mi * math.cos(center_lat)
-        #the circumference of the longitude ring will be equal to the circumference of the earth
-
-        lat_rad = math.radians(center_lat)
-        lon_rad = math.radians(center_lon)
-
-        tmp0 = rng / earth_radius_mi
-
-        for i in range(0, steps+1):
-            bearing = i*(2*math.pi/steps) #in radians
-            lat_out = math.degrees(math.asin(math.sin(lat_rad)*math.cos(tmp0) + math.cos(lat_rad)*math.sin(tmp0)*math.cos(bearing)))
-            lon_out = center_lon + math.degrees(math.atan2(math.sin(bearing)*math.sin(tmp0)*math.cos(lat_rad), math.cos(tmp0)-math.sin(lat_rad)*math.sin(math.radians(lat_out))))
-            retstr += " %.8f, %.8f, 0" % (lon_out, lat_out,)
-
-        retstr = string.lstrip(retstr)
-        return retstr
-    
-    def genkml(self):
-        #first let's draw the static content
-        retstr="""<?xml version="1.0" encoding="UTF-8"?>\n<kml xmlns="http://www.opengis.net/kml/2.2">\n<Document>\n\t<Style id="airplane">\n\t\t<IconStyle>\n\t\t\t<Icon><href>airports.png</href></Icon>\n\t\t</IconStyle>\n\t</Style>\n\t<Style id="rangering">\n\t<LineStyle>\n\t\t<color>9f4f4faf</color>\n\t\t<width>2</width>\n\t</LineStyle>\n\t</Style>\n\t<Style id="track">\n\t<LineStyle>\n\t\t<color>5fff8f8f</color>\n\t\t<width>4</width>\n\t</LineStyle>\n\t</Style>"""
-        retstr += """\t<Folder>\n\t\t<name>Range rings</name>\n\t\t<open>0</open>"""
-        
-        for rng in [100, 200, 300]:     
-                retstr += """\n\t\t<Placemark>\n\t\t\t<name>%inm</name>\n\t\t\t<styleUrl>#rangering</styleUrl>\n\t\t\t<LinearRing>\n\t\t\t\t<coordinates>%s</coordinates>\n\t\t\t</LinearRing>\n\t\t</Placemark>""" % (rng, self.draw_circle(self.my_coords, rng),)
-        
-        retstr += """\t</Folder>\n\t<Folder>\n\t\t<name>Aircraft locations</name>\n\t\t<open>0</open>"""
-
-        #read the database and add KML
-        q = "select distinct icao from positions where seen > datetime('now', '-5 minute')"
-        c = self._db.cursor()
-        c.execute(q)
-        icaolist = c.fetchall()
-        #now we have a list icaolist of all ICAOs seen in the last 5 minutes
-
-        for icao in icaolist:
-            #print "ICAO: %x" % icao
-            q = "select * from positions where icao=%i and seen > datetime('now', '-2 hour') ORDER BY seen DESC" % icao
-            c.execute(q)
-            track = c.fetchall()
-            #print "Track length: %i" % len(track)
-            if len(track) != 0:
-                lat = track[0][3]
-                if lat is None: lat = 0
-                lon = track[0][4]
-                if lon is None: lon = 0
-                alt = track[0][2]
-                if alt is None: alt = 0
-                
-                metric_alt = alt * 0.3048 #google earth takes meters, the commie bastards
-                
-                trackstr = ""
-                
-                for pos in track:
-                    trackstr += " %f, %f, %f" % (pos[4], pos[3], pos[2]*0.3048)
-
-                trackstr = string.lstrip(trackstr)
-            else:
-                alt = 0
-                metric_alt = 0
-                lat = 0
-                lon = 0
-                trackstr = str("")
-
-            #now get metadata
-            q = "select ident from ident where icao=%i" % icao
-            c.execute(q)
-            r = c.fetchall()
-            if len(r) != 0:
-                ident = r[0][0]
-            else: ident=""
-            #if ident is None: ident = ""
-            #get most recent speed/heading/vertical
-            q = "select seen, speed, heading, vertical from vectors where icao=%i order by seen desc limit 1" % icao
-            c.execute(q)
-            r = c.fetchall()
-            if len(r) != 0:
-                seen = r[0][0]
-                speed = r[0][1]
-                heading = r[0][2]
-                vertical = r[0][3]
+
+    def output(self, report):
+        #like modes_output_sql, this ignores anything that isn't Type 17
+        if report.frame.msgtype != 17:
+            return
+
+        now = report.frame.timestamp
+        with self._lock:
+            self._skew = self._clock() - now
+            aircraft = self._aircraft.get(report.icao)
+
+            if isinstance(report, airborne_position) and report.subtype != 15: #this covers surface positions too
+                if report.lat is None: #no unambiguously valid position available otherwise
+                    return
+                altitude = report.altitude
+                if not isinstance(altitude, int): #decode_alt gives us a string for metric altitudes
+                    altitude = None
+                if aircraft is None:
+                    aircraft = kml_aircraft(report.icao, self._track_length)
+                    self._aircraft[report.icao] = aircraft
+                aircraft.track.append((now, altitude, report.lat, report.lon))
+
+            elif aircraft is None: #nothing to draw until we have a position
+                return
+
+            elif isinstance(report, identification):
+                if report.ident == aircraft.ident:
+                    return
+                aircraft.ident = report.ident
+
+            elif isinstance(report, velocity):
+                aircraft.vector = (int(now), round(report.velocity), round(report.heading), round(report.vert_spd))
 
             else:
-                seen = 0
-                speed = 0
-                heading = 0
-                vertical = 0        
-            #now generate some KML
-            retstr+= "\n\t\t<Placemark>\n\t\t\t<name>%s</name>\n\t\t\t<styleUrl>#airplane</styleUrl>\n\t\t\t<description>\n\t\t\t\t<![CDATA[Altitude: %s<br/>Heading: %i<br/>Speed: %i<br/>Vertical speed: %i<br/>ICAO: %x<br/>Last seen: %s]]>\n\t\t\t</description>\n\t\t\t<Point>\n\t\t\t\t<altitudeMode>absolute</altitudeMode>\n\t\t\t\t<extrude>1</extrude>\n\t\t\t\t<coordinates>%s,%s,%i</coordinates>\n\t\t\t</Point>\n\t\t</Placemark>" % (ident, alt, heading, speed, vertical, icao[0], seen, lon, lat, metric_alt, )
+                return
+
+            aircraft.dirty = True
+
+    def refresh(self):
+        now = self._clock() - self._skew
+        with self._lock:
+            self._seq += 1
+            for icao in self._aircraft.keys():
+                aircraft = self._aircraft[icao]
+                if aircraft.track[-1][0] <= now - self._active:
+                    del self._aircraft[icao]
+                    if aircraft.created is not None:
+                        self._deleted.append((self._seq, icao, aircraft.created))
+                    continue
+                while len(aircraft.track) > 1 and aircraft.track[0][0] <= now - self._track_age:
+                    aircraft.track.popleft()
+                    aircraft.dirty = True
+                if aircraft.dirty:
+                    aircraft.render(self._seq)
+
+            while self._deleted and self._deleted[0][0] <= self._seq - self._history:
+                self._deleted.popleft()
+
+    def genkml(self, link=None):
+        #returns the document as it stood at the last refresh, as a list of strings,
+        #and that refresh's sequence number. link(seq), if given, returns
+        #something to go in the document after the aircraft folder.
+        retstr = [self._header]
+        with self._lock:
+            seq = self._seq
+            for icao in sorted(self._aircraft.keys()):
+                aircraft = self._aircraft[icao]
+                if aircraft.kml is not None:
+                    retstr.append(aircraft.kml)
+        if link is None:
+            retstr.append(kml_footer)
+        else:
+            retstr += [kml_folder_end, link(seq), kml_document_end]
+        return (retstr, seq)
+
+    def updates(self, since):
+        #returns the <Update> operations that take a copy of the document from
+        #refresh number since to the last one, as a list of strings, and the last
+        #one's sequence number. if since is too old for us to know what was deleted
+        #after it (or is from before a restart), the whole aircraft folder is replaced.
+        with self._lock:
+            seq = self._seq
+            if since > seq or since < seq - self._history:
+                retstr = ['\n\t<Delete>\n\t\t<Folder targetId="aircraft"/>\n\t</Delete>\n\t<Create>\n\t\t<Document targetId="modes">\n\t\t<Folder id="aircraft">\n\t\t<name>Aircraft locations</name>\n\t\t<open>0</open>']
+                for icao in sorted(self._aircraft.keys()):
+                    aircraft = self._aircraft[icao]
+                    if aircraft.kml is not None:
+                        retstr.append(aircraft.kml)
+                retstr.append('\n\t\t</Folder>\n\t\t</Document>\n\t</Create>')
+                return (retstr, seq)
+
+            deletes = [placemark_delete(icao) for (deleted, icao, created) in self._deleted if deleted > since and created <= since]
+            creates = []
+            changes = []
+            for icao in sorted(self._aircraft.keys()):
+                aircraft = self._aircraft[icao]
+                if aircraft.created is None or aircraft.changed <= since:
+                    continue
+                if aircraft.created > since:
+                    creates.append(aircraft.kml)
+                else:
+                    changes.append(aircraft.change)
+
+        retstr = []
+        if deletes:
+            retstr += ['\n\t<Delete>'] + deletes + ['\n\t</Delete>']
+        if creates:
+            retstr += ['\n\t<Create>\n\t\t<Folder targetId="aircraft">'] + creates + ['\n\t\t</Folder>\n\t</Create>']
+        if changes:
+            retstr += ['\n\t<Change>'] + changes + ['\n\t</Change>']
+        return (retstr, seq)
+
+    def write(self):
+        if self._filename is not None:
+            write_atomic(self._filename, self.genkml()[0])
+
+#serves the live KML over HTTP as a NetworkLink, so Google Earth fetches the whole
+#document once and after that only what's changed. point it at
+#http://<host>:<port>/ (or /root.kml). that links to /aircraft.kml, the document as
+#it stands, which in turn links to /update.kml?seq=N, polled every timeout seconds.
+#each update is a NetworkLinkControl with the Create/Change/Delete operations since
+#refresh N, and a cookie telling Google Earth to ask for the ones after that next time.
+class modes_kml_networklink(modes_kml_live):
+    def __init__(self, filename, localpos, port=8081, **kwargs):
+        modes_kml_live.__init__(self, filename, localpos, **kwargs)
+        kml = self
+
+        class handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                (path, query) = urllib.splitquery(self.path)
+                base = "http://%s" % (self.headers.get("Host") or "localhost:%i" % (port,),)
+                if path in ("/", "/root.kml"):
+                    body = [kml.root_kml(base)]
+                elif path == "/aircraft.kml":
+                    body = kml.genkml(lambda seq: kml.update_link(base, seq))[0]
+                elif path == "/update.kml":
+                    since = cgi.parse_qs(query or "").get("seq", ["0"])[-1] #google earth adds the cookie to the query we gave it, so take the last
+                    try:
+                        since = int(since)
+                    except ValueError:
+                        since = 0
+                    body = kml.update_kml(base, since)
+                else:
+                    self.send_error(404)
+                    return
+                body = "".join(body)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/vnd.google-earth.kml+xml")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass #google earth polls a lot
+
+        self._server = BaseHTTPServer.HTTPServer(('', port), handler)
+        self._server_thread = threading.Thread(target=self._server.serve_forever)
+        self._server_thread.setDaemon(1)
+        self._server_thread.start()
+
+    def root_kml(self, base):
+        return '<?xml version="1.0" encoding="UTF-8"?>\n<kml xmlns="http://www.opengis.net/kml/2.2">\n<NetworkLink>\n\t<name>Mode S</name>\n\t<Link>\n\t\t<href>%s/aircraft.kml</href>\n\t</Link>\n</NetworkLink>\n</kml>\n' % (base,)
 
-            retstr+= "\n\t\t<Placemark>\n\t\t\t<styleUrl>#track</styleUrl>\n\t\t\t<LineString>\n\t\t\t\t<extrude>0</extrude>\n\t\t\t\t<altitudeMode>absolute</altitudeMode>\n\t\t\t\t<coordinates>%s</coordinates>\n\t\t\t</LineString>\n\t\t</Placemark>" % (trackstr,)
+    def update_link(self, base, seq):
+        return '\n\t<NetworkLink>\n\t\t<name>Updates</name>\n\t\t<Link>\n\t\t\t<href>%s/update.kml?seq=%i</href>\n\t\t\t<refreshMode>onInterval</refreshMode>\n\t\t\t<refreshInterval>%i</refreshInterval>\n\t\t</Link>\n\t</NetworkLink>' % (base, seq, self._timeout)
 
-        retstr+= '\n\t</Folder>\n</Document>\n</kml>'
+    def update_kml(self, base, since):
+        (updates, seq) = self.updates(since)
+        retstr = ['<?xml version="1.0" encoding="UTF-8"?>\n<kml xmlns="http://www.opengis.net/kml/2.2">\n<NetworkLinkControl>\n<cookie>seq=%i</cookie>\n' % (seq,)]
+        if updates:
+            retstr += ['<Update>\n\t<targetHref>%s/aircraft.kml</targetHref>' % (base,)] + updates + ['\n</Update>\n']
+        retstr.append('</NetworkLinkControl>\n</kml>\n')
         return retstr
@@ -0,0 +1,43 @@
+#
+# Copyright 2010 Nick Foster
+#
+# This file is part of gr-air-modes
+#
+# gr-air-modes is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+#
+# gr-air-modes is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with gr-air-modes; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+#
+
+#the Mode S CRC-24, for building frames on the python side (see modes_iqgen.py).
+#modes_check_parity in modes_parity.cc computes the same thing with a table and
+#XORs in the parity field, so it returns 0 for a good DF11/DF17.
+
+_poly = 0xFFF409 #generator polynomial, less the x^24 term
+
+#returns the 24-bit CRC of the first nbits of data (an integer, MSB first)
+def modes_crc(data, nbits):
+  crc = 0
+  for i in range(nbits-1, -1, -1):
+    top = ((crc >> 23) ^ (data >> i)) & 1
+    crc = (crc << 1) & 0xFFFFFF
+    if top:
+      crc ^= _poly
+  return crc
+
+#takes the packet minus its last 24 bits (32 bits for short, 88 for long) and
+#returns the whole packet with the parity field filled in. address is XORed into
+#the parity, which is how the address/parity field of DF0/4/5/20/21 is built;
+#leave it at 0 for DF11 and DF17.
+def modes_append_parity(data, nbits, address=0):
+  return (data << 24) | (modes_crc(data, nbits) ^ address)
@@ -23,13 +23,200 @@
 import time, os, sys
 from string import split, join
 from altitude import decode_alt
-from cpr import cpr_decode
+from cpr import cpr_decode, cpr_state, expiring_map
 import math
 
+#decoded reports. each frame is decoded into exactly one of these by
+#modes_parse.decode, and the same report is handed to every output plugin.
+#the raw frame is kept around in case a plugin wants the reference level,
+#timestamp or raw bits.
+class modes_report(object):
+  __slots__ = ["frame", "icao"]
+
+  def __init__(self, frame, icao):
+    self.frame = frame
+    self.icao = icao
+
+#DF0 and DF4. vs and ri only come with DF0, fs only comes with DF4.
+class altitude_reply(modes_report):
+  __slots__ = ["altitude", "fs", "vs", "ri"]
+
+  def __init__(self, frame, icao, altitude, fs=None, vs=None, ri=None):
+    modes_report.__init__(self, frame, icao)
+    self.altitude = altitude
+    self.fs = fs
+    self.vs = vs
+    self.ri = ri
+
+#DF5
+class ident_reply(modes_report):
+  __slots__ = ["fs", "squawk"]
+
+  def __init__(self, frame, icao, fs, squawk):
+    modes_report.__init__(self, frame, icao)
+    self.fs = fs
+    self.squawk = squawk
+
+#DF11
+class all_call_reply(modes_report):
+  __slots__ = ["interrogator", "ca"]
+
+  def __init__(self, frame, icao, interrogator, ca):
+    modes_report.__init__(self, frame, icao)
+    self.interrogator = interrogator
+    self.ca = ca
+
+#DF17 subtypes 1-4
+class identification(modes_report):
+  __slots__ = ["subtype", "ident"]
+
+  def __init__(self, frame, icao, subtype, ident):
+    modes_report.__init__(self, frame, icao)
+    self.subtype = subtype
+    self.ident = ident
+
+#DF17 subtypes 9-18. lat, lon, rnge and bearing are None if CPR couldn't
+#come up with an unambiguous position.
+class airborne_position(modes_report):
+  __slots__ = ["subtype", "altitude", "lat", "lon", "rnge", "bearing"]
+
+  def __init__(self, frame, icao, subtype, altitude, lat, lon, rnge, bearing):
+    modes_report.__init__(self, frame, icao)
+    self.subtype = subtype
+    self.altitude = altitude
+    self.lat = lat
+    self.lon = lon
+    self.rnge = rnge
+    self.bearing = bearing
+
+#DF17 subtypes 5-8
+class surface_position(airborne_position):
+  __slots__ = []
+
+#DF17 subtype 19, subsubtypes 0 and 1
+class velocity(modes_report):
+  __slots__ = ["subsubtype", "velocity", "heading", "vert_spd"]
+
+  def __init__(self, frame, icao, subsubtype, velocity, heading, vert_spd):
+    modes_report.__init__(self, frame, icao)
+    self.subsubtype = subsubtype
+    self.velocity = velocity
+    self.heading = heading
+    self.vert_spd = vert_spd
+
+#aircraft we've heard recently in a frame with a clean CRC (DF11 or DF17).
+#the address/parity formats don't carry the address outright, it's XORed into
+#the parity, so the syndrome is only the address if the frame came in perfectly.
+#any bit error turns it into a random 24-bit "address", so we only believe the ones
+#that belong to an aircraft we know is out there, heard within the last ttl seconds.
+#time is whatever the caller says it is; modes_parse goes by the frames' timestamps.
+class icao_cache:
+  def __init__(self, ttl=60):
+    self.ttl = ttl
+    self._seen = expiring_map(ttl) #icao24: (time last seen,)
+
+  def add(self, icao24, now):
+    self._seen.put(icao24, (now,))
+
+  def known(self, icao24, now):
+    return self._seen.get(icao24, now) is not None
+
+  def expire(self, now):
+    self._seen.expire(now)
+
+  def __len__(self):
+    return len(self._seen)
+
+#downlink formats whose parity field is XORed with the address
+ap_formats = frozenset([0, 4, 5, 16, 20, 21])
+
 class modes_parse:
-  def __init__(self, mypos):
-      self.my_location = mypos
-    
+  def __init__(self, mypos, cprstate=None, icaos=None, ap_filter=True):
+    self.my_location = mypos
+
+    #addresses seen in clean DF11/DF17 frames. with ap_filter on, address/parity
+    #frames from anyone else are thrown out and counted in self.rejected.
+    if icaos is None:
+      icaos = icao_cache()
+    self._icaos = icaos
+    self.ap_filter = ap_filter
+    self.rejected = 0
+
+    #the last known position for emitter-centered decoding, and the last received even and odd
+    #encoded positions for global decoding, per aircraft. there's only one parser, so there's
+    #only one copy of the CPR state. pass one in if you want to control its timeouts.
+    if cprstate is None:
+      cprstate = cpr_state()
+    self._cpr = cprstate
+
+  def decode(self, frame):
+    #turns a frame into a report. this is the only place frames get decoded,
+    #and the only place CPR gets resolved, no matter how many outputs are running.
+    #returns None for an address/parity frame from an address we don't know.
+    #everything is timed by when the frame was received, not when it's decoded,
+    #so a recording ages out addresses and pairs up CPR the same way it did live.
+    msgtype = frame.msgtype
+    shortdata = frame.shortdata
+    parity = frame.parity
+    ecc = frame.ecc
+
+    icaos = self._icaos
+    now = frame.timestamp
+    icaos.expire(now)
+    if msgtype in ap_formats:
+      if self.ap_filter and not icaos.known(ecc, now):
+        self.rejected += 1
+        return None
+    elif (msgtype == 11 or msgtype == 17) and ecc == 0:
+      icaos.add(shortdata & 0xFFFFFF, now)
+
+    if msgtype == 0:
+      [vs, cc, sl, ri, altitude] = self.parse0(shortdata, parity, ecc)
+      return altitude_reply(frame, ecc, altitude, vs=vs, ri=ri)
+    elif msgtype == 4:
+      [fs, dr, um, altitude] = self.parse4(shortdata, parity, ecc)
+      return altitude_reply(frame, ecc, altitude, fs=fs)
+    elif msgtype == 5:
+      [fs, dr, um] = self.parse5(shortdata, parity, ecc)
+      return ident_reply(frame, ecc, fs, shortdata & 0x1FFF)
+    elif msgtype == 11:
+      [icao24, interrogator, ca] = self.parse11(shortdata, parity, ecc)
+      return all_call_reply(frame, icao24, interrogator, ca)
+    elif msgtype == 17:
+      return self.decode17(frame)
+    else:
+      return modes_report(frame, ecc)
+
+  def decode17(self, frame):
+    shortdata = frame.shortdata
+    longdata = frame.longdata
+    parity = frame.parity
+    ecc = frame.ecc
+    icao24 = shortdata & 0xFFFFFF
+    subtype = (longdata >> 51) & 0x1F
+
+    if subtype >= 1 and subtype <= 4:
+      return identification(frame, icao24, subtype, self.parseBDS08(shortdata, longdata, parity, ecc))
+
+    elif subtype >= 5 and subtype <= 8:
+      [altitude, decoded_lat, decoded_lon, rnge, bearing] = self.parseBDS06(shortdata, longdata, parity, ecc, frame.timestamp)
+      return surface_position(frame, icao24, subtype, altitude, decoded_lat, decoded_lon, rnge, bearing)
+
+    elif subtype >= 9 and subtype <= 18:
+      [altitude, decoded_lat, decoded_lon, rnge, bearing] = self.parseBDS05(shortdata, longdata, parity, ecc, frame.timestamp)
+      return airborne_position(frame, icao24, subtype, altitude, decoded_lat, decoded_lon, rnge, bearing)
+
+    elif subtype == 19:
+      subsubtype = (longdata >> 48) & 0x07
+      if subsubtype == 0:
+        [vel, heading, vert_spd] = self.parseBDS09_0(shortdata, longdata, parity, ecc)
+        return velocity(frame, icao24, subsubtype, vel, heading, vert_spd)
+      elif subsubtype == 1:
+        [vel, heading, vert_spd] = self.parseBDS09_1(shortdata, longdata, parity, ecc)
+        return velocity(frame, icao24, subsubtype, vel, heading, vert_spd)
+
+    return modes_report(frame, icao24)
+
   def parse0(self, shortdata, parity, ecc):
 #	shortdata = long(shortdata, 16)
     #parity = long(parity)
@@ -148,17 +335,7 @@ class modes_parse:
 
     return retval
 
-#lkplist is the last known position, for emitter-centered decoding. evenlist and oddlist are the last 
-#received encoded position data for each reporting type. all dictionaries indexed by ICAO number.
-  _lkplist = {}
-  _evenlist = {}
-  _oddlist = {}
-  _evenlist_ground = {}
-  _oddlist_ground = {}
-
-#the above dictionaries are all in the format [lat, lon, time].
-
-  def parseBDS05(self, shortdata, longdata, parity, ecc):
+  def parseBDS05(self, shortdata, longdata, parity, ecc, now=None):
     icao24 = shortdata & 0xFFFFFF
 
     encoded_lon = longdata & 0x1FFFF
@@ -169,13 +346,13 @@ class modes_parse:
 
     altitude = decode_alt(enc_alt, False)
 
-    [decoded_lat, decoded_lon, rnge, bearing] = cpr_decode(self.my_location, icao24, encoded_lat, encoded_lon, cpr_format, self._evenlist, self._oddlist, self._lkplist, 0, longdata)
+    [decoded_lat, decoded_lon, rnge, bearing] = cpr_decode(self.my_location, icao24, encoded_lat, encoded_lon, cpr_format, self._cpr, 0, longdata, now)
 
     return [altitude, decoded_lat, decoded_lon, rnge, bearing]
 
 
 #welp turns out it looks like there's only 17 bits in the BDS0,6 ground packet after all. fuck.
-  def parseBDS06(self, shortdata, longdata, parity, ecc):
+  def parseBDS06(self, shortdata, longdata, parity, ecc, now=None):
     icao24 = shortdata & 0xFFFFFF
 
     encoded_lon = longdata & 0x1FFFF
@@ -186,7 +363,7 @@ class modes_parse:
 
     altitude = 0
 
-    [decoded_lat, decoded_lon, rnge, bearing] = cpr_decode(self.my_location, icao24, encoded_lat, encoded_lon, cpr_format, self._evenlist_ground, self._oddlist_ground, self._lkplist, 1, longdata)
+    [decoded_lat, decoded_lon, rnge, bearing] = cpr_decode(self.my_location, icao24, encoded_lat, encoded_lon, cpr_format, self._cpr, 1, longdata, now)
 
     return [altitude, decoded_lat, decoded_lon, rnge, bearing]
 
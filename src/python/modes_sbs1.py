@@ -20,66 +20,158 @@
 #
 
 
-import time, os, sys, socket
+import time, os, sys, socket, select, errno
 from string import split, join
-import modes_parse
+from modes_parse import *
 from datetime import *
+from collections import deque, OrderedDict
 
-class modes_output_sbs1(modes_parse.modes_parse):
-  def __init__(self, mypos):
-    modes_parse.modes_parse.__init__(self, mypos)
+#one connected SBS-1 client. messages wait in pending until the socket can take
+#them, and go out joined together in as few send() calls as the socket allows.
+#sending holds whatever's left of a line the socket only took part of, so pending
+#only ever holds whole lines and dropping from its head never splits one.
+class sbs1_client:
+  def __init__(self, conn, addr):
+    self.conn = conn
+    self.addr = addr
+    self.pending = deque()
+    self.sending = ""
+    self.nbytes = 0 #bytes waiting, pending and sending together
+    self.dropped = 0 #lines thrown away because the client fell behind
+    self.blocked = False #the socket didn't take everything last time; wait for select to say it's ready
+
+  def fileno(self):
+    return self.conn.fileno()
+
+  def queue(self, msg, max_buffer, slow_policy):
+    #returns False if the client has fallen too far behind to keep
+    if self.nbytes + len(msg) > max_buffer:
+      if slow_policy != "lag":
+        return False
+      while self.pending and self.nbytes + len(msg) > max_buffer:
+        self.nbytes -= len(self.pending.popleft())
+        self.dropped += 1
+    self.pending.append(msg)
+    self.nbytes += len(msg)
+    return True
+
+  def flush(self):
+    #raises socket.error if the client has gone away
+    if not self.nbytes:
+      return
+    data = self.sending + "".join(self.pending)
+    self.pending.clear()
+    try:
+      sent = self.conn.send(data)
+    except socket.error, e:
+      if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+        raise
+      sent = 0
+    self.sending = data[sent:]
+    self.nbytes = len(self.sending)
+    self.blocked = (self.nbytes > 0)
+
+#the SBS-1 (BaseStation) output, served on port 30003 to any number of clients.
+#nothing here ever blocks: output() just queues each message for every client,
+#and update(), which the main loop calls every time around, accepts new clients
+#and writes to whichever sockets are ready. a client that can't keep up gets
+#dropped, or with slow_policy="lag" loses its oldest unsent messages instead,
+#once it has more than max_buffer bytes waiting.
+class modes_output_sbs1:
+  def __init__(self, port=30003, max_buffer=262144, slow_policy="drop", flush_size=4096, max_aircraft=10000):
     self._s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    self._s.bind(('', 30003))
-    self._s.listen(1)
+    self._s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self._s.bind(('', port))
+    self._s.listen(socket.SOMAXCONN)
     self._s.setblocking(0) #nonblocking
-    self._conns = [] #list of active connections
-    self._aircraft_id_map = {} # dictionary of icao24 to aircraft IDs
+    self._clients = [] #list of active connections, as sbs1_clients
+    self._max_buffer = max_buffer
+    self._slow_policy = slow_policy
+    self._flush_size = flush_size #write out early once this much is waiting for a client
+    self._aircraft_id_map = OrderedDict() # icao24 to aircraft IDs, least recently seen first
     self._aircraft_id_count = 0 # Current Aircraft ID count
+    self._max_aircraft = max_aircraft # how many aircraft IDs to remember
 
   def __del__(self):
+    for client in self._clients:
+      client.conn.close()
     self._s.close()
 
   def get_aircraft_id(self, icao24):
-    if icao24 in self._aircraft_id_map:
-      return self._aircraft_id_map[icao24]
-
-    # Adding this new ID to the dictionary
-    self._aircraft_id_count += 1
-    self._aircraft_id_map[icao24] = self._aircraft_id_count
-
-    # Checking to see if we need to clean up in the event that the
-    # dictionary is getting too large.
-    if len(self._aircraft_id_map) > 1e4:
-      minimum = ('', self._aircraft_id_count)
-      for pair in self._aircraft_id_map:
-        if pair[1] < minimum[1]:
-          minimum = pair
-      self._aircraft_id_map.pop(minimum[0])
-
-    # Finally return the new pair
-    return self._aircraft_id_count
-
-  def output(self, msg):
-    sbs1_msg = self.parse(msg)
+    #the map is kept in order of last use, so the least recently seen aircraft
+    #is always at the front and evicting it is O(1). an aircraft keeps its ID
+    #for as long as it stays in the map.
+    aircraft_id = self._aircraft_id_map.pop(icao24, None)
+    if aircraft_id is None:
+      self._aircraft_id_count += 1
+      aircraft_id = self._aircraft_id_count
+      if len(self._aircraft_id_map) >= self._max_aircraft:
+        self._aircraft_id_map.popitem(last=False)
+
+    self._aircraft_id_map[icao24] = aircraft_id #back on the end as the most recently seen
+    return aircraft_id
+
+  def output(self, report):
+    sbs1_msg = self.parse(report)
     if sbs1_msg is not None:
-      for conn in self._conns[:]: #iterate over a copy of the list
+      for client in self._clients[:]: #iterate over a copy of the list
+        if not client.queue(sbs1_msg, self._max_buffer, self._slow_policy):
+          self.drop(client, "too far behind")
+        elif client.nbytes >= self._flush_size and not client.blocked:
+          try:
+            client.flush()
+          except socket.error:
+            self.drop(client, "connection lost")
+
+  def update(self):
+    self.add_pending_conns()
+    if not self._clients:
+      return
+
+    writers = [client for client in self._clients if client.nbytes]
+    try:
+      (readable, writable, errored) = select.select(self._clients, writers, [], 0)
+    except select.error:
+      return
+
+    #clients aren't expected to say anything, so anything readable is either
+    #chatter we ignore or the client hanging up
+    for client in readable:
+      try:
+        if not client.conn.recv(4096):
+          self.drop(client, "closed by client")
+      except socket.error:
+        self.drop(client, "connection lost")
+
+    for client in writable:
+      if client in self._clients:
         try:
-          conn.send(sbs1_msg)
+          client.flush()
         except socket.error:
-          self._conns.remove(conn)
-          print "Connections: ", len(self._conns)
+          self.drop(client, "connection lost")
 
   def add_pending_conns(self):
-    try:
-      conn, addr = self._s.accept()
-      self._conns.append(conn)
-      print "Connections: ", len(self._conns)
-    except socket.error:
-      pass
+    while 1:
+      try:
+        conn, addr = self._s.accept()
+      except socket.error:
+        return
+      conn.setblocking(0)
+      self._clients.append(sbs1_client(conn, addr))
+      print "Connections: ", len(self._clients)
+
+  def drop(self, client, reason):
+    client.conn.close()
+    self._clients.remove(client)
+    print "Dropped %s:%i (%s, %i messages lost)" % (client.addr[0], client.addr[1], reason, client.dropped)
+    print "Connections: ", len(self._clients)
 
-  def current_time(self):
-    timenow = datetime.now()
-    return [timenow.strftime("%Y/%m/%d"), timenow.strftime("%H:%M:%S.%f")[0:-3]]
+  def current_time(self, report):
+    #the message was generated when the receiver heard it, and logged now
+    generated = datetime.fromtimestamp(report.frame.timestamp)
+    logged = datetime.now()
+    return [generated.strftime("%Y/%m/%d"), generated.strftime("%H:%M:%S.%f")[0:-3],
+            logged.strftime("%Y/%m/%d"), logged.strftime("%H:%M:%S.%f")[0:-3]]
 
   def decode_fs(self, fs):
     if fs == 0:
@@ -97,106 +189,82 @@ class modes_output_sbs1(modes_parse.modes_parse):
     else:
       return ",,,"
 
-  def parse(self, message):
-    #assembles a SBS-1-style output string from the received message
-
-    [msgtype, shortdata, longdata, parity, ecc, reference, timestamp] = message.split()
-
-    shortdata = long(shortdata, 16)
-    longdata = long(longdata, 16)
-    parity = long(parity, 16)
-    ecc = long(ecc, 16)
-    msgtype = int(msgtype)
+  def parse(self, report):
+    #assembles a SBS-1-style output string from the decoded report
+    msgtype = report.frame.msgtype
     outmsg = None
 
     if msgtype == 0:
-      outmsg = self.pp0(shortdata, parity, ecc)
+      outmsg = self.pp0(report)
     elif msgtype == 4:
-      outmsg = self.pp4(shortdata, parity, ecc)
+      outmsg = self.pp4(report)
     elif msgtype == 5:
-      outmsg = self.pp5(shortdata, parity, ecc)
+      outmsg = self.pp5(report)
     elif msgtype == 11:
-      outmsg = self.pp11(shortdata, parity, ecc)
+      outmsg = self.pp11(report)
     elif msgtype == 17:
-      outmsg = self.pp17(shortdata, longdata, parity, ecc)
+      outmsg = self.pp17(report)
     return outmsg
 
-  def pp0(self, shortdata, parity, ecc):
-    [datestr, timestr] = self.current_time()
-    [vs, cc, sl, ri, altitude] = self.parse0(shortdata, parity, ecc)
+  def pp0(self, report):
+    [gendate, gentime, logdate, logtime] = self.current_time(report)
+    ecc = report.icao
     aircraft_id = self.get_aircraft_id(ecc)
-    retstr = "MSG,7,0,%i,%X,%i,%s,%s,%s,%s,,%s,,,,,,,,,," % (aircraft_id, ecc, aircraft_id+100, datestr, timestr, datestr, timestr, altitude)
-    if vs:
+    retstr = "MSG,7,0,%i,%X,%i,%s,%s,%s,%s,,%s,,,,,,,,,," % (aircraft_id, ecc, aircraft_id+100, gendate, gentime, logdate, logtime, report.altitude)
+    if report.vs:
       retstr += "1\n"
     else:
       retstr += "0\n"
     return retstr
 
-  def pp4(self, shortdata, parity, ecc):
-    [datestr, timestr] = self.current_time()
-    [fs, dr, um, altitude] = self.parse4(shortdata, parity, ecc)
+  def pp4(self, report):
+    [gendate, gentime, logdate, logtime] = self.current_time(report)
+    ecc = report.icao
     aircraft_id = self.get_aircraft_id(ecc)
-    retstr = "MSG,5,0,%i,%X,%i,%s,%s,%s,%s,,%s,,,,,,," % (aircraft_id, ecc, aircraft_id+100, datestr, timestr, datestr, timestr, altitude)
-    return retstr + self.decode_fs(fs) + "\n"
+    retstr = "MSG,5,0,%i,%X,%i,%s,%s,%s,%s,,%s,,,,,,," % (aircraft_id, ecc, aircraft_id+100, gendate, gentime, logdate, logtime, report.altitude)
+    return retstr + self.decode_fs(report.fs) + "\n"
 
-  def pp5(self, shortdata, parity, ecc):
-    # I'm not sure what to do with the identiifcation shortdata & 0x1FFF
-    [datestr, timestr] = self.current_time()
-    [fs, dr, um] = self.parse5(shortdata, parity, ecc)
+  def pp5(self, report):
+    # I'm not sure what to do with the identiifcation report.squawk
+    [gendate, gentime, logdate, logtime] = self.current_time(report)
+    ecc = report.icao
     aircraft_id = self.get_aircraft_id(ecc)
-    retstr = "MSG,6,0,%i,%X,%i,%s,%s,%s,%s,,,,,,,,," % (aircraft_id, ecc, aircraft_id+100, datestr, timestr, datestr, timestr)
-    return retstr + self.decode_fs(fs) + "\n"
+    retstr = "MSG,6,0,%i,%X,%i,%s,%s,%s,%s,,,,,,,,," % (aircraft_id, ecc, aircraft_id+100, gendate, gentime, logdate, logtime)
+    return retstr + self.decode_fs(report.fs) + "\n"
 
-  def pp11(self, shortdata, parity, ecc):
-    [datestr, timestr] = self.current_time()
-    [icao24, interrogator, ca] = self.parse11(shortdata, parity, ecc)
+  def pp11(self, report):
+    [gendate, gentime, logdate, logtime] = self.current_time(report)
+    icao24 = report.icao
     aircraft_id = self.get_aircraft_id(icao24)
-    return "MSG,8,0,%i,%X,%i,%s,%s,%s,%s,,,,,,,,,,,,\n" % (aircraft_id, icao24, aircraft_id+100, datestr, timestr, datestr, timestr)
+    return "MSG,8,0,%i,%X,%i,%s,%s,%s,%s,,,,,,,,,,,,\n" % (aircraft_id, icao24, aircraft_id+100, gendate, gentime, logdate, logtime)
 
-  def pp17(self, shortdata, longdata, parity, ecc):
-    icao24 = shortdata & 0xFFFFFF
+  def pp17(self, report):
+    icao24 = report.icao
     aircraft_id = self.get_aircraft_id(icao24)
-    subtype = (longdata >> 51) & 0x1F
 
     retstr = None
-    #we'll get better timestamps later, hopefully with actual VRT time
-    #in them
-    [datestr, timestr] = self.current_time()
+    [gendate, gentime, logdate, logtime] = self.current_time(report)
 
-    if subtype >= 1 and subtype <= 4:
+    if isinstance(report, identification):
       # Aircraft Identification
-      msg = self.parseBDS08(shortdata, longdata, parity, ecc)
-      retstr = "MSG,1,0,%i,%X,%i,%s,%s,%s,%s,%s,,,,,,,,,,,\n" % (aircraft_id, icao24, aircraft_id+100, datestr, timestr, datestr, timestr, msg)
+      retstr = "MSG,1,0,%i,%X,%i,%s,%s,%s,%s,%s,,,,,,,,,,,\n" % (aircraft_id, icao24, aircraft_id+100, gendate, gentime, logdate, logtime, report.ident)
 
-    elif subtype >= 5 and subtype <= 8:
+    elif isinstance(report, surface_position):
       # Surface position measurement
-      [altitude, decoded_lat, decoded_lon, rnge, bearing] = self.parseBDS06(shortdata, longdata, parity, ecc)
-      if decoded_lat is None: #no unambiguously valid position available
-        retstr = None
-      else:
-        retstr = "MSG,2,0,%i,%X,%i,%s,%s,%s,%s,,%i,,,%.5f,%.5f,,,,0,0,0\n" % (aircraft_id, icao24, aircraft_id+100, datestr, timestr, datestr, timestr, altitude, decoded_lat, decoded_lon)
+      if report.lat is not None: #no unambiguously valid position available otherwise
+        retstr = "MSG,2,0,%i,%X,%i,%s,%s,%s,%s,,%i,,,%.5f,%.5f,,,,0,0,0\n" % (aircraft_id, icao24, aircraft_id+100, gendate, gentime, logdate, logtime, report.altitude, report.lat, report.lon)
 
-    elif subtype >= 9 and subtype <= 18 and subtype != 15:
+    elif isinstance(report, airborne_position) and report.subtype != 15:
       # Airborne position measurements
       # WRONG (rnge, bearing), is this still true?
       # i'm eliminating type 15 records because they don't appear to be
       # valid position reports.
-      [altitude, decoded_lat, decoded_lon, rnge, bearing] = self.parseBDS05(shortdata, longdata, parity, ecc)
-      if decoded_lat is None: #no unambiguously valid position available
-        retstr = None
-      else:
-        retstr = "MSG,3,0,%i,%X,%i,%s,%s,%s,%s,,%i,,,%.5f,%.5f,,,,0,0,0\n" % (aircraft_id, icao24, aircraft_id+100, datestr, timestr, datestr, timestr, altitude, decoded_lat, decoded_lon)
+      if report.lat is not None: #no unambiguously valid position available otherwise
+        retstr = "MSG,3,0,%i,%X,%i,%s,%s,%s,%s,,%i,,,%.5f,%.5f,,,,0,0,0\n" % (aircraft_id, icao24, aircraft_id+100, gendate, gentime, logdate, logtime, report.altitude, report.lat, report.lon)
 
-    elif subtype == 19:
+    elif isinstance(report, velocity):
       # Airborne velocity measurements
       # WRONG (heading, vert_spd), Is this still true?
-      subsubtype = (longdata >> 48) & 0x07
-      if subsubtype == 0:
-        [velocity, heading, vert_spd] = self.parseBDS09_0(shortdata, longdata, parity, ecc)
-        retstr = "MSG,4,0,%i,%X,%i,%s,%s,%s,%s,,,%.1f,%.1f,,,%i,,,,,\n" % (aircraft_id, icao24, aircraft_id+100, datestr, timestr, datestr, timestr, velocity, heading, vert_spd)
-
-      elif subsubtype == 1:
-        [velocity, heading, vert_spd] = self.parseBDS09_1(shortdata, longdata, parity, ecc)
-        retstr = "MSG,4,0,%i,%X,%i,%s,%s,%s,%s,,,%.1f,%.1f,,,%i,,,,,\n" % (aircraft_id, icao24, aircraft_id+100, datestr, timestr, datestr, timestr, velocity, heading, vert_spd)
+      retstr = "MSG,4,0,%i,%X,%i,%s,%s,%s,%s,,,%.1f,%.1f,,,%i,,,,,\n" % (aircraft_id, icao24, aircraft_id+100, gendate, gentime, logdate, logtime, report.velocity, report.heading, report.vert_spd)
 
     return retstr
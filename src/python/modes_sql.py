@@ -19,108 +19,437 @@
 # Boston, MA 02110-1301, USA.
 # 
 
-import time, os, sys
+import time, os, sys, threading, Queue
 from string import split, join
-import modes_parse
+from modes_parse import *
 import sqlite3
 
-class modes_output_sql(modes_parse.modes_parse):
-  def __init__(self, mypos, filename):
-    modes_parse.modes_parse.__init__(self, mypos)
-    #create the database
-    self.db = sqlite3.connect(filename)
-    #now execute a schema to create the tables you need
-    c = self.db.cursor()
-    query = """CREATE TABLE IF NOT EXISTS "positions" (
+#rows go to the database from a thread of their own, so the decoder never waits on
+#the disk. insert() turns a report into a row and queues it; the writer thread takes
+#rows off the queue and writes them with executemany, committing once it has
+#batch_size rows or the oldest one has waited batch_interval seconds. with WAL and
+#synchronous=NORMAL that's one sync per batch at most, instead of one per row.
+#
+#the queue holds at most queue_size rows. when it's full, insert() waits for the
+#writer (block=True) or throws the row away (block=False); either way it's counted
+#in stats().
+#
+#if sqlite fails a batch (the database is locked, the disk is full, a row it won't
+#take) the batch is rolled back, printed, counted in stats() and lost, and the writer
+#carries on with the next one. if the writer thread dies anyway, insert() and flush()
+#raise rather than wait for it forever.
+#
+#positions and vectors go into partitions partition seconds long (a day by default).
+#with retention set, the writer drops partitions once everything in them is more than
+#retention seconds old, checking every retention_interval seconds.
+_flush = "flush" #queued by flush() to make the writer commit what it has now
+_stop = "stop" #queued by close()
+
+#the schema is versioned with PRAGMA user_version. each entry here takes the database
+#from the version before it to the next one, so an old adsb.db is brought up to date
+#the first time it's opened and a new one goes through exactly the same steps.
+def _schema_v1(c):
+  #the original tables, with seen as sqlite datetime() text
+  c.execute("""CREATE TABLE IF NOT EXISTS "positions" (
                 "icao" INTEGER KEY NOT NULL,
                 "seen" TEXT NOT NULL,
                 "alt"  INTEGER,
                 "lat"  REAL,
                 "lon"  REAL
-            );"""
-    c.execute(query)
-    query = """CREATE TABLE IF NOT EXISTS "vectors" (
+            );""")
+  c.execute("""CREATE TABLE IF NOT EXISTS "vectors" (
                 "icao"     INTEGER KEY NOT NULL,
                 "seen"     TEXT NOT NULL,
                 "speed"    REAL,
                 "heading"  REAL,
                 "vertical" REAL
-            );"""
-    c.execute(query)
-    query = """CREATE TABLE IF NOT EXISTS "ident" (
+            );""")
+  c.execute("""CREATE TABLE IF NOT EXISTS "ident" (
                 "icao"     INTEGER PRIMARY KEY NOT NULL,
                 "ident"    TEXT NOT NULL
-            );"""
-    c.execute(query)
-    c.close()
+            );""")
+
+def _schema_v2(c):
+  #seen becomes integer seconds since the epoch (UTC), and positions and vectors
+  #get indexed on it so queries over a time window don't scan the whole history
+  c.execute("ALTER TABLE positions RENAME TO positions_v1")
+  c.execute("""CREATE TABLE "positions" (
+                "icao" INTEGER NOT NULL,
+                "seen" INTEGER NOT NULL,
+                "alt"  INTEGER,
+                "lat"  REAL,
+                "lon"  REAL
+            );""")
+  c.execute("""INSERT INTO positions (icao, seen, alt, lat, lon)
+               SELECT icao, CAST(strftime('%s', seen) AS INTEGER), alt, lat, lon FROM positions_v1""")
+  c.execute("DROP TABLE positions_v1")
+
+  c.execute("ALTER TABLE vectors RENAME TO vectors_v1")
+  c.execute("""CREATE TABLE "vectors" (
+                "icao"     INTEGER NOT NULL,
+                "seen"     INTEGER NOT NULL,
+                "speed"    REAL,
+                "heading"  REAL,
+                "vertical" REAL
+            );""")
+  c.execute("""INSERT INTO vectors (icao, seen, speed, heading, vertical)
+               SELECT icao, CAST(strftime('%s', seen) AS INTEGER), speed, heading, vertical FROM vectors_v1""")
+  c.execute("DROP TABLE vectors_v1")
+
+  c.execute("CREATE INDEX positions_icao_seen ON positions (icao, seen)")
+  c.execute("CREATE INDEX positions_seen ON positions (seen)")
+  c.execute("CREATE INDEX vectors_icao_seen ON vectors (icao, seen)")
+
+def _schema_v3(c):
+  #positions and vectors move into one partition per day
+  c.execute("""CREATE TABLE "partitions" (
+                "name"  TEXT PRIMARY KEY NOT NULL,
+                "kind"  TEXT NOT NULL,
+                "start" INTEGER NOT NULL,
+                "end"   INTEGER NOT NULL
+            );""")
+  for kind in _columns:
+    c.execute('ALTER TABLE "%s" RENAME TO "%s_v2"' % (kind, kind))
+  for kind in _columns:
+    starts = [r[0] for r in c.execute('SELECT DISTINCT seen - seen %% 86400 FROM "%s_v2"' % (kind,)).fetchall()]
+    for start in starts:
+      name = create_partition(c, kind, start, 86400)
+      c.execute('INSERT INTO "%s" SELECT %s FROM "%s_v2" WHERE seen >= ? AND seen < ?' % (name, _columns[kind][0], kind), (start, start + 86400))
+    c.execute('DROP TABLE "%s_v2"' % (kind,))
+
+def _schema_v4(c):
+  #earlier builds kept a positions view and a vectors view over every partition,
+  #which stops working once there are 500 of them; read through partition_select
+  for kind in _columns:
+    c.execute('DROP VIEW IF EXISTS "%s"' % (kind,))
+
+_migrations = [_schema_v1, _schema_v2, _schema_v3, _schema_v4]
+schema_version = len(_migrations)
+
+#positions and vectors are kept in partitions, one table for each day (or hour) named
+#for how long it is and when it starts, like positions_d20120614 or positions_h2012061400,
+#so a day and an hour starting at the same time are never the same table if the
+#width changes between runs. overlapping partitions are fine, since every row is
+#only in one of them and queries look at all that overlap. the partitions table says which
+#stretch of seen each one covers, so a query only has to look at the partitions that
+#can hold what it wants (see partition_select), and the whole of an old one can be
+#dropped at once when it's past keeping. there's no view over all of them: sqlite
+#won't take more than 500 tables in one UNION ALL, and hourly partitions with no
+#retention get there in three weeks. read them through partition_select.
+_columns = {"positions": ("icao, seen, alt, lat, lon", '"alt" INTEGER, "lat" REAL, "lon" REAL'),
+            "vectors": ("icao, seen, speed, heading, vertical", '"speed" REAL, "heading" REAL, "vertical" REAL')}
+
+_width_names = {86400: "d%Y%m%d", 3600: "h%Y%m%d%H"}
+
+def partition_name(kind, start, width):
+  format = _width_names.get(width, "%i_%%Y%%m%%d%%H%%M%%S" % (width,))
+  return "%s_%s" % (kind, time.strftime(format, time.gmtime(start)))
+
+def create_partition(c, kind, start, width):
+  #returns the name of the partition of kind covering width seconds from start,
+  #creating it if need be
+  name = partition_name(kind, start, width)
+  c.execute('CREATE TABLE IF NOT EXISTS "%s" ("icao" INTEGER NOT NULL, "seen" INTEGER NOT NULL, %s)' % (name, _columns[kind][1]))
+  c.execute('CREATE INDEX IF NOT EXISTS "%s_icao_seen" ON "%s" (icao, seen)' % (name, name))
+  c.execute('CREATE INDEX IF NOT EXISTS "%s_seen" ON "%s" (seen)' % (name, name))
+  c.execute('INSERT OR IGNORE INTO partitions (name, kind, start, end) VALUES (?, ?, ?, ?)', (name, kind, start, start + width))
+  if c.rowcount != 1 and c.execute("SELECT start, end FROM partitions WHERE name = ?", (name,)).fetchone() != (start, start + width):
+    raise Exception("partition %s is already registered with a different range" % (name,))
+  return name
 
-  def __del__(self):
-    self.db.close()
+def drop_partitions(c, before):
+  #drops every partition that ends before before, returning their names
+  names = [r[0] for r in c.execute("SELECT name FROM partitions WHERE end <= ?", (before,)).fetchall()]
+  for name in names:
+    c.execute('DROP TABLE "%s"' % (name,))
+    c.execute("DELETE FROM partitions WHERE name = ?", (name,))
+  return names
 
-  def insert(self, message):
-    query = self.make_insert_query(message)
-    if query is not None:
-      c = self.db.cursor()
-      c.execute(query)
+#how many partitions partition_select puts in one UNION ALL, well inside sqlite's 500
+_compound_terms = 100
+
+def partition_select(db, kind, since=None):
+  #a SELECT of the rows of kind seen after since (or all of them), which only looks
+  #in the partitions that can have any. the columns are icao, seen and the kind's own.
+  #past _compound_terms partitions, they're unioned in groups and the groups unioned.
+  columns = _columns[kind][0]
+  if since is None:
+    names = [r[0] for r in db.execute("SELECT name FROM partitions WHERE kind = ? ORDER BY start", (kind,)).fetchall()]
+    selects = ['SELECT %s FROM "%s"' % (columns, name) for name in names]
+  else:
+    names = [r[0] for r in db.execute("SELECT name FROM partitions WHERE kind = ? AND end > ? ORDER BY start", (kind, since)).fetchall()]
+    selects = ['SELECT %s FROM "%s" INDEXED BY "%s_seen" WHERE seen > %i' % (columns, name, name, since) for name in names]
+  if not selects:
+    return "SELECT %s WHERE 0" % (", ".join(["NULL AS %s" % (column,) for column in columns.split(", ")]),)
+  while len(selects) > _compound_terms:
+    selects = ["SELECT %s FROM (%s)" % (columns, " UNION ALL ".join(selects[i:i+_compound_terms]))
+               for i in range(0, len(selects), _compound_terms)]
+  return " UNION ALL ".join(selects)
+
+def migrate(db):
+  #brings db up to schema_version. each step is its own transaction, so a step that
+  #fails leaves the database as it was at the end of the one before.
+  version = db.execute("PRAGMA user_version").fetchone()[0]
+  if version > schema_version:
+    raise Exception("database is schema version %i; this version of gr-air-modes only knows up to %i" % (version, schema_version))
+
+  isolation_level = db.isolation_level
+  db.isolation_level = None #python's sqlite3 commits before DDL on its own otherwise
+  try:
+    if version == 0 and db.execute("SELECT count(*) FROM sqlite_master").fetchone()[0] == 0:
+      #a new database. this has to be set before there are any tables; it lets the
+      #space from dropped partitions go back to the filesystem.
+      db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+    for step in range(version, schema_version):
+      c = db.cursor()
+      c.execute("BEGIN")
+      try:
+        _migrations[step](c)
+        c.execute("PRAGMA user_version = %i" % (step+1))
+      except:
+        c.execute("ROLLBACK")
+        raise
+      c.execute("COMMIT")
       c.close()
-      self.db.commit() #not sure if i have to do this
-  
-  def make_insert_query(self, message):
-    #assembles a SQL query tailored to our database
-    #this version ignores anything that isn't Type 17 for now, because we just don't care
-    [msgtype, shortdata, longdata, parity, ecc, reference, time_secs] = message.split()
+  finally:
+    db.isolation_level = isolation_level
+
+class modes_output_sql(threading.Thread):
+  _queries = [("ident", "INSERT OR REPLACE INTO ident (icao, ident) VALUES (?, ?)"),
+              ("positions", 'INSERT INTO "%s" (icao, seen, alt, lat, lon) VALUES (?, ?, ?, ?, ?)'),
+              ("vectors", 'INSERT INTO "%s" (icao, seen, speed, heading, vertical) VALUES (?, ?, ?, ?, ?)')]
+
+  def __init__(self, filename, synchronous="NORMAL", queue_size=10000, batch_size=1000, batch_interval=1.0, block=True,
+               partition=86400, retention=None, retention_interval=600):
+    threading.Thread.__init__(self)
+    self._filename = filename
+    self._synchronous = synchronous
+    self._partition = partition
+    self._retention = retention
+    self._retention_interval = retention_interval
+    self._partitions = {} #(kind, start) to the name of each partition the writer knows exists
+    self._batch_size = batch_size
+    self._batch_interval = batch_interval
+    self._wait_when_full = block
+    self._queue = Queue.Queue(queue_size)
+    self._lock = threading.Lock()
+    self._stats = {"queued": 0,       #rows handed to the writer
+                   "written": 0,      #rows committed
+                   "dropped": 0,      #rows thrown away because the queue was full
+                   "stalls": 0,       #times insert() found the queue full
+                   "stall_time": 0.0, #seconds insert() spent waiting on a full queue
+                   "flushes": 0,      #transactions committed
+                   "last_flush_rows": 0,
+                   "max_flush_time": 0.0,
+                   "partitions_dropped": 0,
+                   "errors": 0,       #batches or expiry runs sqlite failed
+                   "lost": 0}         #rows in the batches that failed
+
+    #create or upgrade the database. this is done here rather than in the writer
+    #thread so the tables are there as soon as we return, for anything reading alongside.
+    db = sqlite3.connect(filename)
+    migrate(db)
+    db.close()
+
+    self.setDaemon(1)
+    self.start()
+
+  def insert(self, report):
+    row = self.make_row(report)
+    if row is None:
+      return
+
+    try:
+      self._queue.put_nowait(row)
+    except Queue.Full:
+      self._check_writer()
+      with self._lock:
+        self._stats["stalls"] += 1
+      if not self._wait_when_full:
+        with self._lock:
+          self._stats["dropped"] += 1
+        return
+      start = time.time()
+      self._put(row)
+      with self._lock:
+        self._stats["stall_time"] += time.time() - start
+    with self._lock:
+      self._stats["queued"] += 1
 
-    shortdata = long(shortdata, 16)
-    longdata = long(longdata, 16)
-    parity = long(parity, 16)
-    ecc = long(ecc, 16)
-#   reference = float(reference)
+  def flush(self):
+    #returns once everything inserted so far is committed (or has failed and been counted)
+    self._put(_flush)
+    queue = self._queue
+    with queue.all_tasks_done:
+      while queue.unfinished_tasks:
+        self._check_writer()
+        queue.all_tasks_done.wait(0.5)
 
-    msgtype = int(msgtype)
+  def _put(self, item):
+    #a blocking put that gives up if there's no writer left to make room
+    while 1:
+      try:
+        self._queue.put(item, True, 0.5)
+        return
+      except Queue.Full:
+        self._check_writer()
 
-    query = None
+  def _check_writer(self):
+    if not self.isAlive():
+      raise Exception("the SQL writer thread has stopped")
 
-    if msgtype == 17:
-      query = self.sql17(shortdata, longdata, parity, ecc)
+  def close(self):
+    #commits whatever's left and stops the writer
+    if self.isAlive():
+      self._queue.put(_stop)
+      self.join()
 
-    return query
+  def stats(self):
+    with self._lock:
+      stats = dict(self._stats)
+    stats["queue_depth"] = self._queue.qsize()
+    return stats
 
-  def sql17(self, shortdata, longdata, parity, ecc):
-    icao24 = shortdata & 0xFFFFFF	
-    subtype = (longdata >> 51) & 0x1F
+  def run(self):
+    db = sqlite3.connect(self._filename, isolation_level=None) #we do our own transactions
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=%s" % self._synchronous)
 
-    retstr = None
+    batch = dict([(table, []) for (table, query) in self._queries])
+    nrows = 0
+    deadline = None
+    next_expiry = 0
+    while 1:
+      if self._retention is not None and time.time() >= next_expiry:
+        try:
+          self.expire(db)
+        except sqlite3.Error, e:
+          self._failed(db, "SQL partition expiry failed: %s" % (e,), 0)
+        next_expiry = time.time() + self._retention_interval
 
-    if subtype == 4:
-      msg = self.parseBDS08(shortdata, longdata, parity, ecc)
-      retstr = "INSERT OR REPLACE INTO ident (icao, ident) VALUES (" + "%i" % icao24 + ", '" + msg + "')"
+      try:
+        if nrows == 0:
+          item = self._queue.get()
+        else:
+          item = self._queue.get(True, max(0, deadline - time.time()))
+      except Queue.Empty:
+        item = None #batch_interval is up
 
-    elif subtype >= 5 and subtype <= 8:
-      [altitude, decoded_lat, decoded_lon, rnge, bearing] = self.parseBDS06(shortdata, longdata, parity, ecc)
-      if decoded_lat is None: #no unambiguously valid position available
-        retstr = None
-      else:
-        retstr = "INSERT INTO positions (icao, seen, alt, lat, lon) VALUES (" + "%i" % icao24 + ", datetime('now'), " + str(altitude) + ", " + "%.6f" % decoded_lat + ", " + "%.6f" % decoded_lon + ")"
+      if isinstance(item, tuple):
+        (table, row) = item
+        batch[table].append(row)
+        nrows += 1
+        if nrows == 1:
+          deadline = time.time() + self._batch_interval
+        if nrows < self._batch_size:
+          continue
 
-    elif subtype >= 9 and subtype <= 18 and subtype != 15: #i'm eliminating type 15 records because they don't appear to be valid position reports.
-      [altitude, decoded_lat, decoded_lon, rnge, bearing] = self.parseBDS05(shortdata, longdata, parity, ecc)
-      if decoded_lat is None: #no unambiguously valid position available
-        retstr = None
-      else:
-        retstr = "INSERT INTO positions (icao, seen, alt, lat, lon) VALUES (" + "%i" % icao24 + ", datetime('now'), " + str(altitude) + ", " + "%.6f" % decoded_lat + ", " + "%.6f" % decoded_lon + ")"
+      if nrows:
+        try:
+          self.write(db, batch, nrows)
+        except sqlite3.Error, e:
+          self._failed(db, "SQL write failed, %i rows lost: %s" % (nrows, e), nrows)
+        for (table, query) in self._queries:
+          batch[table] = []
+        for i in range(0, nrows):
+          self._queue.task_done()
+        nrows = 0
+
+      if item is _flush or item is _stop:
+        self._queue.task_done()
+        if item is _stop:
+          break
+
+    db.close()
+
+  def _failed(self, db, message, nrows):
+    #rolls back whatever the failed transaction got done, and forgets any partitions
+    #it made, since they went with it
+    print message
+    try:
+      db.execute("ROLLBACK")
+    except sqlite3.Error:
+      pass #the failure already ended the transaction, or it never began
+    self._partitions = {}
+    with self._lock:
+      self._stats["errors"] += 1
+      self._stats["lost"] += nrows
+
+  def write(self, db, batch, nrows):
+    start = time.time()
+    c = db.cursor()
+    c.execute("BEGIN")
+    for (table, query) in self._queries:
+      if not batch[table]:
+        continue
+      if table not in _columns:
+        c.executemany(query, batch[table])
+        continue
+
+      #sort the rows out by partition
+      partitions = {}
+      for row in batch[table]:
+        seen = row[1]
+        partitions.setdefault(seen - seen % self._partition, []).append(row)
+      for (partition_start, rows) in partitions.items():
+        name = self._partitions.get((table, partition_start))
+        if name is None:
+          name = create_partition(c, table, partition_start, self._partition)
+          self._partitions[(table, partition_start)] = name
+        c.executemany(query % (name,), rows)
+    c.execute("COMMIT")
+    c.close()
+    elapsed = time.time() - start
+    with self._lock:
+      stats = self._stats
+      stats["written"] += nrows
+      stats["flushes"] += 1
+      stats["last_flush_rows"] = nrows
+      stats["max_flush_time"] = max(stats["max_flush_time"], elapsed)
+
+  def expire(self, db):
+    #drops partitions with nothing newer than retention seconds in them
+    c = db.cursor()
+    c.execute("BEGIN")
+    names = drop_partitions(c, time.time() - self._retention)
+    c.execute("COMMIT")
+    if names:
+      c.execute("PRAGMA incremental_vacuum").fetchall() #does nothing unless the database was created with auto_vacuum
+      for (key, name) in self._partitions.items():
+        if name in names:
+          del self._partitions[key]
+      with self._lock:
+        self._stats["partitions_dropped"] += len(names)
+    c.close()
+
+  def make_row(self, report):
+    #turns a report into a (table, row) pair for the writer
+    #this version ignores anything that isn't Type 17 for now, because we just don't care
+    row = None
 
-    elif subtype == 19:
-      subsubtype = (longdata >> 48) & 0x07
-      if subsubtype == 0:
-        [velocity, heading, vert_spd] = self.parseBDS09_0(shortdata, longdata, parity, ecc)
-        retstr = "INSERT INTO vectors (icao, seen, speed, heading, vertical) VALUES (" + "%i" % icao24 + ", datetime('now'), " + "%.0f" % velocity + ", " + "%.0f" % heading + ", " + "%.0f" % vert_spd + ")";
+    if report.frame.msgtype == 17:
+      row = self.sql17(report)
 
-      elif subsubtype == 1:
-        [velocity, heading, vert_spd] = self.parseBDS09_1(shortdata, longdata, parity, ecc)
-        retstr = "INSERT INTO vectors (icao, seen, speed, heading, vertical) VALUES (" + "%i" % icao24 + ", datetime('now'), " + "%.0f" % velocity + ", " + "%.0f" % heading + ", " + "%.0f" % vert_spd + ")";
+    return row
 
-    return retstr
+  def sql17(self, report):
+    icao24 = report.icao
+    seen = int(report.frame.timestamp) #when it was received, not when we got round to it
+    row = None
 
+    if isinstance(report, identification):
+      row = ("ident", (icao24, report.ident))
 
+    elif isinstance(report, airborne_position) and report.subtype != 15: #i'm eliminating type 15 records because they don't appear to be valid position reports.
+      #this covers surface positions too
+      if report.lat is not None: #no unambiguously valid position available otherwise
+        altitude = report.altitude
+        if not isinstance(altitude, int): #decode_alt gives us a string for metric altitudes
+          altitude = None
+        row = ("positions", (icao24, seen, altitude, round(report.lat, 6), round(report.lon, 6)))
 
+    elif isinstance(report, velocity):
+      row = ("vectors", (icao24, seen, round(report.velocity), round(report.heading), round(report.vert_spd)))
 
+    return row
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+#
+# Copyright 2010 Nick Foster
+# 
+# This file is part of gr-air-modes
+# 
+# gr-air-modes is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+# 
+# gr-air-modes is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with gr-air-modes; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+# 
+
+#runs synthetic IQ through the receive chain from uhd_modes.py with the preamble
+#search split across different numbers of threads, and checks that every run
+#hands the slicer exactly the same frames as the single-threaded one, and that
+#the frames are timestamped by where they are in the stream.
+
+from gnuradio import gr, air
+from modes_iqgen import aircraft, modulate, noise
+import modes_frame
+import numpy, random, math, sys
+
+rate = 8000000
+samples_per_chip = rate / 2000000
+random.seed(1090)
+nprng = numpy.random.RandomState(1090)
+
+#dense traffic: short gaps, some of them shorter than a packet so replies overlap
+planes = [aircraft(random, [37.76225, -122.44254]) for i in range(0, 50)]
+chunks = []
+starts = [] #the sample each packet starts at
+nsamples = 0
+for n in range(0, 4000):
+	(df, islong, bits) = random.choice(planes).next_frame()
+	pulses = modulate(bits, 112 if islong else 56, samples_per_chip) * 10 ** (random.uniform(8, 25) / 20.0)
+	chunk = noise(nprng, random.randint(100, 2000) + len(pulses))
+	chunk[-len(pulses):] += pulses.astype(numpy.complex64)
+	chunks.append(chunk)
+	nsamples += len(chunk)
+	starts.append(nsamples - len(pulses))
+chunks.append(noise(nprng, 10000))
+samples = numpy.concatenate(chunks)
+
+taps = gr.firdes.low_pass(1, rate, 1.8e6, 200e3)
+
+def run(nthreads):
+	queue = gr.msg_queue()
+	tb = gr.top_block()
+	src = gr.vector_source_c(samples.tolist())
+	lpfilter = gr.fir_filter_ccc(1, taps)
+	demod = gr.complex_to_mag()
+	avg = gr.moving_average_ff(100, 1.0/100, 400)
+	preamble = air.modes_preamble(rate, 3.0)
+	preamble.set_nthreads(nthreads)
+	slicer = air.modes_slicer(rate, queue)
+	slicer.set_start_time(0) #count from the first sample, so every run stamps the same
+	tb.connect(src, lpfilter, demod)
+	tb.connect(demod, avg)
+	tb.connect(demod, (preamble, 0))
+	tb.connect(avg, (preamble, 1))
+	tb.connect((preamble, 0), (slicer, 0))
+	tb.run()
+
+	frames = []
+	times = []
+	while queue.empty_p() == 0:
+		frame = modes_frame.from_message(queue.delete_head())
+		frames.append(str(frame))
+		times.append(frame.timestamp)
+	return (preamble.num_preambles(), frames, times)
+
+(reference_preambles, reference, times) = run(1)
+print "1 thread: %i preambles, %i frames" % (reference_preambles, len(reference))
+
+#every frame should be stamped within the filter's length of a packet we put there
+failures = 0
+starts = numpy.array(starts)
+for timestamp in times:
+	sample = timestamp * rate
+	nearest = starts[numpy.abs(starts - sample).argmin()]
+	if abs(nearest - sample) > len(taps):
+		print "Frame at sample %.1f, nearest packet at %i" % (sample, nearest)
+		failures += 1
+
+for nthreads in [2, 3, 4, 8]:
+	(npreambles, frames, times) = run(nthreads)
+	print "%i threads: %i preambles, %i frames" % (nthreads, npreambles, len(frames))
+	if npreambles != reference_preambles or frames != reference:
+		print "  does not match the single-threaded search"
+		failures += 1
+
+if failures:
+	sys.exit(1)
+
+print "Threaded preamble search matches the single-threaded one"
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+#
+# Copyright 2010 Nick Foster
+# 
+# This file is part of gr-air-modes
+# 
+# gr-air-modes is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+# 
+# gr-air-modes is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with gr-air-modes; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+# 
+
+#checks the partitioned SQL schema: an old database migrates into daily
+#partitions, changing the partition width between runs keeps every row where
+#partition_select and retention can find it, and retention only drops
+#partitions that are entirely past keeping. more partitions than sqlite will
+#take in one UNION ALL are still written and read.
+
+from modes_sql import *
+from modes_frame import modes_frame, frame_record, Long_Packet
+import sqlite3, os, sys, tempfile, shutil, calendar
+
+failures = 0
+def check(what, ok):
+	global failures
+	if not ok:
+		print "FAILED: %s" % what
+		failures += 1
+
+def position(icao24, seen):
+	frame = modes_frame(frame_record.pack("\0" * 14, 17, Long_Packet, 0, 0.0, seen, 0.0))
+	return airborne_position(frame, icao24, 11, 10000, 37.5, -122.0, None, None)
+
+def count(db, kind, since=None):
+	return db.execute("SELECT count(*) FROM (%s)" % (partition_select(db, kind, since),)).fetchone()[0]
+
+midnight = calendar.timegm((2012, 10, 18, 0, 0, 0))
+hour = 3600
+day = 86400
+
+tmpdir = tempfile.mkdtemp()
+try:
+	#a database from before the schema was versioned, with two days of positions
+	filename = os.path.join(tmpdir, "old.db")
+	db = sqlite3.connect(filename)
+	c = db.cursor()
+	c.execute('CREATE TABLE "positions" ("icao" INTEGER KEY NOT NULL, "seen" TEXT NOT NULL, "alt" INTEGER, "lat" REAL, "lon" REAL)')
+	c.execute('CREATE TABLE "vectors" ("icao" INTEGER KEY NOT NULL, "seen" TEXT NOT NULL, "speed" REAL, "heading" REAL, "vertical" REAL)')
+	c.execute('CREATE TABLE "ident" ("icao" INTEGER PRIMARY KEY NOT NULL, "ident" TEXT NOT NULL)')
+	for seen in [midnight - hour, midnight + hour, midnight + 10*hour]:
+		c.execute("INSERT INTO positions VALUES (?, datetime(?, 'unixepoch'), 10000, 37.5, -122.0)", (0xabcdef, seen))
+	c.execute("INSERT INTO vectors VALUES (?, datetime(?, 'unixepoch'), 400, 90, 0)", (0xabcdef, midnight + hour))
+	db.commit()
+	migrate(db)
+	check("migrated to the current schema", db.execute("PRAGMA user_version").fetchone()[0] == schema_version)
+	partitions = db.execute("SELECT name, kind, start, end FROM partitions ORDER BY kind, start").fetchall()
+	check("one daily partition per day", partitions == [("positions_d20121017", "positions", midnight - day, midnight),
+	                                                     ("positions_d20121018", "positions", midnight, midnight + day),
+	                                                     ("vectors_d20121018", "vectors", midnight, midnight + day)])
+	check("no views over the partitions", db.execute("SELECT count(*) FROM sqlite_master WHERE type = 'view'").fetchone()[0] == 0)
+	check("every position survives", count(db, "positions") == 3)
+	check("and every vector", count(db, "vectors") == 1)
+	check("with seen in seconds", db.execute("SELECT seen FROM (%s) ORDER BY seen" % (partition_select(db, "positions"),)).fetchall() == [(midnight - hour,), (midnight + hour,), (midnight + 10*hour,)])
+	check("partition_select finds the new ones", count(db, "positions", midnight + 5*hour) == 1)
+	db.close()
+
+	#hourly partitions, then a restart with daily ones, covering the same stretch
+	filename = os.path.join(tmpdir, "adsb.db")
+	writer = modes_output_sql(filename, partition=hour)
+	for seen in [midnight + 10, midnight + 20]:
+		writer.insert(position(0x111111, seen))
+	writer.close()
+	writer = modes_output_sql(filename, partition=day)
+	for seen in [midnight + 30, midnight + 11*hour]:
+		writer.insert(position(0x222222, seen))
+	writer.close()
+
+	db = sqlite3.connect(filename)
+	partitions = db.execute("SELECT name, start, end FROM partitions WHERE kind = 'positions' ORDER BY end").fetchall()
+	check("hour and day partitions are separate", partitions == [("positions_h2012101800", midnight, midnight + hour),
+	                                                             ("positions_d20121018", midnight, midnight + day)])
+	check("partition_select has every row", count(db, "positions") == 4)
+	check("partition_select finds the hourly rows", count(db, "positions", midnight) == 4)
+	check("and rows after the hour ends", count(db, "positions", midnight + 10*hour) == 1)
+
+	#retention past the end of the hour only takes the hourly partition
+	c = db.cursor()
+	check("retention drops just the finished partition", drop_partitions(c, midnight + 2*hour) == ["positions_h2012101800"])
+	db.commit()
+	check("the daily partition's rows are all still there", count(db, "positions") == 2)
+	check("and partition_select still finds them", count(db, "positions", midnight + 10*hour) == 1)
+	check("retention before the day ends keeps it", drop_partitions(c, midnight + day - 1) == [])
+	check("retention after the day ends drops it", drop_partitions(c, midnight + day) == ["positions_d20121018"])
+	db.commit()
+	check("nothing left", count(db, "positions") == 0 and count(db, "positions", 0) == 0)
+
+	#the writer's own retention, going by the time now
+	now = int(time.time())
+	create_partition(c, "positions", now - 3*day - now % day, day)
+	create_partition(c, "positions", now - now % day, day)
+	db.commit()
+	db.close()
+	writer = modes_output_sql(filename, retention=2*day)
+	writer.flush()
+	writer.close()
+	check("writer drops partitions past the retention", writer.stats()["partitions_dropped"] == 1)
+	db = sqlite3.connect(filename)
+	check("and keeps today's", db.execute("SELECT start FROM partitions").fetchall() == [(now - now % day,)])
+	db.close()
+
+	#25 days of hourly partitions with no retention: 600 of them, more than sqlite
+	#will take in one compound SELECT
+	filename = os.path.join(tmpdir, "hourly.db")
+	writer = modes_output_sql(filename, partition=hour)
+	for i in range(0, 600):
+		writer.insert(position(0x333333, midnight + i*hour + 10))
+		if i % 100 == 99:
+			writer.flush()
+	writer.close()
+	stats = writer.stats()
+	check("every hour is written", stats["written"] == 600 and stats["errors"] == 0 and stats["lost"] == 0)
+	db = sqlite3.connect(filename)
+	check("into its own partition", db.execute("SELECT count(*) FROM partitions").fetchone()[0] == 600)
+	check("partition_select reads them all", count(db, "positions") == 600 and count(db, "positions", 0) == 600)
+	check("and just the recent ones", count(db, "positions", midnight + 590*hour) == 10)
+	db.close()
+finally:
+	shutil.rmtree(tmpdir)
+
+if failures:
+	print "%i failures" % failures
+	sys.exit(1)
+
+print "SQL partitions OK"
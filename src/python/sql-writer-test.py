@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+#
+# Copyright 2010 Nick Foster
+# 
+# This file is part of gr-air-modes
+# 
+# gr-air-modes is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3, or (at your option)
+# any later version.
+# 
+# gr-air-modes is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with gr-air-modes; see the file COPYING.  If not, write to
+# the Free Software Foundation, Inc., 51 Franklin Street,
+# Boston, MA 02110-1301, USA.
+# 
+
+#checks that the SQL writer thread survives sqlite failing a batch: the rows are
+#counted as lost, the writer carries on, and flush() still returns. and that
+#if the writer does die, insert() and flush() raise instead of hanging.
+
+from modes_sql import *
+from modes_frame import modes_frame, frame_record, Long_Packet
+import sqlite3, os, sys, tempfile, shutil, threading
+
+failures = 0
+def check(what, ok):
+	global failures
+	if not ok:
+		print "FAILED: %s" % what
+		failures += 1
+
+def position(icao24, seen):
+	frame = modes_frame(frame_record.pack("\0" * 14, 17, Long_Packet, 0, 0.0, seen, 0.0))
+	return airborne_position(frame, icao24, 11, 10000, 37.5, -122.0, None, None)
+
+#runs f in a thread and says whether it came back. sqlite waits 5 seconds
+#for a lock before it gives up, so this has to wait longer than that.
+def returns(f):
+	t = threading.Thread(target=f)
+	t.setDaemon(1)
+	t.start()
+	t.join(20)
+	return not t.isAlive()
+
+tmpdir = tempfile.mkdtemp()
+try:
+	filename = os.path.join(tmpdir, "adsb.db")
+	writer = modes_output_sql(filename, batch_interval=0.05)
+	writer.flush() #so the writer's connected before anyone else takes the lock
+
+	#hold a write lock from another connection so the writer's batch fails
+	blocker = sqlite3.connect(filename, timeout=0, isolation_level=None)
+	blocker.execute("BEGIN EXCLUSIVE")
+	for i in range(0, 10):
+		writer.insert(position(0xabcdef, 1350000000 + i))
+	check("flush returns with the database locked", returns(writer.flush))
+	stats = writer.stats()
+	check("failed batch is counted", stats["errors"] == 1 and stats["lost"] == 10 and stats["written"] == 0)
+	blocker.execute("ROLLBACK")
+	blocker.close()
+
+	#a row sqlite won't bind fails its batch without taking the writer down
+	writer._queue.put(("positions", (0xabcdef, 1350000100, object(), 37.5, -122.0)))
+	check("flush returns after a bad row", returns(writer.flush))
+	check("bad row is counted", writer.stats()["errors"] == 2)
+
+	#and the writer's still there for the next lot
+	for i in range(0, 10):
+		writer.insert(position(0x123456, 1350000200 + i))
+	writer.flush()
+	check("writer carries on", writer.stats()["written"] == 10)
+	db = sqlite3.connect(filename)
+	check("rows after the failures are there", db.execute("SELECT count(*) FROM (%s) WHERE icao = ?" % (partition_select(db, "positions"),), (0x123456,)).fetchone()[0] == 10)
+	check("rows from the failed batches aren't", db.execute("SELECT count(*) FROM (%s) WHERE icao = ?" % (partition_select(db, "positions"),), (0xabcdef,)).fetchone()[0] == 0)
+	db.close()
+	writer.close()
+
+	#a writer that's gone can't make room in the queue
+	writer = modes_output_sql(filename, queue_size=2)
+	writer.close()
+	raised = []
+	def fill():
+		try:
+			for i in range(0, 3):
+				writer.insert(position(0xabcdef, 1350000300 + i))
+		except Exception:
+			raised.append(True)
+	check("insert into a dead writer returns", returns(fill))
+	check("and raises", raised == [True])
+	raised = []
+	def flush():
+		try:
+			writer.flush()
+		except Exception:
+			raised.append(True)
+	check("flush on a dead writer returns", returns(flush))
+	check("and raises", raised == [True])
+finally:
+	shutil.rmtree(tmpdir)
+
+if failures:
+	print "%i failures" % failures
+	sys.exit(1)
+
+print "SQL writer error handling OK"
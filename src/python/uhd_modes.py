@@ -29,8 +29,11 @@ import time, os, sys, threading
 from string import split, join
 from modes_print import modes_output_print
 from modes_sql import modes_output_sql
+from modes_columnar import modes_output_columnar
 from modes_sbs1 import modes_output_sbs1
-from modes_kml import modes_kml
+from modes_kml import modes_kml_live, modes_kml_networklink
+import modes_frame
+from modes_parse import modes_parse
 import gnuradio.gr.gr_threading as _threading
 import csv
 
@@ -77,6 +80,9 @@ class adsb_rx_block (gr.top_block):
       self.u.set_gain(options.gain)
       print "Gain is %i" % (self.u.get_gain(),)
 
+      #the USRP tags the stream with its own clock, so set that to ours
+      self.u.set_time_now(uhd.time_spec_t(time.time()))
+
     else:
       self.u = gr.file_source(gr.sizeof_gr_complex, options.filename)
 
@@ -95,8 +101,12 @@ class adsb_rx_block (gr.top_block):
     self.lpfilter = gr.fir_filter_ccc(1, self.lpfiltcoeffs)
     
     self.preamble = air.modes_preamble(rate, options.threshold)
+    self.preamble.set_nthreads(options.threads)
     #self.framer = air.modes_framer(rate)
     self.slicer = air.modes_slicer(rate, queue)
+    self.slicer.set_error_correction(options.error_correction)
+    if options.start_time is not None: #otherwise it's when the flowgraph was built
+      self.slicer.set_start_time(options.start_time)
     
     self.connect(self.u, self.lpfilter, self.demod)
     self.connect(self.demod, self.avg)
@@ -108,6 +118,31 @@ class adsb_rx_block (gr.top_block):
     result = self.u.set_center_freq(freq, 0)
     return result
 
+#the file source has no throttle, so with -F the flowgraph already runs flat out.
+#this just reports how fast that was. the sample count comes from the file size,
+#so it's only meaningful if the run wasn't interrupted.
+def print_benchmark(fg, decoder, options, elapsed, finished, dfcounts, sqlport):
+  nsamples = os.path.getsize(options.filename) / gr.sizeof_gr_complex
+  print ""
+  if not finished:
+    print "Interrupted before the end of the file; rates below are overstated"
+  print "Input samples: %i in %.3f seconds" % (nsamples, elapsed)
+  print "Samples/sec: %s" % (eng_notation.num_to_str(nsamples / elapsed),)
+  print "Real-time factor at %ssps: %.2fx" % (eng_notation.num_to_str(options.rate), nsamples / (elapsed * options.rate))
+  print "Preambles detected: %i" % (fg.preamble.num_preambles(),)
+  print "Frames sliced: %i" % (fg.slicer.num_sliced(),)
+  print "Frames passing parity: %i" % (fg.slicer.num_passed(),)
+  print "Frames corrected: %i one-bit, %i two-bit" % (fg.slicer.num_corrected(1), fg.slicer.num_corrected(2))
+  print "Address/parity frames from unknown aircraft: %i" % (decoder.rejected,)
+  for df in sorted(dfcounts.keys()):
+    print "Type %i reports: %i" % (df, dfcounts[df])
+  if sqlport is not None:
+    stats = sqlport.stats()
+    print "SQL rows written: %i in %i transactions (largest took %.3f seconds)" % (stats["written"], stats["flushes"], stats["max_flush_time"])
+    print "SQL queue full: %i times, %.3f seconds waiting" % (stats["stalls"], stats["stall_time"])
+    if stats["errors"]:
+      print "SQL errors: %i, %i rows lost" % (stats["errors"], stats["lost"])
+
 if __name__ == '__main__':
   usage = "%prog: [options] output filename"
   parser = OptionParser(option_class=eng_option, usage=usage)
@@ -123,20 +158,43 @@ if __name__ == '__main__':
                       help="set ADC sample rate [default=%default]")
   parser.add_option("-T", "--threshold", type="eng_float", default=3.0,
                       help="set pulse detection threshold above noise in dB [default=%default]")
+  parser.add_option("-t", "--threads", type="int", default=1,
+                      help="number of threads to search for preambles with [default=%default]")
+  parser.add_option("-e", "--error-correction", type="int", default=0,
+                      help="fix up to this many bad bits (0, 1 or 2) in type 11 and 17 packets [default=%default]")
   parser.add_option("-a","--output-all", action="store_true", default=False,
-                      help="output all frames")
+                      help="output all frames, even address/parity frames from aircraft we haven't heard a clean frame from")
   parser.add_option("-F","--filename", type="string", default=None,
             help="read data from file instead of USRP")
+  parser.add_option("--start-time", type="float", default=None,
+                      help="with -F, when the file was recorded, in seconds since the epoch, to time frames by [default: now]")
   parser.add_option("-K","--kml", type="string", default=None,
                       help="filename for Google Earth KML output")
+  parser.add_option("--kml-port", type="int", default=None,
+                      help="serve KML as a NetworkLink with incremental updates on this HTTP port")
+  parser.add_option("--sql", type="string", default=None,
+                      help="log positions, vectors and idents to this SQLite database")
+  parser.add_option("--sql-sync", type="choice", choices=["OFF", "NORMAL", "FULL"], default="NORMAL",
+                      help="SQLite synchronous setting for the --sql database: OFF, NORMAL or FULL [default=%default]")
+  parser.add_option("--sql-partition", type="choice", choices=["hour", "day"], default="day",
+                      help="split positions and vectors in the database into a table per hour or per day [default=%default]")
+  parser.add_option("--sql-retention", type="eng_float", default=None,
+                      help="drop database partitions once they're this many days old [default: keep everything]")
+  parser.add_option("--export", type="string", default=None,
+                      help="write every decoded report to columnar files (Parquet with pyarrow, .npz without) in this directory")
   parser.add_option("-P","--sbs1", action="store_true", default=False,
                       help="open an SBS-1-compatible server on port 30003")
   parser.add_option("-n","--no-print", action="store_true", default=False,
                       help="disable printing decoded packets to stdout")
   parser.add_option("-l","--location", type="string", default=None,
                       help="GPS coordinates of receiving station in format xx.xxxxx,xx.xxxxx (latlon)")
+  parser.add_option("-B","--benchmark", action="store_true", default=False,
+                      help="replay the file given with -F as fast as possible and print throughput figures at the end")
   (options, args) = parser.parse_args()
 
+  if options.benchmark and options.filename is None:
+    parser.error("--benchmark needs a recorded IQ file (-F); try modes_iqgen.py to make one")
+
   if options.location is not None:
     reader = csv.reader([options.location])
     latlon = reader.next();
@@ -147,21 +205,45 @@ if __name__ == '__main__':
   outputs = [] #registry of plugin output functions
   updates = [] #registry of plugin update functions
 
-  if options.kml is not None:
-    sqlport = modes_output_sql(my_position, 'adsb.db') #create a SQL parser to push stuff into SQLite
+  sqlport = None
+  if options.sql is not None:
+    partition = {"hour": 3600, "day": 86400}[options.sql_partition]
+    retention = None
+    if options.sql_retention is not None:
+      retention = options.sql_retention * 86400
+    sqlport = modes_output_sql(options.sql, options.sql_sync, partition=partition, retention=retention) #create a SQL parser to push stuff into SQLite
     outputs.append(sqlport.insert)
+
+  exporter = None
+  if options.export is not None:
+    exporter = modes_output_columnar(options.export)
+    outputs.append(exporter.output)
+    updates.append(exporter.update)
+
+  kmlgen = None
+  if options.kml_port is not None:
+    #as below, and also serve it to Google Earth a change at a time
+    kmlgen = modes_kml_networklink(options.kml, my_position, options.kml_port)
+  elif options.kml is not None:
     #also we spawn a thread to run every 30 seconds (or whatever) to generate KML
-    kmlgen = modes_kml('adsb.db', options.kml, my_position) #create a KML generating thread which reads the database
+    kmlgen = modes_kml_live(options.kml, my_position) #create a KML generating thread which keeps track of aircraft as reports come in
+  if kmlgen is not None:
+    outputs.append(kmlgen.output)
 
   if options.sbs1 is True:
-    sbs1port = modes_output_sbs1(my_position)
+    sbs1port = modes_output_sbs1()
     outputs.append(sbs1port.output)
-    updates.append(sbs1port.add_pending_conns)
+    updates.append(sbs1port.update)
     
   if options.no_print is not True:
-    outputs.append(modes_output_print(my_position).parse)
+    outputs.append(modes_output_print().output)
+
+  decoder = modes_parse(my_position, ap_filter=not options.output_all) #the one and only decoder, shared by all the outputs
+
+  dfcounts = {} #decoded reports by downlink format, for the benchmark
 
   fg = adsb_rx_block(options, args, queue)
+  start = time.time()
   runner = top_block_runner(fg)
 
   while 1:
@@ -176,9 +258,14 @@ if __name__ == '__main__':
       if queue.empty_p() == 0 :
         while queue.empty_p() == 0 :
           msg = queue.delete_head() #blocking read
+          frame = modes_frame.from_message(msg)
+          report = decoder.decode(frame) #decode once, share with every plugin
+          if report is None: #address/parity frame from an aircraft we haven't heard from
+            continue
+          dfcounts[frame.msgtype] = dfcounts.get(frame.msgtype, 0) + 1
 
           for out in outputs:
-            out(msg.to_string())
+            out(report)
 
       elif runner.done:
         raise KeyboardInterrupt
@@ -186,8 +273,17 @@ if __name__ == '__main__':
         time.sleep(0.1)
 
     except KeyboardInterrupt:
+      elapsed = time.time() - start
+      finished = runner.done
       fg.stop()
       runner = None
-      if options.kml is not None:
+      if kmlgen is not None:
           kmlgen.done = True
+      if sqlport is not None:
+          sqlport.close() #write out whatever's still queued
+      if exporter is not None:
+          exporter.close()
       break
+
+  if options.benchmark:
+    print_benchmark(fg, decoder, options, elapsed, finished, dfcounts, sqlport)